@@ -0,0 +1 @@
+default_app_config = "market.checkout.apps.CheckoutConfig"
@@ -22,15 +22,19 @@ class OrderAdmin(admin.ModelAdmin):
     # change_password_form = AdminPasswordChangeForm
     fields = ['user', 'status',
               ('total', 'subtotal'),
+              ('shipping_total', 'amount_paid'),
               ('modified', 'created'),
               ('billing_address_text', 'shipping_address_text'),
               ]
     list_display = ('uid', 'modified', 'user', 'status', 'total', 'amount_paid')
+    list_select_related = ('user', )
     list_filter = ('status', )
     search_fields = ('user', )
     ordering = ('-created', 'status', 'user')
     readonly_fields = ('billing_address_text',
                        'shipping_address_text',
+                       'shipping_total',
+                       'amount_paid',
                        'created',
                        'modified')
     inlines = [OrderInlineAdmin]
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class CheckoutConfig(AppConfig):
+    """Checkout application - carts, orders and payments."""
+
+    name = "market.checkout"
+    label = "checkout"
+    verbose_name = "Market checkout"
+
+    def ready(self):
+        """Compile cart price modifiers and register background tasks."""
+        from market.checkout import modifiers
+        from market.checkout import tasks  # noqa: register tasks into the queue
+        modifiers.registry.compile()
@@ -1,17 +0,0 @@
-#import calery
-
-
-def send_proforma_to_seller(order_id):
-    print("Sending proforma to seller")
-
-
-def send_proforma_to_buyer(order_id):
-    print("Sending proforma to buyer")
-
-
-def send_invoice_to_seller(order_id):
-    print("Sending invoice to seller")
-
-
-def send_invoice_to_buyer(order_id):
-    print("Sending invoice to buyer")
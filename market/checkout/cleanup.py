@@ -0,0 +1,107 @@
+# coding: utf-8
+"""Garbage collection of abandoned carts and stale orders.
+
+Nobody ever deletes anonymous `Cart`s nor the PROCESSING/CONFIRMING orders that
+`OrderManager.unconfirmed_for_cart` leaves behind when a customer walks away from
+the checkout. The functions here delete them in bounded batches so they can be
+called periodically (see the `cleanup_checkout` management command).
+"""
+import logging
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.deletion import Collector
+from django.utils import timezone
+
+from . import models
+from . import reservations
+
+logger = logging.getLogger(__name__)
+
+CART_EXPIRATION_DAYS = getattr(settings, "MARKET_CART_EXPIRATION_DAYS", 30)
+ORDER_EXPIRATION_DAYS = getattr(settings, "MARKET_ORDER_EXPIRATION_DAYS", 7)
+BATCH_SIZE = 500
+
+
+def keyset(queryset, batch_size=BATCH_SIZE):
+    """Yield lists of primary keys from `queryset` ordered by pk.
+
+    Every batch is a fresh query starting after the last seen pk so no
+    long-running cursor nor OFFSET scan is needed.
+    """
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)
+                             .order_by("pk")
+                             .values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1]
+
+
+def count_deletion(queryset):
+    """Count rows per table which would be deleted together with `queryset`."""
+    collector = Collector(using=queryset.db)
+    collector.collect(queryset)
+    counts = Counter()
+    for model, instances in collector.data.items():
+        counts[model._meta.label] += len(instances)
+    for qs in collector.fast_deletes:
+        counts[qs.model._meta.label] += qs.count()
+    return counts
+
+
+def delete_in_batches(queryset, batch_size=BATCH_SIZE, dry_run=False):
+    """Delete `queryset` (with cascades) in short transactions.
+
+    :returns: Counter of deleted rows per model label
+    """
+    deleted = Counter()
+    for batch in keyset(queryset, batch_size):
+        batch_qs = queryset.model.objects.filter(pk__in=batch)
+        if dry_run:
+            deleted.update(count_deletion(batch_qs))
+            continue
+        with transaction.atomic():
+            deleted.update(batch_qs.delete()[1])
+    return deleted
+
+
+def stale_orders(now=None, days=ORDER_EXPIRATION_DAYS):
+    """Top-orders which never made it past the checkout."""
+    threshold = (now or timezone.now()) - timedelta(days=days)
+    return models.Order.objects.filter(
+        order__isnull=True,
+        status__in=(models.Order.PROCESSING, models.Order.CONFIRMING),
+        modified__lt=threshold)
+
+
+def expired_carts(now=None, days=CART_EXPIRATION_DAYS):
+    """Anonymous carts untouched for `days`."""
+    threshold = (now or timezone.now()) - timedelta(days=days)
+    return models.Cart.objects.filter(user__isnull=True, modified__lt=threshold)
+
+
+def collect_garbage(now=None, cart_days=CART_EXPIRATION_DAYS,
+                    order_days=ORDER_EXPIRATION_DAYS, batch_size=BATCH_SIZE, dry_run=False):
+    """Delete stale orders first and expired carts afterwards.
+
+    Suborders, order items and their extra price fields go away by cascade.
+    Orders are deleted before carts because `Order.cart` would be otherwise
+    nulled one-by-one.
+
+    :returns: Counter of deleted rows per model label
+    """
+    if not dry_run:
+        # return the stock held by abandoned orders before deleting them
+        reservations.release_expired(now)
+    deleted = Counter()
+    deleted.update(delete_in_batches(stale_orders(now, order_days), batch_size, dry_run))
+    deleted.update(delete_in_batches(expired_carts(now, cart_days), batch_size, dry_run))
+    logger.info("Checkout garbage collection %s %s",
+                "would delete" if dry_run else "deleted", dict(deleted))
+    return deleted
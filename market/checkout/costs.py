@@ -0,0 +1,122 @@
+# coding: utf-8
+"""Recomputation of order costs.
+
+Costs of a top-order are the sums of costs of its suborders. Costs of a
+suborder are the sums over its order items plus shipping costs (extra price
+fields marked `is_shipping`). All suborders of many top-orders are computed
+by grouped queries (items are summed over a join with orders, shipping and
+payments separately because joining more relations would multiply the sums)
+and the changed rows are written by one UPDATE.
+
+Denormalized `Order.shipping_total` and `Order.amount_paid` are maintained
+here too - payments of a top-order are its own payments plus payments of
+its suborders.
+"""
+import logging
+
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from market.utils.models import bulk_update
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+ZERO = Decimal('0.00')
+
+Costs = namedtuple("Costs", ("subtotal", "total", "shipping", "paid"))
+STORED = ("subtotal", "total", "shipping_total", "amount_paid")
+
+
+def _top_ids(orders):
+    """Normalize orders (instances, IDs or a queryset) into IDs of their top-orders."""
+    ids = set()
+    for order in orders:
+        if isinstance(order, models.Order):
+            ids.add(order.order_id or order.pk)
+        else:
+            ids.add(order)
+    return sorted(ids)
+
+
+def _grouped_sum(queryset, field):
+    return dict(queryset.order_by().values('order').annotate(sum=Sum(field)).values_list('order', 'sum'))
+
+
+@transaction.atomic
+def _recompute_batch(top_ids, write=True):
+    """Compute costs of the order trees of `top_ids`; return (costs, changes)."""
+    if write:
+        # lock the trees so concurrent payments/shipping changes serialize
+        list(models.Order.objects.select_for_update().filter(pk__in=top_ids).values_list('pk'))
+    tree = Q(order__in=top_ids) | Q(order__order__in=top_ids)
+    rows = (models.Order.objects.filter(Q(pk__in=top_ids) | Q(order__in=top_ids))
+                                .order_by()
+                                .values('pk', 'order', *STORED)
+                                .annotate(items_subtotal=Sum('orderitems__subtotal'),
+                                          items_total=Sum('orderitems__total')))
+    shipping = _grouped_sum(models.ExtraOrderPriceField.objects
+                                                       .filter(is_shipping=True, order__order__in=top_ids),
+                            'value')
+    payments = _grouped_sum(models.OrderPayment.objects.filter(tree), 'amount')
+    costs, current = {}, {}
+    tops = {pk: [ZERO, ZERO, ZERO, ZERO] for pk in top_ids}
+    for row in rows:
+        current[row['pk']] = tuple(row[field] for field in STORED)
+        if row['order'] is None:
+            continue
+        suborder_shipping = shipping.get(row['pk']) or ZERO
+        subtotal = row['items_subtotal'] or ZERO
+        total = (row['items_total'] or ZERO) + suborder_shipping
+        paid = payments.get(row['pk']) or ZERO
+        costs[row['pk']] = Costs(subtotal, total, suborder_shipping, paid)
+        top = tops[row['order']]
+        top[0] += subtotal
+        top[1] += total
+        top[2] += suborder_shipping
+        top[3] += paid
+    for pk, (subtotal, total, top_shipping, paid) in tops.items():
+        if pk in current:
+            costs[pk] = Costs(subtotal, total, top_shipping, paid + (payments.get(pk) or ZERO))
+
+    changes = {}
+    for pk, cost in costs.items():
+        if current[pk] != tuple(cost):
+            changes[pk] = dict(zip(STORED, cost))
+    if write:
+        bulk_update(models.Order, changes)
+    return costs, changes
+
+
+def recompute(orders, batch_size=BATCH_SIZE):
+    """Recompute and store costs of `orders` together with all their suborders.
+
+    :param orders: iterable of Order instances or IDs of top-orders (instances
+                   of suborders are resolved to their tops)
+    :returns: dict {order_id: Costs(subtotal, total, shipping, paid)} of all touched orders
+    """
+    top_ids = _top_ids(orders)
+    costs = {}
+    for i in range(0, len(top_ids), batch_size):
+        costs.update(_recompute_batch(top_ids[i:i + batch_size])[0])
+    return costs
+
+
+def reconcile(batch_size=BATCH_SIZE, repair=False):
+    """Find (and optionally repair) orders whose stored costs drifted.
+
+    :returns: dict {order_id: {field: correct value}} of drifted orders
+    """
+    from market.checkout.cleanup import keyset
+    drift = {}
+    for top_ids in keyset(models.Order.objects.filter(order__isnull=True), batch_size):
+        changes = _recompute_batch(top_ids, write=repair)[1]
+        if changes:
+            logger.warning("Orders %s had drifted costs", sorted(changes))
+        drift.update(changes)
+    return drift
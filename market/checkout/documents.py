@@ -0,0 +1,131 @@
+# coding: utf-8
+"""Content-addressed cache of rendered legal documents (invoices and proformas).
+
+Rendering an invoice into PDF is expensive, so every document is rendered
+once and stored on disk under a fingerprint of its contents::
+
+    MARKET_DOCUMENT_ROOT/<app_label>.<model>-<pk>/<fingerprint>/<filename>
+
+The fingerprint covers the invoice row, rows it points to (addresses, bank
+account) and its items, therefore a changed invoice gets a new fingerprint
+and is rendered again while an unchanged one is never re-rendered. All of it
+is read by one query joining the relations. Renders of older fingerprints of
+the same document are removed when a new one is stored. The fingerprint
+doubles as the ETag of the download response.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_ROOT = getattr(settings, "MARKET_DOCUMENT_ROOT",
+                        os.path.join(settings.MEDIA_ROOT, "documents"))
+MIMETYPE = "application/pdf"
+
+
+def _lookups(invoice):
+    """Return value lookups of everything the rendered document depends on.
+
+    That is the fields of `invoice`, of rows it points to and of rows pointing
+    to it together with the ordering keeping the joined rows stable.
+    """
+    opts = invoice._meta
+    lookups = [field.attname for field in opts.concrete_fields]
+    ordering = []
+    for field in opts.concrete_fields:
+        if field.is_relation:
+            lookups.extend("{}__{}".format(field.name, related.attname)
+                           for related in field.related_model._meta.concrete_fields)
+    for relation in opts.related_objects:
+        if relation.one_to_many:
+            name = relation.field.related_query_name()
+            lookups.extend("{}__{}".format(name, related.attname)
+                           for related in relation.related_model._meta.concrete_fields)
+            ordering.append("{}__pk".format(name))
+    return lookups, ordering
+
+
+def _rows(invoice):
+    """Return everything the rendered document depends on (one query).
+
+    Rows pointing to `invoice` are joined, so every one-to-many relation
+    multiplies the rows - invoices have just their items.
+    """
+    lookups, ordering = _lookups(invoice)
+    return (type(invoice)._default_manager.filter(pk=invoice.pk)
+                                          .order_by(*ordering)
+                                          .values(*lookups))
+
+
+def fingerprint(invoice):
+    """Hash of the contents of `invoice` (one query)."""
+    rows = json.dumps(list(_rows(invoice)), sort_keys=True, default=str)
+    return hashlib.sha1(rows.encode("utf-8")).hexdigest()
+
+
+def _store(directory, filename, content):
+    """Write `content` atomically so readers never see a half written file."""
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp, os.path.join(directory, filename))
+
+
+def _directory(invoice):
+    """Directory holding renders of all fingerprints of `invoice`."""
+    return os.path.join(DOCUMENT_ROOT, "{}-{}".format(invoice._meta.label_lower, invoice.pk))
+
+
+def _purge(parent, keep):
+    """Remove renders of outdated fingerprints in `parent` except `keep`."""
+    for name in os.listdir(parent):
+        if name != keep:
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+
+def render(invoice):
+    """Return (path, fingerprint) of the rendered `invoice`, render it if necessary."""
+    key = fingerprint(invoice)
+    parent = _directory(invoice)
+    directory = os.path.join(parent, key)
+    if os.path.isdir(directory):
+        names = [name for name in os.listdir(directory) if not name.startswith("tmp")]
+        if names:
+            return os.path.join(directory, names[0]), key
+
+    filename, content, mimetype = invoice.export_attachment()
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    filename = os.path.basename(filename)
+    _store(directory, filename, content)
+    _purge(parent, key)
+    logger.info("Rendered document %s into %s", invoice.pk, directory)
+    return os.path.join(directory, filename), key
+
+
+def attachment(invoice):
+    """Return the rendered `invoice` as an email attachment (filename, content, mimetype)."""
+    path, key = render(invoice)
+    with open(path, "rb") as f:
+        return os.path.basename(path), f.read(), MIMETYPE
+
+
+def response(request, invoice):
+    """Stream the rendered `invoice` as a download with its fingerprint as ETag."""
+    path, key = render(invoice)
+    etag = '"{}"'.format(key)
+    if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+        return HttpResponseNotModified()
+    result = FileResponse(open(path, "rb"), content_type=MIMETYPE)
+    result["Content-Length"] = os.path.getsize(path)
+    result["Content-Disposition"] = 'attachment; filename="{}"'.format(os.path.basename(path))
+    result["ETag"] = etag
+    return result
@@ -0,0 +1,102 @@
+# coding: utf-8
+"""Streaming export of order history (one row per order item).
+
+Rows are read in keyset batches over `OrderItem` primary keys (each batch
+is one query, so no long-running cursor is held open) and written
+out immediately so memory stays constant regardless of the number of rows.
+CSV is produced line by line (suitable for `StreamingHttpResponse`), XLSX
+through the write-only mode of openpyxl (optional dependency). XLSX can not
+be streamed - the ZIP container needs a seekable file which is complete
+only after the last row.
+"""
+import csv
+
+from . import models
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+BATCH_SIZE = 2000
+FORMATS = ("csv", "xlsx")
+
+COLUMNS = (
+    ("order__uid", "Order"),
+    ("order__created", "Created"),
+    ("order__status", "Status"),
+    ("order__vendor__name", "Vendor"),
+    ("order__order__user__email", "Customer"),
+    ("item_reference", "Reference"),
+    ("item_name", "Item"),
+    ("unit_price", "Unit price"),
+    ("quantity", "Quantity"),
+    ("subtotal", "Subtotal"),
+    ("total", "Total"),
+)
+STATUS_NAMES = dict(models.Order.STATUS_CODES)
+
+
+def items(vendor=None, status=None, since=None, until=None):
+    """Order items of (sub)orders filtered by vendor, status and [since, until)."""
+    queryset = models.OrderItem.objects.all()
+    if vendor is not None:
+        queryset = queryset.filter(order__vendor=vendor)
+    if status is not None:
+        queryset = queryset.filter(order__status=status)
+    if since is not None:
+        queryset = queryset.filter(order__created__gte=since)
+    if until is not None:
+        queryset = queryset.filter(order__created__lt=until)
+    return queryset
+
+
+def rows(queryset, batch_size=BATCH_SIZE):
+    """Yield the header and then one tuple per order item in batches."""
+    fields = [field for field, title in COLUMNS]
+    status = fields.index("order__status") + 1
+    yield tuple(title for field, title in COLUMNS)
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)
+                             .order_by("pk")
+                             .values_list("pk", *fields)[:batch_size])
+        if not batch:
+            return
+        for row in batch:
+            row = list(row)
+            row[status] = STATUS_NAMES.get(row[status], row[status])
+            yield tuple(row[1:])
+        last_pk = batch[-1][0]
+
+
+class Echo(object):
+    """File-like object returning what is written (for streaming csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """Serialize `rows` into CSV lines one by one."""
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_csv(fileobj, rows):
+    writer = csv.writer(fileobj)
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_xlsx(fileobj, rows):
+    """Write `rows` into XLSX `fileobj` (path or binary file) without holding them in memory."""
+    if openpyxl is None:
+        raise ImportError("XLSX export requires openpyxl")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title="Orders")
+    for row in rows:
+        sheet.append([value.replace(tzinfo=None) if hasattr(value, "tzinfo") else value
+                      for value in row])
+    workbook.save(fileobj)
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""Listing of vendor's orders.
+
+Orders are listed newest first with keyset pagination over (created, pk) -
+the cursor is the position of the last shown order so every page costs the
+same no matter how deep the vendor browses. Filtering by vendor, status and
+a date range is backed by the (vendor, status, created) index of `Order`.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import models
+
+PAGE_SIZE = 30
+
+Page = namedtuple("Page", ("object_list", "cursor"))
+
+
+def date_range(since=None, until=None):
+    """Parse YYYY-MM-DD `since` and `until` into a half-open datetime range.
+
+    The `until` day is included. Missing bounds are None.
+    :raises ValueError: for invalid dates
+    """
+    def start_of(day):
+        moment = datetime.combine(day, time.min)
+        return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+    since = parse_date(since or "")
+    until = parse_date(until or "")
+    return (start_of(since) if since else None,
+            start_of(until + timedelta(days=1)) if until else None)
+
+
+def orders(vendor, since=None, until=None):
+    """Vendor's orders optionally limited to a date range [since, until)."""
+    queryset = models.Order.objects.filter(vendor=vendor)
+    if since is not None:
+        queryset = queryset.filter(created__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created__lt=until)
+    return queryset
+
+
+def status_counts(vendor, since=None, until=None):
+    """Return {status: count} of vendor's orders by one grouped query."""
+    return dict(orders(vendor, since, until).order_by()
+                                            .values("status")
+                                            .annotate(count=Count("pk"))
+                                            .values_list("status", "count"))
+
+
+def encode_cursor(order):
+    return "{}_{}".format(order.created.isoformat(), order.pk)
+
+
+def decode_cursor(cursor):
+    """Return (created, pk) from a cursor or raise ValueError."""
+    created, pk = cursor.rsplit("_", 1)
+    created = parse_datetime(created)
+    if created is None:
+        raise ValueError("Invalid cursor")
+    return created, int(pk)
+
+
+def page(vendor, status, cursor=None, since=None, until=None, size=PAGE_SIZE):
+    """One page of vendor's orders in `status` following the `cursor`.
+
+    :returns: Page(object_list, cursor) where cursor is None on the last page
+    """
+    queryset = (orders(vendor, since, until).filter(status=status)
+                                            .select_related("user", "order__user")
+                                            .prefetch_related("orderitems__item")
+                                            .order_by("-created", "-pk"))
+    if cursor:
+        created, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, pk__lt=pk))
+    object_list = list(queryset[:size + 1])
+    if len(object_list) > size:
+        object_list = object_list[:size]
+        return Page(object_list, encode_cursor(object_list[-1]))
+    return Page(object_list, None)
@@ -0,0 +1,29 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from market.checkout import cleanup
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned anonymous carts and orders stuck in the checkout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cart-days', type=int, default=cleanup.CART_EXPIRATION_DAYS,
+                            help='Delete anonymous carts untouched for this many days')
+        parser.add_argument('--order-days', type=int, default=cleanup.ORDER_EXPIRATION_DAYS,
+                            help='Delete unfinished orders untouched for this many days')
+        parser.add_argument('--batch-size', type=int, default=cleanup.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only count rows which would be deleted')
+
+    def handle(self, *args, **options):
+        deleted = cleanup.collect_garbage(
+            cart_days=options['cart_days'],
+            order_days=options['order_days'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        for label, count in sorted(deleted.items()):
+            self.stdout.write("{} {:d} rows from {}".format(verb, count, label))
+        if not deleted:
+            self.stdout.write("Nothing to delete")
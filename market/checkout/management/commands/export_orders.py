@@ -0,0 +1,46 @@
+# coding: utf-8
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.checkout import export, listing
+from market.checkout.models import Order
+from market.core.models import Vendor
+
+
+class Command(BaseCommand):
+    help = 'Export order items (for accounting) into CSV or XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor', help='UID of the vendor (all vendors by default)')
+        parser.add_argument('--status', choices=[name.lower() for name, value in vars(Order).items()
+                                                 if name.isupper() and value in Order.STATUSES])
+        parser.add_argument('--since', help='First day (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--output', help='Output file (stdout for CSV by default)')
+        parser.add_argument('--batch-size', type=int, default=export.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        vendor = None
+        if options['vendor']:
+            vendor = Vendor.objects.filter(uid=options['vendor']).first()
+            if vendor is None:
+                raise CommandError("Vendor {} does not exist".format(options['vendor']))
+        try:
+            since, until = listing.date_range(options['since'], options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        status = getattr(Order, options['status'].upper()) if options['status'] else None
+        rows = export.rows(export.items(vendor=vendor, status=status, since=since, until=until),
+                           batch_size=options['batch_size'])
+
+        if options['format'] == 'xlsx':
+            if not options['output']:
+                raise CommandError("XLSX export needs --output")
+            export.write_xlsx(options['output'], rows)
+        elif options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                export.write_csv(f, rows)
+        else:
+            export.write_csv(sys.stdout, rows)
@@ -0,0 +1,21 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from market.checkout import costs
+from market.checkout.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute subtotals and totals of orders (e.g. after a tax fix)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('uids', nargs='*', help='UIDs of orders (all orders by default)')
+        parser.add_argument('--batch-size', type=int, default=costs.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.filter(order__isnull=True)
+        if options['uids']:
+            orders = orders.filter(uid__in=options['uids'])
+        recomputed = costs.recompute(orders.values_list('pk', flat=True).iterator(),
+                                     batch_size=options['batch_size'])
+        self.stdout.write("Recomputed costs of {:d} orders".format(len(recomputed)))
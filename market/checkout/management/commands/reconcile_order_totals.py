@@ -0,0 +1,21 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from market.checkout import costs
+
+
+class Command(BaseCommand):
+    help = 'Verify (and with --repair fix) stored totals, shipping and payments of orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', default=False,
+                            help='Store the correct values')
+        parser.add_argument('--batch-size', type=int, default=costs.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        drift = costs.reconcile(batch_size=options['batch_size'], repair=options['repair'])
+        for pk, values in sorted(drift.items()):
+            self.stdout.write("Order {:d}: {}".format(
+                pk, ", ".join("{}={}".format(field, value) for field, value in sorted(values.items()))))
+        verb = "Repaired" if options['repair'] else "Found"
+        self.stdout.write("{} {:d} drifted orders".format(verb, len(drift)))
@@ -0,0 +1,12 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from market.checkout import reservations
+
+
+class Command(BaseCommand):
+    help = 'Return stock held by unfinished orders for longer than MARKET_RESERVATION_TTL'
+
+    def handle(self, *args, **options):
+        released = reservations.release_expired()
+        self.stdout.write("Released {:d} reservations".format(released))
@@ -0,0 +1,22 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from market.checkout import queue
+
+
+class Command(BaseCommand):
+    help = 'Run the background task worker (emails, legal documents, statistics)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=queue.CONCURRENCY,
+                            help='Number of tasks executed in parallel')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Exit when the queue is empty instead of polling')
+        parser.add_argument('--poll', type=float, default=queue.POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        succeeded, failed = queue.work(concurrency=options['concurrency'],
+                                       once=options['once'],
+                                       poll=options['poll'])
+        self.stdout.write("Finished {:d} tasks, {:d} failed".format(succeeded, failed))
@@ -18,93 +18,102 @@ class OrderManager(models.Manager):
 
     @transaction.atomic
     def create_from_cart(self, cart, request, status=None):
-        """Create suborders to the top-order.
-
-        If the creation of suborders fails, delete the original order.
-        """
         """Create atomically a new Order form Cart.
 
-        Specifically, it creates an Order with corresponding OrderItems and
-        eventually corresponding ExtraPriceFields
+        Specifically, it creates a top-order with one suborder per vendor,
+        corresponding OrderItems and eventually corresponding ExtraPriceFields.
+        Lines are grouped by vendor in memory and every table is written by one
+        bulk insert; costs are computed from the in-memory lines thus no
+        `update_costs` is necessary.
 
-        This will only actually commit the transaction once the function exits
-        to minimize useless database access.
+        The `request` parameter is further passed to the cart price modifiers,
+        so it can be used as a way to store per-request arbitrary information.
 
-        The `request` parameter is further passed to cart_item_process,
-        cart_pre_process, and cart_post_process, so it can be used as a way to
-        store per-request arbitrary information.
+        Stock of the ordered offers gets reserved for the order. In case some
+        offer is sold out `reservations.SoldOut` is raised and nothing is created.
 
         Emits the ``processing`` signal.
         """
         from . import models
-
-        def apply(func, seq, *args):
-            for data in seq:
-                func(*(args + data))
-
-        def serialize_order_extra(order, label, price, *data):
-            """Serialize cart's extra price fields into database together with Order."""
-            models.ExtraOrderPriceField(
-                order=order,
-                label=str(label),
-                value=price if isinstance(price, Decimal) else Decimal(price),
-                data=None if not data else data[0]
-            ).save()
-
-        def serialize_order_item_extras(order_item, label, price, *data):
-            """Serialize cart_item's extra price fields into database together with OrderItem."""
-            models.ExtraOrderItemPriceField(
-                order_item=order_item,
-                label=str(label),
-                value=price if isinstance(price, Decimal) else Decimal(price),
-                data=None if not data else data[0]
-            ).save()
-
-        # trigger all signals and updates
+        from . import reservations
+        from market.utils.models import assign_uids, bulk_create
+
+        def serialize_extras(model, fields, **owner):
+            """Serialize (cart's or cart_item's) extra price fields into database models."""
+            return [model(label=str(label),
+                          value=price if isinstance(price, Decimal) else Decimal(price),
+                          data=None if not data else data[0],
+                          **owner)
+                    for label, price, *data in fields]
+
+        # trigger all modifiers and updates
         cart.update(request)
+        groups = cart.items_by_vendor()
 
-        # First, let's remove old orders
-        self.unconfirmed_for_cart(cart).delete()
+        # First, let's remove old orders (and return the stock they held)
+        old_orders = self.unconfirmed_for_cart(cart)
+        reservations.release(old_orders)
+        old_orders.delete()
 
-        # Create an empty order object
+        status = status or self.model.PROCESSING
         order = self.model(
             user=cart.user,
             vendor=None,
             cart=cart,
-            status=status or self.model.PROCESSING,
-            subtotal=cart.subtotal,
-            total=cart.total,
+            status=status,
+            subtotal=sum((group['subtotal'] for group in groups), Decimal('0.00')),
+            total=sum((group['total'] for group in groups), Decimal('0.00')),
         )
-        suborders = {}
-        order.save()
-        apply(serialize_order_extra, cart.extra_price_fields, order)
-
-        for cart_item in cart.updated_items:
-            suborder = suborders.setdefault(
-                cart_item.item.vendor.id,
-                self.create(
-                    user=None,
-                    vendor=cart_item.item.vendor,
-                    order=order,
-                    status=order.status))
-            order_item = models.OrderItem(
-                order=suborder,
-                item_reference=cart_item.item.slug,
-                item_name=cart_item.item.name,
-                item=cart_item.item,
-                unit_price=cart_item.item.unit_price,
-                quantity=cart_item.quantity,
-                total=cart_item.total,
-                subtotal=cart_item.subtotal)
-            order_item.save()
-            # For each order item, we save the extra_price_fields to DB
-            apply(serialize_order_item_extras, cart_item.extra_price_fields, order_item)
-
-        # update orders prices
-        order.update_costs()
+        bulk_create(self.model, [order])
+
+        suborders = [self.model(user=None, vendor=group['vendor'], order=order, status=status,
+                                subtotal=group['subtotal'], total=group['total'])
+                     for group in groups]
+        bulk_create(self.model, suborders)
+
+        lines = []
+        quantities = {}
+        for suborder, group in zip(suborders, groups):
+            for cart_item in group['items']:
+                lines.append((cart_item, models.OrderItem(
+                    order=suborder,
+                    item_reference=cart_item.item.slug,
+                    item_name=cart_item.item.name,
+                    item=cart_item.item,
+                    unit_price=cart_item.item.unit_price,
+                    quantity=cart_item.quantity,
+                    total=cart_item.total,
+                    subtotal=cart_item.subtotal)))
+                quantities[cart_item.item] = quantities.get(cart_item.item, 0) + cart_item.quantity
+
+        if any(cart_item.extra_price_fields for cart_item, order_item in lines):
+            # we need IDs of order items for their extra price fields
+            bulk_create(models.OrderItem, [order_item for cart_item, order_item in lines])
+            models.ExtraOrderItemPriceField.objects.bulk_create([
+                extra
+                for cart_item, order_item in lines
+                for extra in serialize_extras(models.ExtraOrderItemPriceField,
+                                              cart_item.extra_price_fields,
+                                              order_item=order_item)])
+        else:
+            models.OrderItem.objects.bulk_create([order_item for cart_item, order_item in lines])
+
+        if cart.extra_price_fields:
+            models.ExtraOrderPriceField.objects.bulk_create(
+                serialize_extras(models.ExtraOrderPriceField, cart.extra_price_fields, order=order))
+
+        # hold the stock for this order - raises reservations.SoldOut
+        reservations.reserve(order, quantities)
+
+        assign_uids([order] + suborders)
         signals.order_processing.send(self.model, order=order, cart=cart)
         return order
 
     def unconfirmed_for_cart(self, cart):
-        """Get all unconfirmed orders for current cart."""
-        return self.filter(cart=cart, status__lt=self.model.CONFIRMED)
+        """Get all unfinished orders for current cart.
+
+        Only PROCESSING and CONFIRMING orders are returned - those still hold
+        their stock by reservations. UNCONFIRMED orders have their stock secured
+        already and wait only for the customer to verify their email.
+        """
+        return self.filter(cart=cart, status__lt=self.model.UNCONFIRMED)
@@ -1,11 +1,11 @@
 # coding:utf-8
-import dbmail
 import logging
+from collections import OrderedDict
 from decimal import Decimal
 
 from django.conf import settings
 from django.db import transaction, models
-from django.db.models import Sum, Max
+from django.db.models import Max
 from django.dispatch import receiver
 from django.utils.translation import ugettext as _
 
@@ -17,6 +17,7 @@ from django.utils.functional import cached_property
 from market.utils.models import UidMixin
 from market.checkout import signals
 from market.checkout import managers
+from market.checkout import modifiers
 
 from . import serializers
 
@@ -150,6 +151,20 @@ class OrderPayment(models.Model):
         verbose_name_plural = _('Order payments')
 
 
+class Reservation(models.Model):
+    """Stock of an `Offer` held for an unfinished `Order` (see `checkout.reservations`)."""
+    offer = models.ForeignKey('market.Offer', related_name='reservations', verbose_name=_('Offer'))
+    order = models.ForeignKey('market.Order', related_name='reservations', verbose_name=_('Order'))
+    quantity = models.PositiveIntegerField(verbose_name=_('Quantity'))
+    expires = models.DateTimeField(db_index=True, verbose_name=_('Expires'))
+
+    class Meta(object):
+        """Explicitely mark the app_label."""
+        app_label = "market"
+        verbose_name = _('Reservation')
+        verbose_name_plural = _('Reservations')
+
+
 class Cart(models.Model):
     """Vendorping `Cart` handling `Offer`s from multiple vendors."""
     user = models.OneToOneField(settings.AUTH_USER_MODEL, swappable=True,
@@ -230,6 +245,7 @@ class Cart(models.Model):
             return self.update_quantity(cart_item.id, cart_item.quantity + int(quantity))
 
         cart_item = CartItem.objects.create(cart=self, quantity=quantity, item=item)
+        self.updated_items = None  # the cart changed - it has to be updated again
         return cart_item
 
     def update_quantity(self, cart_item_id, quantity):
@@ -239,6 +255,7 @@ class Cart(models.Model):
         cart_item = self.items.get(pk=cart_item_id)
         cart_item.quantity = quantity
         cart_item.save()
+        self.updated_items = None
         self.save()
         return cart_item
 
@@ -250,6 +267,7 @@ class Cart(models.Model):
         """
         cart_item = self.items.get(pk=cart_item_id)
         cart_item.delete()
+        self.updated_items = None
         self.save()
 
     def get_updated_cart_items(self):
@@ -272,24 +290,30 @@ class Cart(models.Model):
         that for the order items (since they are legally binding after the
         "purchase" button was pressed)
         """
+        pipeline = modifiers.registry.pipeline
         self.extra_price_fields = []  # Reset the price fields
         self.subtotal = Decimal('0.0')  # Reset subtotal
         self.total = Decimal('0.0')  # Reset total
 
-        # This calls all the cart_pre_process methods (if any), before the cart
+        # This calls all the pre_process modifiers (if any), before the cart
         # is processed. This allows for data collection on the cart for
         # example)
-        signals.cart_pre_process.send(
-            sender=self.__class__, cart=self, request=request)
+        for modifier in pipeline.pre:
+            modifier(self, request)
 
-        self.updated_items = self.items.all()
+        self.updated_items = list(self.get_items())
+        for item in self.updated_items:
+            item.reset()
+        for modifier in pipeline.items:
+            modifier(self, self.updated_items, request)
         for item in self.updated_items:
-            item.update(request)
+            item.finalize()
+        self.subtotal = sum((item.subtotal for item in self.updated_items), Decimal('0.0'))
         self.total += sum(item.total for item in self.updated_items)
 
         self.current_total = self.total
-        signals.cart_post_process.send(
-            sender=self.__class__, cart=self, request=request)
+        for modifier in pipeline.post:
+            modifier(self, request)
 
         # in case modifiers got too wild and put negative price - round it back
         if self.current_total < 0:
@@ -298,8 +322,29 @@ class Cart(models.Model):
         self.total = self.current_total
         return self.total
 
+    @transaction.atomic
+    def merge(self, other):
+        """Move all lines from `other` cart into this one and delete `other`.
+
+        Lines with the same offer get their quantities summed up.
+        """
+        lines = {line.item_id: line for line in self.items.select_for_update()}
+        moved = []
+        for line in other.items.all():
+            if line.item_id in lines:
+                lines[line.item_id].quantity += line.quantity
+                lines[line.item_id].save(update_fields=['quantity'])
+            else:
+                moved.append(line.pk)
+        if moved:
+            other.items.filter(pk__in=moved).update(cart=self)
+        other.delete()
+        self.updated_items = None
+        self.save()
+
     def empty(self):
         """Remove all cart items."""
+        self.updated_items = None
         if self.pk:
             self.items.all().delete()
             self.delete()
@@ -317,29 +362,48 @@ class Cart(models.Model):
     def __str__(self):
         return _("Cart for") + " " + str(self.user)
 
+    def get_items(self):
+        """Cart items with their offers, vendors and products fetched in one query."""
+        return (self.items.select_related('item', 'item__vendor', 'item__vendor__address',
+                                          'item__product')
+                          .order_by('item__vendor', 'pk'))
+
     @property
     def vendors(self):
-        """List of vendors participating on this cart."""
-        return self.items.distinct("product__vendor").values_list("product__vendor", flat=True)
+        """List of IDs of vendors participating on this cart."""
+        return (self.items.order_by()
+                          .values_list("item__vendor", flat=True)
+                          .distinct())
 
     def items_by_vendor(self):
         """Group items together by vendor.
 
-        :returns: list of dicts{"vendor": <vendor-instance>, "items": [<item-instance>...]}
+        Uses items from the last :meth:`update` (thus with price modifiers applied)
+        or fetches them in one query. Subtotals, totals and shipping estimates
+        (the most expensive shipping of vendor's offers) are computed in memory.
+
+        :returns: list of dicts{"vendor": <vendor-instance>, "items": [<item-instance>...],
+                                "subtotal": Decimal, "total": Decimal, "shipping": Decimal}
         """
-        result = []
-        cache = {}
-        vendor = None
-        for item in self.items.all().order_by("product__vendor"):
-            if item.product.vendor != vendor:
-                if cache:
-                    result.append(cache)
-                cache = {'vendor': item.product.vendor, 'items': []}
-                vendor = item.product.vendor
-            cache['items'].append(item)
-        if cache:
-            result.append(cache)
-        return result
+        updated = self.updated_items is not None
+        items = self.updated_items if updated else self.get_items()
+        groups = OrderedDict()
+        for item in items:
+            offer = item.item
+            group = groups.get(offer.vendor_id)
+            if group is None:
+                group = groups[offer.vendor_id] = {
+                    'vendor': offer.vendor,
+                    'items': [],
+                    'subtotal': Decimal('0.0'),
+                    'total': Decimal('0.0'),
+                    'shipping': Decimal('0.0'),
+                }
+            group['items'].append(item)
+            group['subtotal'] += offer.unit_price * item.quantity
+            group['total'] += item.total if updated else offer.price * item.quantity
+            group['shipping'] = max(group['shipping'], offer.shipping_price or Decimal('0.0'))
+        return list(groups.values())
 
 
 class CartItem(models.Model):
@@ -373,25 +437,32 @@ class CartItem(models.Model):
         self.extra_price_fields.append((label, value))
         self.current_total += value
 
-    def update(self, request):
-        """Give apps the chance to modify single cart items."""
+    def reset(self):
+        """Compute base prices before price modifiers are applied."""
         self.extra_price_fields = []  # Reset the price fields
         self.subtotal = self.item.unit_price * self.quantity
         self.total = self.item.price * self.quantity
-
-        # backup ``total`` into ``current_total`` because receivers will modify it
+        # backup ``total`` into ``current_total`` because modifiers will modify it
         self.current_total = self.total
-        # We now loop over every registered price modifier,
-        # most of them will simply add a field to extra_payment_fields
-        signals.cart_item_process.send_robust(
-            sender=self.__class__, cart_item=self, request=request)
 
+    def finalize(self):
+        """Fix the total after all price modifiers were applied."""
         if self.current_total < 0:
             self.add_modifier(_("Automatic rounding to 0"), abs(self.current_total))
 
         self.total = self.current_total
         return self.total
 
+    def update(self, request):
+        """Give apps the chance to modify single cart items.
+
+        `Cart.update` processes all items at once - this is for a standalone item.
+        """
+        self.reset()
+        for modifier in modifiers.registry.pipeline.items:
+            modifier(self.cart, [self], request)
+        return self.finalize()
+
 
 class OrderItem(models.Model):
     """A line Item for an order."""
@@ -418,7 +489,8 @@ class OrderItem(models.Model):
     def save(self, *args, **kwargs):
         """Copy the name from referenced item."""
         if not self.item_name and self.item:
-            self.item_name = self.item.get_name()
+            self.item_name = self.item.name
+        return super(OrderItem, self).save(*args, **kwargs)
 
 
 class Order(UidMixin, models.Model):
@@ -481,6 +553,9 @@ class Order(UidMixin, models.Model):
     status = models.IntegerField(choices=STATUS_CODES, default=PROCESSING, verbose_name=_('Status'))
     subtotal = utils.CurrencyField(verbose_name=_('Order subtotal'))
     total = utils.CurrencyField(verbose_name=_('Order Total'))
+    # denormalized sums maintained by `checkout.costs`
+    shipping_total = utils.CurrencyField(verbose_name=_('Shipping total'))
+    amount_paid = utils.CurrencyField(verbose_name=_('Amount paid'))
 
     shipping_address_text = models.TextField(_('Shipping address'), blank=True, null=True)
     shipping = models.BooleanField(default=False, blank=True,
@@ -501,6 +576,7 @@ class Order(UidMixin, models.Model):
         """Explicitely mark the app_label and concrete model."""
         app_label = 'market'
         ordering = ['status', 'created']
+        index_together = (('vendor', 'status', 'created'), )
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
 
@@ -544,26 +620,37 @@ class Order(UidMixin, models.Model):
         return dict(self.STATUS_CODES)[self.status]
 
     def mark_as(self, status, save=True):
-        """The only way of changing the state of the order and it's suborders."""
+        """The only way of changing the state of the order and it's suborders.
+
+        Suborders with lower status follow their top-order. Signals are sent
+        after the transaction commits (see `checkout.transitions`).
+
+        With `save=False` nothing is written - the status of the order and of
+        its (freshly loaded) suborders is changed in memory only and the status
+        signals are sent right away.
+        """
         if status not in self.STATUSES:
             raise KeyError("Status not listed in Order.STATUS_CODES")
-        self.status = status
-        if save:
-            self.save()
-        if status in self.STATUS_TO_SIGNALS.keys():
-            self.STATUS_TO_SIGNALS[status].send(self.__class__, order=self)
-        if self.is_suborder():
+        if not save:
+            self.status = status
+            signal = self.STATUS_TO_SIGNALS.get(status)
+            if signal is not None:
+                signal.send(self.__class__, order=self)
+            if not self.is_suborder():
+                for suborder in self.suborders.filter(status__lt=status):
+                    suborder.mark_as(status, save=False)
             return self
-        lowstatus_suborders = self.suborders.filter(status__lt=status)
-        if lowstatus_suborders.exists():
-            for suborder in lowstatus_suborders:
-                suborder.mark_as(status, save)
+        from market.checkout import transitions
+        transitions.transition([self], status)
         return self
 
     def mark_as_confirming(self, save=True):
         self.mark_as(self.CONFIRMING, save)
 
     def mark_as_unconfirmed(self, save=True):
+        """Mark as confirmed by an unverified user - a confirmed order stays confirmed."""
+        if self.UNCONFIRMED < self.status < self.CANCELED:
+            return
         self.mark_as(self.UNCONFIRMED, save)
 
     def mark_as_confirmed(self, save=True):
@@ -585,16 +672,8 @@ class Order(UidMixin, models.Model):
     def mark_as_canceled(self, save=True):
         self.mark_as(self.CANCELED, save)
 
-    @property
-    def amount_paid(self):
-        """The amount paid is the sum of related orderpayments."""
-        q = OrderPayment.objects.all()
-        q = q.filter(order=self) if self.is_suborder else q.filter(order__in=self.suborders.all())
-        return q.aggregate(sum=Sum('amount')).get('sum') or Decimal('0.00')
-
     def add_shipping_costs(self, name, amount):
         """Create ExtraOrderPriceField with shipping costs for this order."""
-        from vendor.models import ExtraOrderPriceField
         if isinstance(amount, float):
             value = Decimal("%.2f".format(amount))
         else:
@@ -608,36 +687,19 @@ class Order(UidMixin, models.Model):
 
     @property
     def shipping_costs(self):
-        """Compute shipping costs of the whole order (readonly)."""
-        q = ExtraOrderPriceField.objects.filter(is_shipping=True)
-        q = q.filter(order=self) if self.is_suborder() else q.filter(order__in=self.suborders.all())
-        return q.aggregate(sum=Sum('value')).get('sum') or Decimal(0)
+        """Shipping costs of the whole order (readonly)."""
+        return self.shipping_total
 
     def update_costs(self):
-        """Update all costs in case shipping or other things has changed."""
-        if not self.is_suborder():
-            self.subtotal = Decimal('0.00')
-            self.total = Decimal('0.00')
-            for suborder in self.suborders.all():
-                suborder.update_costs()
-                self.subtotal += suborder.subtotal
-                self.total += suborder.total
-            self.save()
-            return
+        """Update all costs in case shipping or other things has changed.
 
-        prev_subtotal = self.subtotal or Decimal('0.00')
-        self.subtotal = (
-            self.orderitems.all().aggregate(subtotal=Sum("subtotal"))["subtotal"]
-        ) or Decimal('0.00')
-
-        prev_total = self.total or Decimal('0.00')
-        self.total = (
-            self.orderitems.all().aggregate(total=Sum("total"))["total"] or Decimal('0.00') +
-            self.shipping_costs
-        )
-
-        if prev_subtotal != self.subtotal or prev_total != self.total:
-            self.save()
+        The whole order tree (top-order and all suborders) is recomputed at
+        once by `checkout.costs`.
+        """
+        from market.checkout import costs
+        cost = costs.recompute([self])[self.pk]
+        self.subtotal, self.total = cost.subtotal, cost.total
+        self.shipping_total, self.amount_paid = cost.shipping, cost.paid
 
     @property
     def short_name(self):
@@ -747,19 +809,108 @@ class Order(UidMixin, models.Model):
             self.save()
 
 
+class OrderTransition(models.Model):
+    """Log of status changes of an order (see `checkout.transitions`)."""
+    order = models.ForeignKey('market.Order', on_delete=models.CASCADE, related_name='transitions',
+                              verbose_name=_('Order'))
+    old_status = models.IntegerField(choices=Order.STATUS_CODES, verbose_name=_('Old status'))
+    new_status = models.IntegerField(choices=Order.STATUS_CODES, verbose_name=_('New status'))
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
+                             on_delete=models.SET_NULL, verbose_name=_('User'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('Created'))
+
+    class Meta(object):
+        """Explicitely mark the app_label."""
+        app_label = "market"
+        verbose_name = _('Order transition')
+        verbose_name_plural = _('Order transitions')
+
+
+class Task(models.Model):
+    """A durable unit of background work (see `checkout.queue`)."""
+
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+
+    STATUS_CODES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    name = models.CharField(max_length=255, verbose_name=_('Task'))
+    args = jsonfield.JSONField(null=True, blank=True, verbose_name=_('Arguments'))
+    key = models.CharField(max_length=255, unique=True, null=True, blank=True,
+                           verbose_name=_('Idempotency key'))
+    status = models.IntegerField(choices=STATUS_CODES, default=PENDING, verbose_name=_('Status'))
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_('Attempts'))
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name=_('Maximal attempts'))
+    run_at = models.DateTimeField(db_index=True, verbose_name=_('Run at'))
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Locked at'))
+    error = models.TextField(blank=True, verbose_name=_('Last error'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('Created'))
+    modified = models.DateTimeField(auto_now=True, verbose_name=_('Updated'))
+
+    class Meta(object):
+        """Explicitely mark the app_label."""
+        app_label = "market"
+        index_together = (('status', 'run_at'), )
+        verbose_name = _('Task')
+        verbose_name_plural = _('Tasks')
+
+    def __str__(self):
+        return "{0.name}({0.args}) [{0.status}]".format(self)
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=OrderPayment)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=ExtraOrderPriceField)
+def order_totals_changed(sender, instance, **kwargs):
+    """Keep denormalized `amount_paid` and `shipping_total` of the order tree in sync.
+
+    Every order tree is recomputed once when the transaction commits no matter
+    how many of its rows changed. Trees deleted in the meantime (e.g. payments
+    deleted together with their order) are skipped. Being connected, this
+    receiver makes deletion of orders load their payments and price fields
+    instead of fast-deleting them.
+    """
+    if sender is ExtraOrderPriceField and not instance.is_shipping:
+        return
+    utils.on_commit_once(recompute_order_totals, [instance.order_id])
+
+
+def recompute_order_totals(order_ids):
+    """Recompute costs of the order trees of existing `order_ids`."""
+    from market.checkout import costs
+    orders = list(Order.objects.only('pk', 'order').filter(pk__in=order_ids))
+    if orders:
+        costs.recompute(orders)
+
+
+@receiver(signals.orders_transitioned)
+def orders_transitioned_dashboard(sender, orders, status, **kwargs):
+    """Drop cached dashboards of vendors whose orders changed status."""
+    from market.core import dashboard
+    dashboard.invalidate(*set(order.vendor_id for order in orders))
+
+
+@receiver(signals.order_processing)
+def order_processing_dashboard(sender, order, **kwargs):
+    """New (sub)orders appear in the dashboards of their vendors."""
+    from market.core import dashboard
+    dashboard.invalidate(*set(order.suborders.values_list("vendor", flat=True)))
+
+
 @receiver(signals.order_shipped)
 def order_shipped_mailer(sender, order, **kwargs):
-    """Email customer about shipped order."""
+    """Email customer about shipped order (in the background)."""
     if not order.is_suborder():
         return
-    customer = order.order.user
-    seller = order.vendor.user
-    context = {"order": order,
-               "vendor": order.vendor,
-               "customer": customer,
-               "seller": seller}
-    dbmail.send_db_mail('checkout-shipped-customer', customer.email, context,
-                        reply_to=[seller.email, ])
+    from market.checkout import queue, tasks
+    queue.enqueue_on_commit(tasks.send_shipped_mail, order.pk,
+                            key="order-shipped:{}".format(order.pk))
 
 
 @receiver([signals.order_completed, signals.order_shipped, signals.order_confirmed])
@@ -806,65 +957,30 @@ def order_completed_mailer(sender, order, **kwargs):
     Complete means a payment for the order has arrived.
 
     This hook sends emails to users about a payment with an according invoice.
-    The invoice is ALWAYS created as an user-vendor relation (thus only in suborders)
+    The invoice is ALWAYS created as an user-vendor relation (thus only in suborders).
+    Documents are rendered and mails sent by `checkout.tasks.send_status_mails`.
     """
     if not order.is_suborder():
         return
+    from market.checkout import queue, tasks
+    queue.enqueue_on_commit(tasks.send_status_mails, order.pk, order.status,
+                            key="order-mails:{}:{}".format(order.pk, order.status))
 
-    order.create_legal_documents()
-
-    seller = order.vendor
-    customer = order.order.user
-
-    context = {"order": order,
-               "seller": seller.user,
-               "customer": customer,
-               "vendor": seller}
-
-    if kwargs['signal'] == signals.order_unconfirmed:
-        # send confirmation link for their order
-        dbmail.send_db_mail('checkout-unconfirmed-customer',
-                            customer.email, context)
-
-    if kwargs['signal'] == signals.order_confirmed and order.pay_on_delivery():
-        # send a proforma to the user
-        dbmail.send_db_mail('checkout-confirmed-customer', customer.email, context,
-                            reply_to=[seller.user.email, ],
-                            attachments=[order.proforma.export_attachment(), ])
-        # send an invoice to the seller
-        dbmail.send_db_mail('checkout-confirmed-vendor', seller.user.email, context,
-                            reply_to=[customer.email, ],
-                            attachments=[order.invoice.export_attachment(), ])
-
-    if kwargs['signal'] == signals.order_completed:
-        # send a proforma to the user
-        dbmail.send_db_mail('checkout-completed-customer', customer.email, context,
-                            reply_to=[seller.user.email, ],
-                            attachments=[order.invoice.export_attachment(), ])
-        # send an invoice to the seller so they are ready if/when customer steps in
-        dbmail.send_db_mail('checkout-completed-vendor', seller.user.email, context,
-                            reply_to=[customer.email, ],
-                            attachments=[order.invoice.export_attachment(), ])
-
-
-@receiver(signals.order_completed)
-def order_completed_offer_update(sender, order, **kwargs):
-    """Completed means a payment for the order has arrived."""
-    for item in order.item_set:
-        if item.product.quantity > 0:
-            item.product.quantity -= item.quantity
-            if item.product.quantity < 0:
-                item.product.quantity = 0
-            item.product.save()
+
+@receiver(signals.order_cancelled)
+def order_cancelled_reservations(sender, order, **kwargs):
+    """Return reserved stock of a canceled order back to the offers."""
+    if order.order_id is not None:
+        return
+    from market.checkout import reservations
+    reservations.release(order)
 
 
 @receiver(signals.order_confirmed)
 def order_completed_statistics(sender, order, **kwargs):
-    """Update products statistics after order was placed on them."""
-    for item in order.item_set:
-        offer = item.product
-        product = offer.product
-        offer.sold += item.quantity
-        offer.save()
-        product.sold += item.quantity
-        product.save()
+    """Update products statistics after order was placed on them (in the background)."""
+    if not order.is_suborder():
+        return
+    from market.checkout import queue, tasks
+    queue.enqueue_on_commit(tasks.update_statistics, order.pk,
+                            key="order-statistics:{}".format(order.pk))
@@ -0,0 +1,171 @@
+# coding: utf-8
+"""Cart price modifiers.
+
+A modifier is an object with any of the following hooks
+
+    pre_process(cart, request)
+        called before the items are priced (e.g. remove unavailable items)
+    process_items(cart, items, request)
+        called once with all the cart items (batch-aware modifiers)
+    process_item(cart_item, request)
+        called per cart item when the modifier is not batch-aware
+    post_process(cart, request)
+        called when totals of all items are available (ideal for discounts)
+
+Modifiers change prices via `cart.add_modifier` / `cart_item.add_modifier`.
+
+Modifiers are registered into :data:`registry` with an `order` and the registry
+compiles them (once at startup) into a flat list of callables per stage so the
+`Cart.update` does not resolve receivers nor allocate anything per call. The
+old `cart_pre_process`, `cart_item_process` and `cart_post_process` signals keep
+working through :class:`SignalModifier`.
+"""
+import logging
+import time
+
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+
+from . import signals
+
+logger = logging.getLogger(__name__)
+
+Pipeline = namedtuple("Pipeline", ("pre", "items", "post"))
+
+
+class Modifier(object):
+    """Base class for price modifiers - override only the hooks you need."""
+
+    order = 100
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def pre_process(self, cart, request):
+        pass
+
+    def process_items(self, cart, items, request):
+        pass
+
+    def process_item(self, cart_item, request):
+        pass
+
+    def post_process(self, cart, request):
+        pass
+
+
+class SignalModifier(Modifier):
+    """Compatibility layer sending the original cart signals."""
+
+    order = 0
+
+    def pre_process(self, cart, request):
+        signals.cart_pre_process.send(sender=cart.__class__, cart=cart, request=request)
+
+    def process_items(self, cart, items, request):
+        if not signals.cart_item_process.receivers:
+            return
+        for item in items:
+            signals.cart_item_process.send_robust(
+                sender=item.__class__, cart_item=item, request=request)
+
+    def post_process(self, cart, request):
+        signals.cart_post_process.send(sender=cart.__class__, cart=cart, request=request)
+
+
+def _overrides(modifier, hook):
+    """Check whether `modifier` implements `hook` (the base does nothing)."""
+    return getattr(type(modifier), hook) is not getattr(Modifier, hook)
+
+
+def _per_item(hook):
+    """Turn a per-item hook into a batch one."""
+    def process_items(cart, items, request):
+        for item in items:
+            hook(item, request)
+    return process_items
+
+
+class ModifierRegistry(object):
+    """Ordered collection of modifiers compiled into a flat `Pipeline`."""
+
+    def __init__(self, profile=False):
+        self._modifiers = []
+        self._pipeline = None
+        self.profile = profile
+        self.timings = OrderedDict()  # name -> [calls, seconds]
+
+    def register(self, modifier, order=None):
+        """Add `modifier` (class or instance) into the pipeline."""
+        if isinstance(modifier, type):
+            modifier = modifier()
+        if order is not None:
+            modifier.order = order
+        self._modifiers.append(modifier)
+        self._pipeline = None
+        return modifier
+
+    def unregister(self, modifier):
+        """Remove a modifier (or all modifiers of a class)."""
+        self._modifiers = [m for m in self._modifiers
+                           if m is not modifier and type(m) is not modifier]
+        self._pipeline = None
+
+    @property
+    def modifiers(self):
+        """Registered modifiers in order of execution."""
+        return sorted(self._modifiers, key=lambda m: m.order)
+
+    def compile(self):
+        """Precompute flat lists of callables for every stage."""
+        stages = {"pre": [], "items": [], "post": []}
+        for modifier in self.modifiers:
+            if _overrides(modifier, "pre_process"):
+                stages["pre"].append((modifier.name, modifier.pre_process))
+            if _overrides(modifier, "process_items"):
+                stages["items"].append((modifier.name, modifier.process_items))
+            if _overrides(modifier, "process_item"):
+                stages["items"].append((modifier.name, _per_item(modifier.process_item)))
+            if _overrides(modifier, "post_process"):
+                stages["post"].append((modifier.name, modifier.post_process))
+
+        if self.profile:
+            self.timings.clear()
+            compiled = {stage: [self._timed(name, func) for name, func in funcs]
+                        for stage, funcs in stages.items()}
+        else:
+            compiled = {stage: [func for name, func in funcs] for stage, funcs in stages.items()}
+        self._pipeline = Pipeline(**compiled)
+        logger.debug("Compiled cart modifiers %s", [m.name for m in self.modifiers])
+        return self._pipeline
+
+    @property
+    def pipeline(self):
+        """Compiled pipeline (compiles lazily if registry changed since startup)."""
+        if self._pipeline is None:
+            self.compile()
+        return self._pipeline
+
+    def _timed(self, name, func):
+        """Wrap `func` to account its runtime under `name`."""
+        timing = self.timings.setdefault(name, [0, 0.0])
+
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                timing[0] += 1
+                timing[1] += time.perf_counter() - start
+        return timed
+
+    def report(self):
+        """Return list of (name, calls, seconds) sorted by total time."""
+        return sorted(((name, calls, seconds) for name, (calls, seconds) in self.timings.items()),
+                      key=lambda row: row[2], reverse=True)
+
+
+registry = ModifierRegistry(profile=getattr(settings, "MARKET_PROFILE_MODIFIERS", False))
+registry.register(SignalModifier)
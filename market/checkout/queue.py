@@ -0,0 +1,156 @@
+# coding: utf-8
+"""Durable database-backed task queue.
+
+Slow side effects (PDF rendering, emails, statistics) are stored as `Task`
+rows and executed by the ``run_tasks`` management command instead of inside
+the request. Tasks are plain functions registered by :func:`task`; their
+arguments have to be JSON serializable (pass IDs, not instances).
+
+- a task with an idempotency `key` is enqueued at most once
+- failed tasks are retried with exponential backoff up to `max_attempts`
+- tasks are claimed by a conditional UPDATE so any number of workers
+  (threads or processes) can share the queue
+- tasks locked by a crashed worker are released after `LOCK_TIMEOUT`
+"""
+import logging
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = getattr(settings, "MARKET_TASKS_CONCURRENCY", 4)
+MAX_ATTEMPTS = getattr(settings, "MARKET_TASKS_MAX_ATTEMPTS", 5)
+BACKOFF = getattr(settings, "MARKET_TASKS_BACKOFF", 30)  # seconds, doubled per attempt
+LOCK_TIMEOUT = getattr(settings, "MARKET_TASKS_LOCK_TIMEOUT", 600)  # seconds
+POLL_INTERVAL = 1  # seconds
+
+registry = {}
+
+
+def task(func):
+    """Register `func` as a task under its dotted path."""
+    name = "{}.{}".format(func.__module__, func.__name__)
+    registry[name] = func
+    func.task_name = name
+    return func
+
+
+def _name(func):
+    return func if isinstance(func, str) else func.task_name
+
+
+def enqueue(func, *args, key=None, delay=0, max_attempts=MAX_ATTEMPTS):
+    """Store a task for `func(*args)` and return it.
+
+    If a task with the same idempotency `key` exists, that one is returned.
+    """
+    if key is not None:
+        existing = models.Task.objects.filter(key=key).first()
+        if existing is not None:
+            return existing
+    try:
+        with transaction.atomic():
+            return models.Task.objects.create(
+                name=_name(func), args=list(args), key=key, max_attempts=max_attempts,
+                run_at=timezone.now() + timedelta(seconds=delay))
+    except IntegrityError:
+        # somebody else enqueued the same key in the meantime
+        return models.Task.objects.get(key=key)
+
+
+def enqueue_on_commit(func, *args, **kwargs):
+    """Enqueue the task once the current transaction commits (immediately outside of one)."""
+    transaction.on_commit(lambda: enqueue(func, *args, **kwargs))
+
+
+def backoff(attempts):
+    """Delay in seconds before the next attempt."""
+    return BACKOFF * 2 ** max(attempts - 1, 0)
+
+
+def release_stale(now=None):
+    """Return tasks locked by dead workers back to the queue."""
+    threshold = (now or timezone.now()) - timedelta(seconds=LOCK_TIMEOUT)
+    return models.Task.objects.filter(status=models.Task.RUNNING, locked_at__lt=threshold).update(
+        status=models.Task.PENDING, locked_at=None)
+
+
+def claim(limit, now=None):
+    """Lock up to `limit` due tasks for this worker."""
+    now = now or timezone.now()
+    candidates = (models.Task.objects.filter(status=models.Task.PENDING, run_at__lte=now)
+                                     .order_by("run_at", "pk")
+                                     .values_list("pk", flat=True)[:limit])
+    claimed = []
+    for pk in candidates:
+        # conditional update - only one worker wins the task
+        if models.Task.objects.filter(pk=pk, status=models.Task.PENDING).update(
+                status=models.Task.RUNNING, locked_at=now, attempts=F("attempts") + 1):
+            claimed.append(pk)
+    return list(models.Task.objects.filter(pk__in=claimed).order_by("run_at", "pk"))
+
+
+def execute(task_obj):
+    """Run a claimed task and record the outcome."""
+    try:
+        func = registry.get(task_obj.name) or import_string(task_obj.name)
+        func(*(task_obj.args or []))
+    except Exception:
+        error = traceback.format_exc()
+        if task_obj.attempts >= task_obj.max_attempts:
+            logger.error("Task %s failed for good:\n%s", task_obj, error)
+            models.Task.objects.filter(pk=task_obj.pk).update(
+                status=models.Task.FAILED, locked_at=None, error=error)
+        else:
+            delay = backoff(task_obj.attempts)
+            logger.warning("Task %s failed, retry in %ds:\n%s", task_obj, delay, error)
+            models.Task.objects.filter(pk=task_obj.pk).update(
+                status=models.Task.PENDING, locked_at=None, error=error,
+                run_at=timezone.now() + timedelta(seconds=delay))
+        return False
+    models.Task.objects.filter(pk=task_obj.pk).update(
+        status=models.Task.DONE, locked_at=None, error="")
+    return True
+
+
+def _execute_in_thread(task_obj):
+    try:
+        return execute(task_obj)
+    finally:
+        connection.close()
+
+
+def work(concurrency=CONCURRENCY, once=False, poll=POLL_INTERVAL):
+    """Process the queue with `concurrency` threads.
+
+    :param once: stop when there is nothing to do instead of polling
+    :returns: tuple (succeeded, failed) counts
+    """
+    succeeded = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            release_stale()
+            tasks = claim(concurrency)
+            if not tasks:
+                if once:
+                    break
+                time.sleep(poll)
+                continue
+            if concurrency == 1:
+                results = [execute(task_obj) for task_obj in tasks]
+            else:
+                results = list(pool.map(_execute_in_thread, tasks))
+            succeeded += results.count(True)
+            failed += results.count(False)
+    return succeeded, failed
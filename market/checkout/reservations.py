@@ -0,0 +1,188 @@
+# coding: utf-8
+"""Stock reservations of offers during checkout.
+
+Stock of an `Offer` (unless its quantity is -1 meaning infinity) is decremented
+by a conditional UPDATE (``quantity >= n``) at the moment an `Order` gets
+created from a cart so two customers can never buy the last piece. The amount
+is remembered as a `Reservation` of the (top) order which
+
+- is committed (forgotten, stock stays decremented) when the order gets confirmed
+- is released (stock returned) when the order gets canceled
+- expires after `TTL` seconds and gets released by :func:`release_expired`
+  which should be run periodically (see `release_reservations` command).
+
+Offers sold out or restocked by these UPDATEs move out of or into vendors'
+offer counters (see `core.counters.restock`).
+
+An order confirmed after its reservation expired gets the stock reserved
+again by :func:`secure` within the confirming transaction - or the
+confirmation fails with `SoldOut` when somebody bought the stock meanwhile.
+"""
+import logging
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from market.core import counters
+from market.core.models import Offer
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+TTL = getattr(settings, "MARKET_RESERVATION_TTL", 30 * 60)  # in seconds
+
+
+class SoldOut(ValueError):
+    """Some offers do not have enough stock."""
+
+    def __init__(self, offers):
+        self.offers = offers
+        super(SoldOut, self).__init__(
+            _("Sold out") + ": " + ", ".join(str(offer) for offer in offers))
+
+
+class _Conflict(Exception):
+    """Internal signal to roll back a partial bulk decrement."""
+
+
+def _decrement_all(quantities):
+    """Decrement stock of all offers by a single UPDATE - all or nothing.
+
+    :returns: False if some offer does not have enough stock (nothing changed)
+    """
+    pks = sorted(offer.pk for offer in quantities)
+    needed = Case(*[When(pk=offer.pk, then=Value(quantity))
+                    for offer, quantity in quantities.items()],
+                  output_field=IntegerField())
+    try:
+        with transaction.atomic():
+            if len(pks) > 1:
+                # lock rows always in the same order to prevent deadlocks
+                list(Offer.objects.select_for_update().filter(pk__in=pks)
+                                  .order_by('pk').values_list('pk', flat=True))
+            updated = (Offer.objects.filter(pk__in=pks, quantity__gte=needed)
+                                    .update(quantity=F('quantity') - needed))
+            if updated != len(pks):
+                raise _Conflict()
+            counters.restock({offer.pk: -quantity for offer, quantity in quantities.items()})
+    except _Conflict:
+        return False
+    return True
+
+
+@transaction.atomic
+def reserve(order, quantities, now=None):
+    """Decrement stock of offers and hold it for `order`.
+
+    :param quantities: dict {<offer-instance>: quantity}
+    :raises SoldOut: if any of the offers does not have enough stock (nothing is reserved)
+    :returns: list of created `Reservation`s
+    """
+    expires = (now or timezone.now()) + timedelta(seconds=TTL)
+    limited = {offer: quantity for offer, quantity in quantities.items() if offer.quantity >= 0}
+    if not limited:
+        return []
+
+    if not _decrement_all(limited):
+        # slow path - go offer by offer to find out which are sold out
+        sold_out = []
+        for offer in sorted(limited, key=lambda offer: offer.pk):
+            quantity = limited.pop(offer)
+            updated = (Offer.objects.filter(pk=offer.pk, quantity__gte=quantity)
+                                    .update(quantity=F('quantity') - quantity))
+            if updated:
+                limited[offer] = quantity
+            elif not Offer.objects.filter(pk=offer.pk, quantity__lt=0).exists():
+                sold_out.append(offer)
+        if sold_out:
+            raise SoldOut(sold_out)
+        counters.restock({offer.pk: -quantity for offer, quantity in limited.items()})
+
+    holds = [models.Reservation(offer=offer, order=order, quantity=quantity, expires=expires)
+             for offer, quantity in limited.items()]
+    models.Reservation.objects.bulk_create(holds)
+    return holds
+
+
+def _restore(holds):
+    """Return the stock of `holds` back to their offers and delete them."""
+    per_offer = defaultdict(int)
+    for hold in holds:
+        per_offer[hold.offer_id] += hold.quantity
+    restored = {}
+    for offer_id, quantity in sorted(per_offer.items()):
+        if (Offer.objects.filter(pk=offer_id, quantity__gte=0)
+                         .update(quantity=F('quantity') + quantity)):
+            restored[offer_id] = quantity
+    counters.restock(restored)
+    if holds:
+        models.Reservation.objects.filter(pk__in=[hold.pk for hold in holds]).delete()
+    return len(holds)
+
+
+@transaction.atomic
+def release(orders):
+    """Return stock held by `orders` (an order, list or queryset of orders)."""
+    if isinstance(orders, models.Order):
+        orders = [orders]
+    holds = list(models.Reservation.objects.select_for_update()
+                                           .filter(order__in=orders)
+                                           .order_by('offer'))
+    return _restore(holds)
+
+
+@transaction.atomic
+def commit(order):
+    """Keep the stock held by `order` decremented for good."""
+    return models.Reservation.objects.filter(order=order).delete()[0]
+
+
+@transaction.atomic
+def secure(orders):
+    """Hold the whole stock of (top) `orders` for good when they get confirmed.
+
+    Amounts whose reservation expired meanwhile are reserved again.
+    :raises SoldOut: if the stock is not available anymore
+    """
+    held = defaultdict(int)
+    for order_id, offer_id, quantity in (models.Reservation.objects.select_for_update()
+                                                                   .filter(order__in=orders)
+                                                                   .values_list('order', 'offer', 'quantity')):
+        held[order_id, offer_id] += quantity
+    ordered = defaultdict(int)
+    offers = {}
+    for item in (models.OrderItem.objects.filter(order__order__in=orders, item__isnull=False)
+                                         .select_related('item', 'order')):
+        ordered[item.order.order_id, item.item_id] += item.quantity
+        offers[item.item_id] = item.item
+    missing = defaultdict(dict)
+    for (order_id, offer_id), quantity in ordered.items():
+        if quantity > held[order_id, offer_id]:
+            missing[order_id][offers[offer_id]] = quantity - held[order_id, offer_id]
+    for order in orders:
+        if order.pk in missing:
+            logger.info("Reserving again expired stock of order %d", order.pk)
+            reserve(order, missing[order.pk])
+    return models.Reservation.objects.filter(order__in=orders).delete()[0]
+
+
+@transaction.atomic
+def release_expired(now=None):
+    """Release all holds which outlived their TTL.
+
+    :returns: number of released reservations
+    """
+    holds = list(models.Reservation.objects.select_for_update()
+                                           .filter(expires__lt=now or timezone.now())
+                                           .order_by('offer'))
+    released = _restore(holds)
+    if released:
+        logger.info("Released %d expired reservations", released)
+    return released
@@ -39,3 +39,6 @@ order_shipped = dispatch.Signal(providing_args=['order'])
 
 """Emitted if the payment was refused or other fatal problem."""
 order_cancelled = dispatch.Signal(providing_args=['order'])
+
+"""Emitted once per batch (after commit) when orders changed their status."""
+orders_transitioned = dispatch.Signal(providing_args=['orders', 'status'])
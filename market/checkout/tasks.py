@@ -0,0 +1,103 @@
+# coding: utf-8
+"""Background side effects of orders executed by `checkout.queue`.
+
+The order signal receivers only enqueue these so rendering of the legal
+documents and talking to the SMTP server never slows down the checkout.
+"""
+import dbmail
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Sum
+
+from market.core import models as core_models
+from market.utils.models import bulk_increment
+
+from .queue import task
+from . import documents
+from . import models
+
+
+def _context(order):
+    return {"order": order,
+            "seller": order.vendor.user,
+            "customer": order.order.user,
+            "vendor": order.vendor}
+
+
+@task
+def send_status_mails(order_id, status):
+    """Create legal documents of a suborder and send mails about its new `status`."""
+    order = models.Order.objects.select_related("vendor__user", "order__user").get(pk=order_id)
+    order.create_legal_documents()
+
+    context = _context(order)
+    seller, customer = context["seller"], context["customer"]
+
+    if status == models.Order.UNCONFIRMED:
+        # send confirmation link for their order
+        dbmail.send_db_mail('checkout-unconfirmed-customer',
+                            customer.email, context)
+
+    if status == models.Order.CONFIRMED and order.pay_on_delivery():
+        invoice = documents.attachment(order.invoice)
+        # send a proforma to the user
+        dbmail.send_db_mail('checkout-confirmed-customer', customer.email, context,
+                            reply_to=[seller.email, ],
+                            attachments=[documents.attachment(order.proforma), ])
+        # send an invoice to the seller
+        dbmail.send_db_mail('checkout-confirmed-vendor', seller.email, context,
+                            reply_to=[customer.email, ],
+                            attachments=[invoice, ])
+
+    if status == models.Order.COMPLETED:
+        # rendered once (and cached) for both mails
+        invoice = documents.attachment(order.invoice)
+        # send a proforma to the user
+        dbmail.send_db_mail('checkout-completed-customer', customer.email, context,
+                            reply_to=[seller.email, ],
+                            attachments=[invoice, ])
+        # send an invoice to the seller so they are ready if/when customer steps in
+        dbmail.send_db_mail('checkout-completed-vendor', seller.email, context,
+                            reply_to=[customer.email, ],
+                            attachments=[invoice, ])
+
+
+@task
+def send_shipped_mail(order_id):
+    """Email customer about shipped order."""
+    order = models.Order.objects.select_related("vendor__user", "order__user").get(pk=order_id)
+    context = _context(order)
+    dbmail.send_db_mail('checkout-shipped-customer', context["customer"].email, context,
+                        reply_to=[context["seller"].email, ])
+
+
+def record_sales(order_ids):
+    """Add quantities of order items of `order_ids` into `sold` of offers and products.
+
+    Quantities are summed per offer and per product by one grouped query and
+    written by one F()-based UPDATE per table - no model is saved so neither
+    `Offer.save` logic nor any signal runs and concurrent orders never lose
+    an increment.
+    """
+    offers, products = Counter(), Counter()
+    for offer, product, quantity in (models.OrderItem.objects
+                                                     .filter(order__in=order_ids, item__isnull=False)
+                                                     .order_by()
+                                                     .values("item", "item__product")
+                                                     .annotate(quantity=Sum("quantity"))
+                                                     .values_list("item", "item__product", "quantity")):
+        offers[offer] += quantity
+        if product is not None:
+            products[product] += quantity
+    with transaction.atomic():
+        bulk_increment(core_models.Offer, "sold", offers)
+        bulk_increment(core_models.Product, "sold", products)
+    return offers, products
+
+
+@task
+def update_statistics(order_id):
+    """Update products statistics after order was placed on them."""
+    record_sales([order_id])
@@ -0,0 +1,117 @@
+# coding: utf-8
+"""Batched status transitions of orders.
+
+Status of an order only grows (see `Order.STATUSES`) and the closed orders
+(received or canceled) can not change anymore. Suborders follow their
+top-order - those with lower status are moved together with it.
+
+Confirmed top-orders get their stock secured (see `reservations.secure`)
+within the same transaction so an order can not be confirmed without stock.
+
+Every batch of orders is moved by one ``UPDATE ... WHERE status < new``, every
+moved order gets an `OrderTransition` log row and the status signals are sent
+for all moved orders at once after the transaction commits so no mail nor
+other side effect happens for a rolled back change.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from . import models
+from . import signals
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+
+CLOSED = (models.Order.RECEIVED, models.Order.CANCELED)
+
+
+def is_allowed(current, status):
+    """Check whether an order in status `current` may be moved to `status`."""
+    return current not in CLOSED and status > current
+
+
+def validate(orders, status):
+    """Validate that all `orders` can be moved to `status`.
+
+    Orders already in `status` are fine (the transition is a no-op for them).
+
+    :raises KeyError: for an unknown status
+    :raises ValueError: listing orders which can not be moved
+    """
+    if status not in models.Order.STATUSES:
+        raise KeyError("Status not listed in Order.STATUS_CODES")
+    invalid = [order for order in orders
+               if order.status != status and not is_allowed(order.status, status)]
+    if invalid:
+        raise ValueError(_("Cannot change status of orders %(uids)s to %(status)s") % {
+            "uids": ", ".join(str(order.uid) for order in invalid),
+            "status": dict(models.Order.STATUS_CODES)[status],
+        })
+
+
+@transaction.atomic
+def _apply(orders, status, user=None):
+    """Move one batch of orders with their suborders; return the moved ones."""
+    ids = [order.pk for order in orders]
+    moved = list(models.Order.objects.select_for_update()
+                                     .filter(Q(pk__in=ids) | Q(order__in=ids),
+                                             status__lt=status)
+                                     .exclude(status__in=CLOSED)
+                                     .order_by("pk"))
+    if not moved:
+        return []
+    if models.Order.UNCONFIRMED <= status < models.Order.CANCELED:
+        # confirmed orders keep their stock - even if the reservation expired meanwhile
+        from . import reservations
+        confirmed = [order for order in moved
+                     if order.order_id is None and order.status < models.Order.UNCONFIRMED]
+        if confirmed:
+            reservations.secure(confirmed)
+    models.Order.objects.filter(pk__in=[order.pk for order in moved]).update(
+        status=status, modified=timezone.now())
+    models.OrderTransition.objects.bulk_create([
+        models.OrderTransition(order=order, old_status=order.status,
+                               new_status=status, user=user)
+        for order in moved])
+    for order in moved:
+        order.status = status
+    return moved
+
+
+def _emit(orders, status):
+    """Send the batch signal and then the per-order status signals."""
+    signals.orders_transitioned.send(sender=models.Order, orders=orders, status=status)
+    signal = models.Order.STATUS_TO_SIGNALS.get(status)
+    if signal is None:
+        return
+    for order in orders:
+        signal.send(sender=models.Order, order=order)
+
+
+def transition(orders, status, user=None, batch_size=BATCH_SIZE):
+    """Move `orders` (and their suborders) into `status`.
+
+    Passed instances get their `status` updated in place.
+
+    :param user: who made the change (stored into the transition log)
+    :returns: list of orders (including suborders) which actually changed
+    """
+    orders = list(orders)
+    validate(orders, status)
+    moved = []
+    for i in range(0, len(orders), batch_size):
+        moved.extend(_apply(orders[i:i + batch_size], status, user))
+
+    moved_ids = {order.pk for order in moved}
+    for order in orders:
+        if order.pk in moved_ids:
+            order.status = status
+    if moved:
+        logger.info("Moved %d orders to status %d", len(moved), status)
+        transaction.on_commit(lambda: _emit(moved, status))
+    return moved
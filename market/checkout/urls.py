@@ -36,6 +36,7 @@ urlpatterns = [
 
     # order views gives user ad vendor to see orders
     url(U / _('order.html'), order.OrderList, name="order-list"),
+    url(U / _('order/') / _('export'), order.Export, name="order-export"),
     url(U / _('order/') / (slug + '.html'), order.OrderDetail, name="order-detail"),
     url(U / _('order/') / _('change-status.json'), order.change_order_status, name='order-change-status'),
 
@@ -1,14 +1,40 @@
 # coding: utf-8
+from django.conf import settings
+from django.core.cache import cache
+
 from . import models
 
 
+CART_CACHE_KEY = "market:cart:user:{:d}"
+CART_CACHE_TIMEOUT = getattr(settings, "MARKET_CART_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def remember_cart(request, cart):
+    """Store the cart ID into session and the user-to-cart mapping into cache."""
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session['cart_id'] = cart.pk
+    if cart.user_id is not None:
+        cache.set(CART_CACHE_KEY.format(cart.user_id), cart.pk, CART_CACHE_TIMEOUT)
+
+
 def get_cart_from_database(request):
-    """Return cart instance for current user from DB storage."""
-    database_cart = models.Cart.objects.filter(user=request.user)
-    if database_cart:
-        database_cart = database_cart[0]
+    """Return cart instance for current user from DB storage.
+
+    The cart ID is cached per user so the common case is a primary-key lookup.
+    Stale cache is harmless because the cart has to belong to the user anyway.
+    """
+    key = CART_CACHE_KEY.format(request.user.pk)
+    cart_id = cache.get(key)
+    if cart_id is not None:
+        database_cart = models.Cart.objects.filter(pk=cart_id, user=request.user).first()
+        if database_cart is not None:
+            return database_cart
+    database_cart = models.Cart.objects.filter(user=request.user).first()
+    if database_cart is not None:
+        cache.set(key, database_cart.pk, CART_CACHE_TIMEOUT)
     else:
-        database_cart = None
+        cache.delete(key)
     return database_cart
 
 
@@ -19,18 +45,34 @@ def get_cart_from_session(request):
     if session is not None:
         cart_id = session.get('cart_id')
         if cart_id:
-            try:
-                session_cart = models.Cart.objects.get(pk=cart_id)
-            except models.Cart.DoesNotExist:
-                session_cart = None
+            session_cart = models.Cart.objects.filter(pk=cart_id).first()
     return session_cart
 
 
+def adopt_cart(request, session_cart):
+    """Assign anonymous `session_cart` to the logged in user.
+
+    If the user already has a cart in the database, lines of the session cart
+    are merged into it (see `Cart.merge`) instead of throwing the older one away.
+    """
+    database_cart = get_cart_from_database(request)
+    if database_cart is None:
+        session_cart.user = request.user
+        session_cart.save()
+        cart = session_cart
+    else:
+        database_cart.merge(session_cart)
+        cart = database_cart
+    remember_cart(request, cart)
+    return cart
+
+
 def get_or_create_cart(request, save=False):
     """Get cart for current visitor.
 
-    For a logged in user, try to get the cart from the database. If it's not there or it's empty,
-    use the cart from the session.
+    For a logged in user, the cart from the session is used when it is theirs. An
+    anonymous session cart gets merged into the user's database cart (or becomes
+    it). Otherwise the cart is looked up in the database.
     If the user is not logged in use the cart from the session.
     If there is no cart object in the database or session, create one.
 
@@ -43,26 +85,18 @@ def get_or_create_cart(request, save=False):
         if is_logged_in:
             # if we are authenticated
             session_cart = get_cart_from_session(request)
-            if session_cart and session_cart.user == request.user:
+            if session_cart and session_cart.user_id == request.user.pk:
                 # and the session cart already belongs to us, we are done
                 cart = session_cart
-            elif session_cart and not session_cart.is_empty and session_cart.user != request.user:
-                # if it does not belong to us yet
-                database_cart = get_cart_from_database(request)
-                if database_cart:
-                    # and there already is a cart that belongs to us in the database
-                    # delete the old database cart
-                    database_cart.delete()
-                # save the user to the new one from the session
-                session_cart.user = request.user
-                session_cart.save()
-                cart = session_cart
+            elif session_cart and session_cart.user_id is None:
+                # anonymous cart from before the login
+                cart = adopt_cart(request, session_cart)
             else:
-                # if there is no session_cart, or it's empty, use the database cart
+                # if there is no usable session_cart use the database cart
                 cart = get_cart_from_database(request)
                 if cart:
                     # and save it to the session
-                    request.session['cart_id'] = cart.pk
+                    remember_cart(request, cart)
         else:
             # not authenticated? cart might be in session
             cart = get_cart_from_session(request)
@@ -76,7 +110,7 @@ def get_or_create_cart(request, save=False):
 
         if save and not cart.pk:
             cart.save()
-            request.session['cart_id'] = cart.pk
+            remember_cart(request, cart)
 
         setattr(request, '_cart', cart)
 
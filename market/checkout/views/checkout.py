@@ -10,6 +10,7 @@ from django.forms import models as model_forms
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import transaction
+from django.db.models import Sum
 from django.dispatch import receiver
 from django.utils.translation import ugettext as _
 from django.shortcuts import redirect
@@ -22,6 +23,7 @@ from market.core import utils as core_utils
 from market.checkout import models
 from market.checkout import utils
 from market.checkout import forms
+from market.checkout import reservations
 from market.checkout.views import OrderProcessor
 
 logger = logging.getLogger(__name__)
@@ -119,10 +121,17 @@ class Selection(MarketView):
         if cart.user != request.user:
             cart.user = request.user
             cart.save()
-        # check whether all products in the cart are not sold out.
+        # check whether all products in the cart are not sold out. Stock held
+        # by the previous order of this cart is going to be released thus counts
+        held = dict(models.Reservation.objects
+                    .filter(order__in=models.Order.objects.unconfirmed_for_cart(cart))
+                    .values_list('offer')
+                    .annotate(Sum('quantity'))
+                    .order_by())
         remove = []
-        for cartitem in cart.items.all():
-            if cartitem.item.quantity >= 0 and cartitem.quantity > cartitem.item.quantity:
+        for cartitem in cart.get_items():
+            available = cartitem.item.quantity + held.get(cartitem.item.pk, 0)
+            if cartitem.item.quantity >= 0 and cartitem.quantity > available:
                 remove.append(cartitem)
                 messages.warning(
                     request,
@@ -148,7 +157,14 @@ class Selection(MarketView):
             addresses_form.save_to_request(self.request)
 
         # Here it is! Turn Cart into Order!
-        order = models.Order.objects.create_from_cart(cart, self.request)
+        try:
+            order = models.Order.objects.create_from_cart(cart, self.request)
+        except reservations.SoldOut as sold_out:
+            # someone else was faster - the stock is gone in the meantime
+            for offer in sold_out.offers:
+                messages.warning(request, str(offer) + " " + str(_("has been sold out.")))
+            cart.items.filter(item__in=sold_out.offers).delete()
+            return redirect("cart")
         utils.add_order_to_request(self.request, order)
 
         # Save addresses into the order
@@ -230,10 +246,13 @@ class Payment(OrderProcessor, LoginRequiredMixin, MarketFormView):
         if "abort" in self.request.POST:
             return abort_checkout(self.request)
 
-        if self.request.user.primary_email.verified:
-            self.order.mark_as_confirmed()
-        else:
-            self.order.mark_as_unconfirmed()
+        try:
+            if self.request.user.primary_email.verified:
+                self.order.mark_as_confirmed()
+            else:
+                self.order.mark_as_unconfirmed()
+        except reservations.SoldOut as sold_out:
+            return sold_out_checkout(self.request, self.order, sold_out)
 
         if form.cleaned_data['payment'] is None:
             return redirect('checkout-thanks')
@@ -286,6 +305,14 @@ class ThankYou(MarketView):
 thank_you = ThankYou.as_view()
 
 
+def sold_out_checkout(request, order, sold_out):
+    """Cancel `order` whose reservation expired and the stock was sold meanwhile."""
+    for offer in sold_out.offers:
+        messages.warning(request, str(offer) + " " + str(_("has been sold out.")))
+    order.mark_as_canceled()
+    return redirect("cart")
+
+
 def abort_checkout(request):
     """Cancel order in `request and redirect to cart."""
     order = utils.get_order_from_request(request)
@@ -1,8 +1,10 @@
+import tempfile
+
 from django.contrib import messages
 from django.shortcuts import get_object_or_404
 from django.views.generic import View
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404, HttpResponseBadRequest
+from django.http import FileResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.utils.translation import ugettext as _
 from market.core.views import MarketView
 from market.core import models as core_models
@@ -10,7 +12,11 @@ from market.core import models as core_models
 from market.utils.models import try_get
 from market.core.views import VendorRequiredMixin
 
+from market.checkout import documents
+from market.checkout import export
+from market.checkout import listing
 from market.checkout import models
+from market.checkout import transitions
 from marcket.checkout.views import AjaxResponseMixin
 
 
@@ -34,10 +40,10 @@ class Download(LoginRequiredMixin, View):
 
         if document == "proforma":
             # the user can get proforma any time
-            return order.proforma.export_response()
+            return documents.response(request, order.proforma)
 
         if document == "invoice" and (order.is_paid() or order.is_shipped()):
-            return order.invoice.export_response()
+            return documents.response(request, order.invoice)
 
         return HttpResponseBadRequest(_("Invalid request or permissions"))
 
@@ -72,20 +78,66 @@ class OrderList(VendorRequiredMixin, LoginRequiredMixin, MarketView):
     states = ('shipped', 'completed', 'confirmed')
 
     def get(self, request):
-        """Add orders with status in `GET['status'] into context."""
+        """Add a page of orders with status in `GET['status']` into context.
+
+        Optional `GET['since']` and `GET['until']` (YYYY-MM-DD) limit the date range,
+        `GET['cursor']` continues after the previous page.
+        """
         ctx = self.get_context_data()
         status = request.GET.get("status", "shipped")
         if status not in self.states:
             raise Http404('Not a valid status')
-        ctx.update(object_list=models.Order.objects.filter(
-            vendor=self.vendor, status=getattr(models.Order, status.upper())))
+        try:
+            since, until = listing.date_range(request.GET.get("since"), request.GET.get("until"))
+            page = listing.page(self.vendor, getattr(models.Order, status.upper()),
+                                cursor=request.GET.get("cursor"), since=since, until=until)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid cursor or date range")
+        ctx.update(object_list=page.object_list, cursor=page.cursor)
+        counts = listing.status_counts(self.vendor, since, until)
         for s in self.states:
-            ctx.update({"%s_count" % s: models.Order.objects.filter(vendor=self.vendor,
-                        status=getattr(models.Order, status.upper())).count()})
-        ctx.update(status=status)
+            ctx.update({"%s_count" % s: counts.get(getattr(models.Order, s.upper()), 0)})
+        ctx.update(status=status, since=request.GET.get("since"), until=request.GET.get("until"))
         return self.render_to_response(ctx)
 
 
+class Export(LoginRequiredMixin, VendorRequiredMixin, View):
+    """Stream vendor's order history as CSV or XLSX.
+
+    Accepts the same `status`, `since` and `until` GET parameters as OrderList
+    plus `format` (csv or xlsx).
+
+    Only CSV is streamed as it is produced. XLSX is a ZIP archive finished by
+    its central directory, so it is written into a temporary file first (with
+    constant memory) and sent once complete - the first byte of a big XLSX
+    export comes only after all rows were read.
+    """
+
+    def get(self, request):
+        fmt = request.GET.get("format", "csv")
+        status = request.GET.get("status")
+        if fmt not in export.FORMATS or (status and status not in OrderList.states):
+            raise Http404()
+        try:
+            since, until = listing.date_range(request.GET.get("since"), request.GET.get("until"))
+        except ValueError:
+            return HttpResponseBadRequest("Invalid date range")
+        rows = export.rows(export.items(
+            vendor=self.vendor, status=getattr(models.Order, status.upper()) if status else None,
+            since=since, until=until))
+
+        if fmt == "csv":
+            response = StreamingHttpResponse(export.csv_lines(rows), content_type="text/csv")
+        else:
+            output = tempfile.TemporaryFile()
+            export.write_xlsx(output, rows)
+            output.seek(0)
+            response = FileResponse(output, content_type=(
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"))
+        response["Content-Disposition"] = 'attachment; filename="orders.{}"'.format(fmt)
+        return response
+
+
 class ChangeOrderStatus(AjaxResponseMixin, MarketView):
     """(Ajax) view for changing order state.
 
@@ -108,28 +160,39 @@ class ChangeOrderStatus(AjaxResponseMixin, MarketView):
         return self.render_to_response({"order": order})
 
     def post(self, request, *args, **kwargs):
-        """Change the models.Order's status by its seller."""
-        if "uid" not in request.POST:
+        """Change the status of one or more models.Order-s by their seller.
+
+        Multiple orders are passed as repeated `uid` fields.
+        """
+        uids = request.POST.getlist("uid")
+        if not uids:
             return HttpResponseBadRequest("Specify an UID")
-        order = get_object_or_404(models.Order, uid=request.POST['uid'])
         vendor = try_get(core_models.Vendor, user=request.user, active=True)
+        if vendor is None:
+            raise Http404()
+        orders = list(models.Order.objects.filter(uid__in=uids, vendor=vendor))
+        if len(orders) != len(set(uids)):
+            raise Http404()
 
         try:
-            self.change_status(order, int(request.POST['status']), vendor)
+            self.change_status(orders, int(request.POST['status']), vendor)
         except ValueError as e:
             return self.response({"status": "error",
                                   "message": str(e)})
 
         return self.response({"status": "success",
-                              "message": order.get_status_display()})
+                              "message": orders[0].get_status_display()})
 
-    def change_status(self, order, status, vendor=None):
-        """Change order's status from point of its seller."""
-        if status <= order.status:
+    def change_status(self, orders, status, vendor=None):
+        """Change orders' status from point of its seller."""
+        if isinstance(orders, models.Order):
+            orders = [orders]
+        if any(status <= order.status for order in orders):
             raise ValueError(_("Cannot lower order's status."))
-        if status == models.Order.CANCELLED:
+        if status == models.Order.CANCELED:
             raise ValueError(_("Seller cannot cancel an order."))
-        return order.mark_as(status)
+        return transitions.transition(
+            orders, status, user=vendor.user if vendor is not None else None)
 
 
 change_order_status = ChangeOrderStatus.as_view()
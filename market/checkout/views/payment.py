@@ -6,6 +6,9 @@ from django.db import transaction
 from django.shortcuts import redirect
 from django.utils.translation import gettext as _
 
+from market.checkout import reservations
+
+from . import checkout
 from . import utils
 
 
@@ -22,10 +25,13 @@ def pay_on_delivery(request):
         account.models.EmailAddress.objects.filter(
             email=request.user.email, primary=True, verified=True).exists(),
     )
-    if all(conditions):
-        order.mark_as_confirmed()
-    else:
-        order.mark_as_unconfirmed()
+    try:
+        if all(conditions):
+            order.mark_as_confirmed()
+        else:
+            order.mark_as_unconfirmed()
+    except reservations.SoldOut as sold_out:
+        return checkout.sold_out_checkout(request, order, sold_out)
     return redirect("checkout-thanks")
 
 
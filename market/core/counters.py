@@ -0,0 +1,127 @@
+# coding: utf-8
+"""Denormalized counters of vendors' active offers.
+
+`Vendor.offer_count` and `Vendor.offer_total` hold the number and the sum of
+unit prices of the vendor's active offers in stock (sold out offers with
+zero quantity are not counted). Every saved or deleted `Offer` moves its own
+contribution by one ``UPDATE ... SET offer_count = offer_count + n`` so
+concurrent changes are never lost, and reading the numbers (limits of
+unofficial vendors, tariff statistics) costs nothing. Stock changed by bulk
+UPDATEs (reservations) is accounted by `restock` when it crosses zero.
+`reconcile` recomputes the counters by a grouped query to repair drift
+(e.g. after other bulk updates of offers which bypass `Offer.save`).
+"""
+import logging
+
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum
+
+from market.utils.models import bulk_update
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+ZERO = Decimal('0.00')
+
+
+def _state(vendor_id, active, quantity, unit_price):
+    return (vendor_id, bool(active) and quantity != 0, unit_price)
+
+
+def state(offer):
+    """Return what the `offer` contributes to counters: (vendor_id, counted, unit_price)."""
+    return _state(offer.vendor_id, offer.active, offer.quantity, offer.unit_price)
+
+
+def stored(offer):
+    """Return the state of `offer` as it is in the database (None for a new offer).
+
+    The row stays locked until the transaction ends so concurrent changes of
+    the offer are accounted after this one.
+    """
+    if offer.pk is None:
+        return None
+    row = (type(offer).objects.select_for_update().filter(pk=offer.pk)
+                              .values_list("vendor", "active", "quantity", "unit_price").first())
+    return _state(*row) if row is not None else None
+
+
+def move(before, after):
+    """Replace contribution `before` by `after` in vendors' counters (one UPDATE per vendor)."""
+    move_all([(before, after)])
+
+
+def move_all(changes):
+    """Replace contributions of many (before, after) pairs (one UPDATE per vendor)."""
+    from market.core.models import Vendor
+    deltas = {}
+    for before, after in changes:
+        for counted, sign in ((before, -1), (after, 1)):
+            if counted is None or not counted[1]:
+                continue
+            count, total = deltas.get(counted[0], (0, ZERO))
+            deltas[counted[0]] = (count + sign, total + sign * Decimal(counted[2] or 0))
+    for vendor_id, (count, total) in sorted(deltas.items()):
+        if count or total:
+            Vendor.objects.filter(pk=vendor_id).update(offer_count=F("offer_count") + count,
+                                                       offer_total=F("offer_total") + total)
+
+
+def restock(deltas):
+    """Account stock changes `deltas` {offer_id: delta} already written by UPDATEs.
+
+    Offers which got sold out or back in stock move out of or into counters.
+    Has to run in the transaction of the UPDATEs (their rows are locked).
+    """
+    from market.core.models import Offer
+    changes = []
+    for pk, vendor_id, active, quantity, unit_price in (
+            Offer.objects.filter(pk__in=list(deltas))
+                         .values_list("pk", "vendor", "active", "quantity", "unit_price")):
+        before = _state(vendor_id, active, quantity - deltas[pk], unit_price)
+        after = _state(vendor_id, active, quantity, unit_price)
+        if before != after:
+            changes.append((before, after))
+    move_all(changes)
+
+
+def compute(vendor_ids):
+    """Count active offers in stock of `vendor_ids` by one grouped query.
+
+    :returns: dict {vendor_id: (count, total)} with zeros for vendors without offers
+    """
+    from market.core.models import Offer
+    counts = dict.fromkeys(vendor_ids, (0, ZERO))
+    for vendor_id, count, total in (Offer.objects.filter(vendor__in=vendor_ids, active=True)
+                                                 .exclude(quantity=0)
+                                                 .order_by()
+                                                 .values("vendor")
+                                                 .annotate(count=Count("pk"), total=Sum("unit_price"))
+                                                 .values_list("vendor", "count", "total")):
+        counts[vendor_id] = (count, total or ZERO)
+    return counts
+
+
+def reconcile(batch_size=BATCH_SIZE, repair=False):
+    """Find (and optionally repair) vendors whose stored counters drifted.
+
+    :returns: dict {vendor_id: {field: correct value}} of drifted vendors
+    """
+    from market.checkout.cleanup import keyset
+    from market.core.models import Vendor
+    drift = {}
+    for vendor_ids in keyset(Vendor.objects.all(), batch_size):
+        counts = compute(vendor_ids)
+        changes = {}
+        for pk, offer_count, offer_total in (Vendor.objects.filter(pk__in=vendor_ids)
+                                                           .values_list("pk", "offer_count", "offer_total")):
+            count, total = counts[pk]
+            if (offer_count, offer_total) != (count, total):
+                changes[pk] = {"offer_count": count, "offer_total": total}
+        if changes:
+            logger.warning("Vendors %s had drifted offer counters", sorted(changes))
+            if repair:
+                bulk_update(Vendor, changes)
+        drift.update(changes)
+    return drift
@@ -0,0 +1,83 @@
+# coding: utf-8
+"""Data of the vendor's admin dashboard.
+
+All order counts are computed by one conditional aggregate, offer counts by
+another one. The whole dashboard is cached per vendor and invalidated when an
+order of the vendor changes its status or when the vendor's offer changes
+(see receivers in `core.models` and `checkout.models`).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
+
+DASHBOARD_CACHE_KEY = "market:dashboard:vendor:{:d}"
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, "MARKET_DASHBOARD_CACHE_TIMEOUT", 60 * 10)
+RECENT = 10
+
+
+def _count_if(*args, **kwargs):
+    """Conditional COUNT usable in aggregate()."""
+    return Sum(Case(When(Q(*args, **kwargs), then=Value(1)),
+                    default=Value(0), output_field=IntegerField()))
+
+
+def order_counts(vendor):
+    """Count vendor's orders per dashboard column by one query."""
+    from market.checkout.models import Order
+    counts = Order.objects.filter(vendor=vendor).aggregate(
+        confirming=_count_if(status__lte=Order.CONFIRMING),
+        confirmed=_count_if(status=Order.CONFIRMED),
+        completed=_count_if(status=Order.COMPLETED),
+        shipped=_count_if(status=Order.SHIPPED),
+        all=Count("pk"))
+    return {key: value or 0 for key, value in counts.items()}
+
+
+def offer_counts(vendor):
+    """Count vendor's offers by one query."""
+    from market.core.models import Offer
+    counts = Offer.objects.filter(vendor=vendor).aggregate(
+        active=_count_if(active=True),
+        deleted=_count_if(active=False, removed=False))
+    return {key: value or 0 for key, value in counts.items()}
+
+
+def compute(vendor):
+    """Gather the dashboard data of `vendor` from the database."""
+    from market.checkout.models import Order
+    from market.core.models import Offer
+    orders = Order.objects.filter(vendor=vendor).order_by('-modified')
+    offers = Offer.objects.filter(vendor=vendor).order_by('-created')
+    offers_counts = offer_counts(vendor)
+    return {
+        "orders_count": order_counts(vendor),
+        "offers_count": offers_counts["active"],
+        "offers_counts": offers_counts,
+        "orders": {
+            "confirmed": list(orders.filter(status=Order.CONFIRMED)[:RECENT]),
+            "completed": list(orders.filter(status=Order.COMPLETED)[:RECENT]),
+        },
+        "offers": list(offers.filter(active=True)[:RECENT]),
+        "offers_deleted": list(offers.filter(active=False, removed=False)[:RECENT]),
+    }
+
+
+def get(vendor):
+    """Return (cached) dashboard data of `vendor`."""
+    key = DASHBOARD_CACHE_KEY.format(vendor.pk)
+    data = cache.get(key)
+    if data is None:
+        data = compute(vendor)
+        cache.set(key, data, DASHBOARD_CACHE_TIMEOUT)
+    return data
+
+
+def counts(data):
+    """Plain numbers of the dashboard for polling (JSON) clients."""
+    return {"orders_count": data["orders_count"], "offers_count": data["offers_count"],
+            "offers_counts": data["offers_counts"]}
+
+
+def invalidate(*vendor_ids):
+    """Forget cached dashboards of `vendor_ids`."""
+    cache.delete_many([DASHBOARD_CACHE_KEY.format(pk) for pk in vendor_ids if pk is not None])
@@ -4,7 +4,7 @@ from django.conf import settings
 from django.contrib.auth.models import BaseUserManager
 from django.contrib.auth.hashers import make_password
 
-from market.utils.models import slugify_uniquely
+from market.utils.models import save_slugged
 
 if getattr(settings, "ENABLE_POSTGIS", False):
     from django.contrib.gis.db.models import GeoManager as Manager
@@ -36,17 +36,12 @@ class CustomUserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
         """Create and save a User with the given name, email and password."""
-        if not extra_fields.get('slug', None):
-            if 'name' in extra_fields:
-                slug_base = extra_fields['name']
-            else:
-                slug_base = email.split("@")[0]
-            slug = slugify_uniquely(self.model, slug_base)
+        slug_base = extra_fields.get('name') or email.split("@")[0]
         extra_fields.update(is_superuser=False, is_staff=False)
 
-        user = self.model(email=email, slug=slug, **extra_fields)
+        user = self.model(email=email, **extra_fields)
         user.password = make_password(password)  # is password is None => unusable password
-        user.save(using=self._db)
+        save_slugged(user, lambda: user.save(using=self._db), slug_base)
         return user
 
     def create_superuser(self, email, password, **extra_fields):
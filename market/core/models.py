@@ -33,12 +33,13 @@ from market.core.managers import (
 )
 from market.utils.models import UidMixin, CurrencyField, CommentableMixin
 from market.utils.models import (
-    slugify_uniquely, phone_validator, upload_to_classname)
+    save_slugged, phone_validator, upload_to_classname)
 from market.utils.templates import truncate
 from market import locale
 
-from django.db import models
+from django.db import models, transaction
 
+from . import counters
 from . import serializers
 
 logger = logging.getLogger(__name__)
@@ -92,9 +93,9 @@ class User(UidMixin, auth_models.AbstractBaseUser, auth_models.PermissionsMixin)
             self.name = " ".join((self.first_name, self.last_name))
         if not self.name:
             self.set_name_from_email()
-        if not self.slug and self.name:
-            self.slug = slugify_uniquely(self.__class__, self.name)
-        return super(User, self).save(*args, **kwargs)
+        if not self.name:
+            return super(User, self).save(*args, **kwargs)
+        return save_slugged(self, lambda: super(User, self).save(*args, **kwargs), self.name)
 
     @property
     def username(self):
@@ -215,13 +216,12 @@ class Product(CommentableMixin, RatingCacheMixin, models.Model):
 
     def save(self, *args, **kwargs):
         """Infer slug and tax rate before saving."""
-        if not self.slug:
-            self.slug = slugify_uniquely(Product, self.name)
         if not self.tax:
             self.tax = settings.TAX
         if self.category_id is not None:
             self.offer_set.update(category=self.category)
-        return super(Product, self).save(*args, **kwargs)
+        return save_slugged(self, lambda: super(Product, self).save(*args, **kwargs), self.name,
+                            klass=Product)
 
     def __str__(self):
         return self.name
@@ -318,13 +318,14 @@ class Offer(models.Model):
         """Construct slug from product's slug and vendor slug."""
         if not self.name:
             self.name = self.product.name
-        if not self.slug:
-            self.slug = slugify_uniquely(
-                self.__class__,
-                "{0}--{1}".format(self.product.slug, self.vendor.slug or 'x'))
         if not self.category:
             self.category = self.product.category
-        super(Offer, self).save(*args, **kwargs)
+
+        def save():
+            with transaction.atomic():
+                counters.move(counters.stored(self), counters.state(self))
+                super(Offer, self).save(*args, **kwargs)
+        save_slugged(self, save, "{0}--{1}".format(self.product.slug, self.vendor.slug or 'x'))
         self.product.update_price()
 
     def delete(self, *args, **kwargs):
@@ -422,6 +423,8 @@ class Vendor(UidMixin, RatingCacheMixin, models.Model):
     limit_product_count = 4
     limit_product_total = Decimal(5000)
 
+    COUNTERS = ("offer_count", "offer_total")
+
     message = {
         "at_limit": _("Unofficial vendors cannot go beyond {:d} products or {!s} total price").format(
             limit_product_count, limit_product_total),
@@ -457,6 +460,10 @@ class Vendor(UidMixin, RatingCacheMixin, models.Model):
 
     ships = models.BooleanField(default=True, help_text=_("You are shipping wares to customers"))
 
+    # number and value of active offers in stock maintained by `core.counters`
+    offer_count = models.IntegerField(default=0, editable=False)
+    offer_total = CurrencyField(editable=False)
+
     objects = ActiveCategoryManager()
     serializer = serializers.VendorSerializer()
 
@@ -465,10 +472,15 @@ class Vendor(UidMixin, RatingCacheMixin, models.Model):
         app_label = "market"
 
     def save(self, *args, **kwargs):
-        """Construct slug if not explicitely given before saving."""
-        if not self.slug:
-            self.slug = slugify_uniquely(self.__class__, self.name)
-        super(Vendor, self).save(*args, **kwargs)
+        """Construct slug if not explicitely given before saving.
+
+        Offer counters are never written from (possibly stale) memory - only
+        by `core.counters`.
+        """
+        if not self._state.adding and not kwargs.get("force_insert") and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in Vendor.COUNTERS]
+        save_slugged(self, lambda: super(Vendor, self).save(*args, **kwargs), self.name)
 
     def delete(self, *args, **kwargs):
         """Delete image files before deleting the model."""
@@ -494,7 +506,7 @@ class Vendor(UidMixin, RatingCacheMixin, models.Model):
         """Check if the limit was reached and to disallow more actions."""
         if not self.has_limit:
             return False
-        if self.offers.count() >= Vendor.limit_product_count:
+        if self.offer_count >= Vendor.limit_product_count:
             return True
 
         if self.total >= Vendor.limit_product_total:
@@ -510,25 +522,38 @@ class Vendor(UidMixin, RatingCacheMixin, models.Model):
             return self.user.name
         return u""
 
-    @cached_property
+    @property
     def total(self):
-        """Sum of prices of all offers."""
-        return self.offer_set.filter(removed=False)\
-                             .aggregate(total=models.Sum('unit_price'))['total']
+        """Sum of prices of active offers."""
+        return self.offer_total
 
-    def close(self):
+    @transaction.atomic
+    def close(self, batch_size=500):
         """Deactivate the vendor and all offers with it.
 
-        Send a signal in the end because there might be other classes interested.
+        Products left without any active offer are found by one grouped query
+        and deactivated in bulk - no product is saved one by one. Send a signal
+        in the end because there might be other classes interested.
         """
+        products = self.offer_set.values("product")
         self.offer_set.update(active=False)
-        for product in self.product_set.all():
-            if product.offers.count() == 1:
-                product.active = False
-                product.save()
+        Vendor.objects.filter(pk=self.pk).update(offer_count=0, offer_total=0)
+        self.offer_count, self.offer_total = 0, Decimal(0)
+        orphaned = list(Offer.objects.filter(product__in=products)
+                                     .order_by()
+                                     .values("product")
+                                     .annotate(alive=models.Sum(models.Case(
+                                         models.When(active=True, then=models.Value(1)),
+                                         default=models.Value(0), output_field=models.IntegerField())))
+                                     .filter(alive=0)
+                                     .values_list("product", flat=True))
+        for i in range(0, len(orphaned), batch_size):
+            Product.objects.filter(pk__in=orphaned[i:i + batch_size], active=True).update(active=False)
         self.active = False
         self.deactivated = timezone.now()
         self.save()
+        from market.core import dashboard
+        dashboard.invalidate(self.pk)  # the bulk updates bypass offer signals
         vendor_closed.send(sender=self.__class__, instance=self)
 
     @property
@@ -648,7 +673,7 @@ class Manufacturer(RatingCacheMixin, models.Model):
     IMAGE_SIZE = (800, 600)
 
     name = models.CharField(max_length=100)
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     email = models.EmailField(max_length=50, null=True, blank=True, help_text=_('Customer support'))
     phone = models.CharField(max_length=20, validators=[phone_validator, ],
                              null=True, blank=True)
@@ -674,14 +699,25 @@ class Manufacturer(RatingCacheMixin, models.Model):
 
     def save(self, *args, **kwargs):
         """Add slug if non-existing."""
-        if not self.slug:
-            self.slug = slugify_uniquely(self.__class__, self.name)
-        return super(Manufacturer, self).save(*args, **kwargs)
+        return save_slugged(self, lambda: super(Manufacturer, self).save(*args, **kwargs), self.name)
 
 
 ratings.register(Manufacturer, RatingCacheHandler)
 
 
+@receiver(models.signals.pre_delete, sender=Offer)
+def offer_deleted_counters(sender, instance, **kwargs):
+    """Take the deleted offer out of vendor's counters (cascades skip `Offer.delete`)."""
+    counters.move(counters.stored(instance), None)
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Offer)
+def offer_changed_dashboard(sender, instance, **kwargs):
+    """Vendor's dashboard shows counts and the latest offers."""
+    from market.core import dashboard
+    dashboard.invalidate(instance.vendor_id)
+
+
 @receiver(social_account_added)
 def populate_user_name(request, sociallogin, **kwargs):
     if not sociallogin.account.user.name or len(sociallogin.account.user.name) < 3:
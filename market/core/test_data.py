@@ -16,6 +16,13 @@ from . import models
 logger = logging.getLogger(__name__)
 
 
+def _move_offers(offers, product, vendor):
+    """Assign existing `offers` to `product` and `vendor` one by one to keep vendors' counters."""
+    for offer in offers:
+        offer.product, offer.vendor = product, vendor
+        offer.save()
+
+
 @transaction.atomic
 def load():
     """Load testing data into database & media."""
@@ -254,7 +261,7 @@ def load():
             "active": True,
         })
     else:
-        models.Offer.objects.filter(name=product.name).update(product=product, vendor=vendors[0])
+        _move_offers(models.Offer.objects.filter(name=product.name), product, vendors[0])
     products.append(product)
     product, created = models.Product.objects.get_or_create(name="Sandalky", vendor=vendors[1], defaults={
         "category": models.Category.objects.get(path="obleceni-a-obuv/damska-obuv/sandaly"),
@@ -279,7 +286,7 @@ def load():
             "sold": 4,
         })
     else:
-        models.Offer.objects.filter(name=product.name).update(product=product, vendor=vendors[1])
+        _move_offers(models.Offer.objects.filter(name=product.name), product, vendors[1])
     products.append(product)
 
     product, created = models.Product.objects.get_or_create(name="Trezor na dokumenty AAE736", vendor=vendors[0], defaults={
@@ -311,8 +318,8 @@ def load():
             "sold": 2,
         })
     else:
-        models.Offer.objects.filter(name=product.name, sold=1).update(product=product, vendor=vendors[0])
-        models.Offer.objects.filter(name=product.name, sold=2).update(product=product, vendor=vendors[1])
+        _move_offers(models.Offer.objects.filter(name=product.name, sold=1), product, vendors[0])
+        _move_offers(models.Offer.objects.filter(name=product.name, sold=2), product, vendors[1])
     products.append(product)
 
     product, created = models.Product.objects.get_or_create(name="Ochočená sova", vendor=vendors[2], defaults={
@@ -345,8 +352,8 @@ def load():
             "note": "Prodáváme jen po párech, protože sovy jsou společenská zvířata"
         })
     else:
-        models.Offer.objects.filter(name=product.name, sold=1).update(product=product, vendor=vendors[1])
-        models.Offer.objects.filter(name=product.name, sold=2).update(product=product, vendor=vendors[2])
+        _move_offers(models.Offer.objects.filter(name=product.name, sold=1), product, vendors[1])
+        _move_offers(models.Offer.objects.filter(name=product.name, sold=2), product, vendors[2])
     products.append(product)
 
     # create Votes for Products and Vendors
@@ -2,7 +2,10 @@
 import random
 from decimal import Decimal
 
+from django.conf import settings
+
 from market.core.models import Category, Product, Offer
+from market.utils.models import bulk_create_slugged
 from .test_data import load as base_load
 
 products = 150
@@ -15,12 +18,14 @@ def load():
     max_offers = len(data['vendors'])
     categories = Category.objects.all()
 
-    for i in range(products):
-        product = create_product(
-            name="Produkt {0}".format(i),
-            vendor=random.choice(vendors),
-            category=random.choice(categories),
-        )
+    batch = [make_product(
+        name="Produkt {0}".format(i),
+        vendor=random.choice(vendors),
+        category=random.choice(categories),
+    ) for i in range(products)]
+    # slugs of the whole batch are allocated at once
+    for product in bulk_create_slugged(Product, batch):
+        create_offer(product=product, vendor=product.vendor)
         offers = random.randint(-5, max_offers - 1)
         vendors_local = vendors[:]
         vendors_local.remove(product.vendor)
@@ -33,7 +38,7 @@ def load():
     return data
 
 
-def create_product(**kwargs):
+def make_product(**kwargs):
     base_product = {
         'name': 'unique',
         'active': True,
@@ -42,12 +47,11 @@ def create_product(**kwargs):
         'category': None,
         'photo': None,
         'description': '',
+        'tax': settings.TAX,
         'expedition_days': random.choice((0, 0, 0, 0, 1, 2, 3, 1, 0))
     }
     base_product.update(kwargs)
-    product = Product.objects.create(**base_product)
-    create_offer(product=product, vendor=base_product['vendor'])
-    return product
+    return Product(**base_product)
 
 
 def create_offer(**kwargs):
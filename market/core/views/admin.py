@@ -21,7 +21,7 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 from allauth import account
 from market.checkout.models import Order
-from market.core import forms, models, views
+from market.core import dashboard, forms, models, views
 from market.utils.templates import render_template
 
 logger = logging.getLogger(__name__)
@@ -230,25 +230,12 @@ class Home(views.VendorRequiredMixin, views.MarketAdminView):
     """Dashboard showing order states and providing most common functionality."""
 
     def get(self, request, *args, **kwargs):
-        """Get orders grouped by status."""
+        """Get orders grouped by status (JSON clients get only the counts)."""
+        data = dashboard.get(self.vendor)
+        if self.render_json():
+            return JsonResponse(dashboard.counts(data))
         context = self.get_context_data(**kwargs)
-        context.update(orders_count={
-            "confirming": self.vendor.orders.filter(status__lte=Order.CONFIRMING).count(),
-            "confirmed": self.vendor.orders.filter(status=Order.CONFIRMED).count(),
-            "completed": self.vendor.orders.filter(status=Order.COMPLETED).count(),
-            "shipped": self.vendor.orders.filter(status=Order.SHIPPED).count(),
-            "all": self.vendor.orders.all().count(),
-        })
-        context.update(orders={
-            "confirmed": self.vendor.orders.filter(status=Order.CONFIRMED).order_by('-modified')[:10],
-            "completed": self.vendor.orders.filter(status=Order.COMPLETED).order_by('-modified')[:10],
-        })
-        context.update(
-            offers=models.Offer.objects.filter(
-                vendor=self.vendor, active=True).order_by('-created')[:10],
-            offers_count=models.Offer.objects.filter(vendor=self.vendor, active=True).count(),
-            offers_deleted=models.Offer.objects.filter(
-                vendor=self.vendor, active=False, removed=False).order_by('-created')[:10])
+        context.update(data)
         return self.render_to_response(context)
 
 
@@ -4,6 +4,8 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from importlib import import_module
 
+from market.tariff import statistics
+
 
 class Command(BaseCommand):
     """Load testing data and move necessary files via calling <appname>.test_data.load()."""
@@ -24,6 +26,7 @@ class Command(BaseCommand):
             if not name.startswith("market"):
                 name = ".".join(("market", name, self.module_name))
             test_data = import_module(name)
-            test_data.load()
+            with statistics.coalesce():
+                test_data.load()
         except ImportError as e:
             print("Problem importing {0} - {1!s}".format(name, e))
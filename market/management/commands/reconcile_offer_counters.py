@@ -0,0 +1,21 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from market.core import counters
+
+
+class Command(BaseCommand):
+    help = "Verify (and with --repair fix) vendors' stored counts and values of active offers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', default=False,
+                            help='Store the correct values')
+        parser.add_argument('--batch-size', type=int, default=counters.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        drift = counters.reconcile(batch_size=options['batch_size'], repair=options['repair'])
+        for pk, values in sorted(drift.items()):
+            self.stdout.write("Vendor {:d}: {}".format(
+                pk, ", ".join("{}={}".format(field, value) for field, value in sorted(values.items()))))
+        verb = "Repaired" if options['repair'] else "Found"
+        self.stdout.write("{} {:d} drifted vendors".format(verb, len(drift)))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import django.db.models.deletion
+
+from django.utils.translation import gettext as _
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0002_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name=_('ID'))),
+                ('quantity', models.PositiveIntegerField(verbose_name=_('Quantity'))),
+                ('expires', models.DateTimeField(db_index=True, verbose_name=_('Expires'))),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='market.Offer', verbose_name=_('Offer'))),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='market.Order', verbose_name=_('Order'))),
+            ],
+            options={
+                'verbose_name': _('Reservation'),
+                'verbose_name_plural': _('Reservations'),
+            },
+        ),
+    ]
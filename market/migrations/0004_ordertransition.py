@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+import django.db.models.deletion
+
+from django.utils.translation import gettext as _
+
+STATUS_CODES = [(10, 'Processing'), (20, 'Confirming'), (25, 'Unconfirmed'), (30, 'Confirmed'),
+                (40, 'Paid'), (45, 'Shipped'), (50, 'Received'), (60, 'Canceled')]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('market', '0003_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTransition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name=_('ID'))),
+                ('old_status', models.IntegerField(choices=STATUS_CODES, verbose_name=_('Old status'))),
+                ('new_status', models.IntegerField(choices=STATUS_CODES, verbose_name=_('New status'))),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name=_('Created'))),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='market.Order', verbose_name=_('Order'))),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name=_('User'))),
+            ],
+            options={
+                'verbose_name': _('Order transition'),
+                'verbose_name_plural': _('Order transitions'),
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+from django.utils.translation import gettext as _
+
+# choose optimized JSONField for default database
+if "postgres" in settings.DATABASES['default']['ENGINE']:
+    from django.contrib.postgres.fields import jsonb as jsonfield
+else:
+    import jsonfield
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0004_ordertransition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name=_('ID'))),
+                ('name', models.CharField(max_length=255, verbose_name=_('Task'))),
+                ('args', jsonfield.JSONField(blank=True, null=True, verbose_name=_('Arguments'))),
+                ('key', models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name=_('Idempotency key'))),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Running'), (2, 'Done'), (3, 'Failed')], default=0, verbose_name=_('Status'))),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name=_('Attempts'))),
+                ('max_attempts', models.PositiveIntegerField(default=5, verbose_name=_('Maximal attempts'))),
+                ('run_at', models.DateTimeField(db_index=True, verbose_name=_('Run at'))),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name=_('Locked at'))),
+                ('error', models.TextField(blank=True, verbose_name=_('Last error'))),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name=_('Created'))),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name=_('Updated'))),
+            ],
+            options={
+                'verbose_name': _('Task'),
+                'verbose_name_plural': _('Tasks'),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='task',
+            index_together=set([('status', 'run_at')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_task'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='order',
+            index_together=set([('vendor', 'status', 'created')]),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+
+import market.utils.models
+
+from django.utils.translation import gettext as _
+
+
+def fill_totals(apps, schema_editor):
+    """Compute initial values - suborders from their rows, top-orders from suborders."""
+    Order = apps.get_model('market', 'Order')
+    OrderPayment = apps.get_model('market', 'OrderPayment')
+    ExtraOrderPriceField = apps.get_model('market', 'ExtraOrderPriceField')
+
+    def grouped(queryset, field):
+        return dict(queryset.order_by().values('order').annotate(sum=Sum(field))
+                                       .values_list('order', 'sum'))
+
+    shipping = grouped(ExtraOrderPriceField.objects.filter(is_shipping=True), 'value')
+    paid = grouped(OrderPayment.objects.all(), 'amount')
+    tops = {}
+    for pk, top_id in Order.objects.filter(order__isnull=False).values_list('pk', 'order'):
+        values = {'shipping_total': shipping.get(pk) or Decimal('0.00'),
+                  'amount_paid': paid.get(pk) or Decimal('0.00')}
+        Order.objects.filter(pk=pk).update(**values)
+        top = tops.setdefault(top_id, {'shipping_total': Decimal('0.00'),
+                                       'amount_paid': paid.get(top_id) or Decimal('0.00')})
+        top['shipping_total'] += values['shipping_total']
+        top['amount_paid'] += values['amount_paid']
+    for pk, values in tops.items():
+        Order.objects.filter(pk=pk).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_order_vendor_status_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='shipping_total',
+            field=market.utils.models.CurrencyField(decimal_places=2, default=Decimal('0.0'), max_digits=30, verbose_name=_('Shipping total')),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='amount_paid',
+            field=market.utils.models.CurrencyField(decimal_places=2, default=Decimal('0.0'), max_digits=30, verbose_name=_('Amount paid')),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
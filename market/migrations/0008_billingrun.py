@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0007_order_denormalized_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('period_end', models.DateField()),
+                ('status', models.IntegerField(choices=[(0, 'Running'), (1, 'Done'), (2, 'Failed')], default=0)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('bill', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='market.Bill')),
+                ('billing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='market.Billing')),
+            ],
+            options={
+                'verbose_name': 'Billing run',
+                'verbose_name_plural': 'Billing runs',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='billingrun',
+            unique_together=set([('billing', 'period_end')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0008_billingrun'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='statistics',
+            index_together=set([('vendor', 'created')]),
+        ),
+    ]
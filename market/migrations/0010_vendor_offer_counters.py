@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+import market.utils.models
+
+
+def fill_counters(apps, schema_editor):
+    """Count active offers in stock of every vendor."""
+    Vendor = apps.get_model('market', 'Vendor')
+    Offer = apps.get_model('market', 'Offer')
+    counts = (Offer.objects.filter(active=True).exclude(quantity=0).order_by().values('vendor')
+                           .annotate(count=Count('pk'), total=Sum('unit_price'))
+                           .values_list('vendor', 'count', 'total'))
+    for vendor_id, count, total in counts:
+        Vendor.objects.filter(pk=vendor_id).update(offer_count=count,
+                                                   offer_total=total or Decimal('0.00'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_statistics_vendor_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vendor',
+            name='offer_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='offer_total',
+            field=market.utils.models.CurrencyField(decimal_places=2, default=Decimal('0.0'), editable=False, max_digits=30),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
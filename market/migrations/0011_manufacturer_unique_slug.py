@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from market.utils.models import pick_slugs
+
+
+def deduplicate_slugs(apps, schema_editor):
+    """Give a new slug to every manufacturer sharing its slug with an older one."""
+    Manufacturer = apps.get_model('market', 'Manufacturer')
+    taken, duplicates = set(), []
+    for pk, slug in Manufacturer.objects.order_by('pk').values_list('pk', 'slug'):
+        if slug in taken:
+            duplicates.append((pk, slug))
+        taken.add(slug)
+    slugs = pick_slugs([slug for pk, slug in duplicates], taken)
+    for (pk, slug), unique in zip(duplicates, slugs):
+        Manufacturer.objects.filter(pk=pk).update(slug=unique)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_vendor_offer_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='manufacturer',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# coding: utf-8
+"""Parallel and resumable billing of vendors.
+
+Due billings are split into batches processed by a pool of workers. Every
+billing is billed in its own transaction holding a row lock taken with
+``SELECT ... FOR UPDATE SKIP LOCKED`` (where the database supports it) so
+concurrent runners never bill the same vendor twice - the other one simply
+skips the locked row. The outcome is recorded per vendor and period in
+`BillingRun`; a crashed run leaves nothing half-billed (the transaction
+rolls back) and the next run picks the unfinished vendors up again while
+the DONE periods are never billed again.
+
+Bills are emailed by the background task queue after commit instead of
+inside the billing transaction.
+"""
+import logging
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from market.checkout import queue
+
+from . import models
+from . import tasks
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+WORKERS = 4
+
+BILLED = "billed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def due(today=None):
+    """Active billings whose period has ended."""
+    return models.Billing.objects.filter(active=True, next_billing__lte=today or timezone.now().date())
+
+
+def _lock(queryset):
+    """Lock rows skipping those locked by another runner (if the database can)."""
+    if getattr(connection.features, "has_select_for_update_skip_locked", False):
+        return queryset.select_for_update(skip_locked=True)
+    return queryset.select_for_update()
+
+
+def bill_one(billing_id, today=None):
+    """Bill one vendor unless somebody else does/did it; return the outcome."""
+    today = today or timezone.now().date()
+    with transaction.atomic():
+        billing = _lock(due(today).filter(pk=billing_id)).select_related("vendor").first()
+        if billing is None:
+            return SKIPPED  # billed meanwhile or locked by a concurrent runner
+        run, created = models.BillingRun.objects.get_or_create(
+            billing=billing, period_end=billing.next_billing,
+            defaults={"period_start": billing.last_billed})
+        if run.status == models.BillingRun.DONE:
+            logger.warning("Period %s of billing %d was billed already", run.period_end, billing.pk)
+            return SKIPPED
+        try:
+            with transaction.atomic():
+                bill = billing.bill(send=False)
+        except Exception as e:
+            logger.exception("Billing of %s failed", billing.vendor)
+            run.status, run.error = models.BillingRun.FAILED, str(e)
+            run.attempts += 1
+            run.finished = timezone.now()
+            run.save()
+            return FAILED
+        run.status, run.bill, run.error = models.BillingRun.DONE, bill, ""
+        run.attempts += 1
+        run.finished = timezone.now()
+        run.save()
+        queue.enqueue_on_commit(tasks.send_bill, bill.pk, key="tariff-bill:{}".format(bill.pk))
+    return BILLED
+
+
+def _bill_batch(billing_ids, today):
+    outcomes = Counter()
+    try:
+        for billing_id in billing_ids:
+            outcomes[bill_one(billing_id, today)] += 1
+    finally:
+        connection.close()
+    return outcomes
+
+
+def run(workers=WORKERS, batch_size=BATCH_SIZE, today=None):
+    """Bill all due vendors in parallel.
+
+    :returns: dict with counts of billed/skipped/failed vendors, elapsed seconds and rate
+    """
+    today = today or timezone.now().date()
+    ids = list(due(today).order_by("pk").values_list("pk", flat=True))
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    start = time.time()
+    outcomes = Counter()
+    if workers <= 1:
+        for batch in batches:
+            for billing_id in batch:
+                outcomes[bill_one(billing_id, today)] += 1
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(lambda batch: _bill_batch(batch, today), batches):
+                outcomes.update(result)
+    elapsed = time.time() - start
+    stats = {
+        BILLED: outcomes[BILLED],
+        SKIPPED: outcomes[SKIPPED],
+        FAILED: outcomes[FAILED],
+        "elapsed": elapsed,
+        "rate": outcomes[BILLED] / elapsed if elapsed else 0.0,
+    }
+    logger.info("Billing run finished %s", stats)
+    return stats
@@ -0,0 +1,141 @@
+# coding: utf-8
+"""Read-only forecast of vendors' bills.
+
+For every active billing it computes the bill the vendor would get on a
+given day - the regular bill when their period ends until that day, the
+closing bill (see `Billing.close`) otherwise. Nothing is written: billings,
+statistics and discounts of all vendors are loaded by a few queries and the
+same in-memory code path as `Billing.bill` (`Billing.segments` and
+`Billing.items`) runs over them, so the forecast doubles as a benchmark of
+the billing computation itself.
+"""
+import csv
+import json
+import logging
+import time
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "json")
+
+COLUMNS = ("vendor", "name", "period_start", "period_end", "due", "tariff",
+           "subtotal", "discount", "total")
+
+
+def billings():
+    """Active billings with their vendors."""
+    return models.Billing.objects.filter(active=True).select_related("vendor").order_by("pk")
+
+
+def histories(vendor_ids, since, until):
+    """Statistics of `vendor_ids` relevant for billing any time in [since, until].
+
+    That is the last stats of every vendor created before `since` and all the
+    stats created later (three queries for all vendors).
+    :returns: dict vendor ID -> list of stats ordered by creation
+    """
+    qs = models.Statistics.objects.filter(vendor__in=vendor_ids).select_related("tariff")
+    primes = dict(qs.filter(created__lte=since).order_by()
+                    .values_list("vendor").annotate(last=Max("created")))
+    history = defaultdict(list)
+    for stat in qs.filter(created__in=set(primes.values())).order_by("created", "pk"):
+        if primes.get(stat.vendor_id) == stat.created:
+            history[stat.vendor_id] = [stat]  # the last of equally old ones wins
+    for stat in qs.filter(created__gt=since, created__lte=until).order_by("created", "pk"):
+        history[stat.vendor_id].append(stat)
+    return history
+
+
+def discounts(vendor_ids):
+    """Available discounts of `vendor_ids` (one query) keyed by vendor ID."""
+    available = defaultdict(list)
+    for discount in (models.Discount.objects.filter(vendor__in=vendor_ids, usages__gt=0)
+                                            .order_by("vendor", "-percent", "pk")):
+        available[discount.vendor_id].append(discount)
+    return available
+
+
+def forecast(day=None):
+    """Project bills of all active vendors on `day` (today by default).
+
+    :returns: list of dicts with `COLUMNS` keys, one per vendor with something to bill
+    """
+    day = day or timezone.now().date()
+    active = [billing for billing in billings() if billing.last_billed < day]
+    periods = {billing.pk: billing.segments(until=min(billing.next_billing, day))
+               for billing in active}
+    bounds = [segment for segments in periods.values() for segment in segments]
+    if not bounds:
+        return []
+    vendor_ids = [billing.vendor_id for billing in active]
+    history = histories(vendor_ids, min(start for start, end in bounds),
+                        max(end for start, end in bounds))
+    available = discounts(vendor_ids)
+
+    bills = []
+    for billing in active:
+        segments, stats = periods[billing.pk], history.get(billing.vendor_id)
+        if not segments or not stats:
+            continue
+        try:
+            items = billing.items(segments, stats, available.get(billing.vendor_id, []))
+        except models.Statistics.DoesNotExist:
+            logger.warning("Billing %d can not be forecast - no statistics", billing.pk)
+            continue
+        subtotal = sum((price for label, price, tax in items if price > 0), Decimal("0.00"))
+        discount = sum((price for label, price, tax in items if price < 0), Decimal("0.00"))
+        bills.append({
+            "vendor": billing.vendor_id,
+            "name": billing.vendor.name,
+            "period_start": billing.last_billed,
+            "period_end": min(billing.next_billing, day),
+            "due": billing.next_billing <= day,
+            "tariff": stats[-1].tariff.name,
+            "subtotal": subtotal,
+            "discount": discount,
+            "total": max(subtotal + discount, Decimal("0.00")),  # rounding price to zero
+        })
+    return bills
+
+
+def run(day=None):
+    """Compute the forecast and measure it.
+
+    :returns: (bills, stats) where stats hold the number of vendors, the
+              projected revenue (total and per current tariff), elapsed seconds and rate
+    """
+    start = time.time()
+    bills = forecast(day)
+    elapsed = time.time() - start
+    tariffs = defaultdict(Decimal)
+    for bill in bills:
+        tariffs[bill["tariff"]] += bill["total"]
+    stats = {
+        "vendors": len(bills),
+        "due": sum(1 for bill in bills if bill["due"]),
+        "revenue": sum((bill["total"] for bill in bills), Decimal("0.00")),
+        "tariffs": dict(tariffs),
+        "elapsed": elapsed,
+        "rate": len(bills) / elapsed if elapsed else 0.0,
+    }
+    return bills, stats
+
+
+def write_csv(fileobj, bills):
+    writer = csv.writer(fileobj)
+    writer.writerow(COLUMNS)
+    for bill in bills:
+        writer.writerow([bill[column] for column in COLUMNS])
+
+
+def write_json(fileobj, bills):
+    json.dump(bills, fileobj, cls=DjangoJSONEncoder, indent=2)
@@ -0,0 +1,82 @@
+# coding: utf-8
+"""In-memory index of active tariffs.
+
+Tariffs change rarely but a tariff is chosen for every statistics snapshot.
+The active tariffs are loaded once per process into a list ordered by price
+(`daily`) and the cheapest one covering a vendor's quantity and price is
+found without touching the database. Saving or deleting a `Tariff` drops the
+index in the current process and, once the transaction commits, bumps a
+version in the shared cache so other processes reload it too.
+"""
+import threading
+
+from django.core.cache import cache
+
+INDEX_VERSION_KEY = "market:tariff:index:version"
+
+_lock = threading.Lock()
+_index = None
+
+
+class TariffIndex(object):
+    """Active tariffs ordered from the cheapest."""
+
+    def __init__(self, tariffs, version=None):
+        self.tariffs = list(tariffs)
+        self.version = version
+
+    def lookup(self, quantity, price):
+        """Return the cheapest tariff with limits covering `quantity` and `price`.
+
+        :raises IndexError: when no tariff is big enough
+        """
+        for tariff in self.tariffs:
+            if tariff.quantity >= quantity and tariff.price >= price:
+                return tariff
+        raise IndexError("No tariff covers quantity {} and price {}".format(quantity, price))
+
+    def assign(self, stats):
+        """Set `tariff` of many `Statistics` at once."""
+        for stat in stats:
+            stat.tariff = self.lookup(stat.quantity, stat.price)
+        return stats
+
+
+def load():
+    """Build the index from the database."""
+    from .models import Tariff
+    return TariffIndex(Tariff.objects.filter(active=True).order_by("daily", "pk"),
+                       version=cache.get(INDEX_VERSION_KEY))
+
+
+def get():
+    """Return the index of this process (reloaded when a tariff changed anywhere)."""
+    global _index
+    index = _index
+    if index is None or index.version != cache.get(INDEX_VERSION_KEY):
+        with _lock:
+            index = _index = load()
+    return index
+
+
+def forget():
+    """Drop the index of this process only."""
+    global _index
+    _index = None
+
+
+def invalidate():
+    """Drop the index here and in other processes."""
+    forget()
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(INDEX_VERSION_KEY, 1, None)
+
+
+def lookup(quantity, price):
+    return get().lookup(quantity, price)
+
+
+def assign(stats):
+    return get().assign(stats)
@@ -1,15 +1,21 @@
 # coding: utf-8
-from datetime import date
 from django.core.management.base import BaseCommand
 
-from market.tariff.models import Billing
+from market.tariff import billing
 
 
 class Command(BaseCommand):
     args = ''
     help = 'Issue billing of the customers which has entered billing period'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=billing.WORKERS,
+                            help='Number of vendors billed in parallel')
+        parser.add_argument('--batch-size', type=int, default=billing.BATCH_SIZE,
+                            help='Number of vendors handed to a worker at once')
+
     def handle(self, *args, **options):
-        billings = Billing.objects.filter(next_bill__lte=date.now(), active=True)
-        for billing in billings:
-            billing.bill()
+        stats = billing.run(workers=options['workers'], batch_size=options['batch_size'])
+        self.stdout.write(
+            "Billed {billed:d}, skipped {skipped:d}, failed {failed:d} vendors "
+            "in {elapsed:.1f}s ({rate:.1f} vendors/s)".format(**stats))
@@ -0,0 +1,25 @@
+# coding: utf-8
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from market.core.models import Vendor
+from market.tariff import statistics
+
+
+class Command(BaseCommand):
+    help = 'Merge historical statistics which can not change any bill'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor', action='append', help='UID of a vendor (all vendors by default)')
+        parser.add_argument('--keep-days', type=int, default=0,
+                            help='Leave statistics of the last days untouched (besides today)')
+        parser.add_argument('--batch-size', type=int, default=statistics.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        vendor_ids = None
+        if options['vendor']:
+            vendor_ids = Vendor.objects.filter(uid__in=options['vendor']).values_list('pk', flat=True)
+        before = statistics.start_of_today() - timedelta(days=options['keep_days'])
+        deleted = statistics.compact(vendor_ids, before=before, batch_size=options['batch_size'])
+        self.stdout.write("Merged {:d} statistics".format(deleted))
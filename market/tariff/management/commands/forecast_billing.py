@@ -0,0 +1,36 @@
+# coding: utf-8
+import sys
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.tariff import forecast
+
+
+class Command(BaseCommand):
+    help = 'Forecast bills of all active vendors on a day without billing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day of the forecast (YYYY-MM-DD, today by default)')
+        parser.add_argument('--format', choices=forecast.FORMATS, default='csv')
+        parser.add_argument('--output', help='Output file (stdout by default)')
+
+    def handle(self, *args, **options):
+        day = None
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Invalid date {}".format(options['date']))
+        bills, stats = forecast.run(day)
+
+        write = forecast.write_json if options['format'] == 'json' else forecast.write_csv
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                write(f, bills)
+        else:
+            write(sys.stdout, bills)
+        self.stderr.write(
+            "Forecast {vendors:d} vendors ({due:d} due) with revenue {revenue} "
+            "in {elapsed:.2f}s ({rate:.1f} vendors/s)".format(**stats))
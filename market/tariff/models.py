@@ -11,7 +11,7 @@ from monthdelta import monthdelta, monthmod
 
 from django.db import models
 from django.db.models.signals import post_save, post_delete
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.conf import settings
 from django.dispatch import receiver
 from django.utils import timezone
@@ -25,7 +25,9 @@ from dbmail import send_db_mail
 from market.core.models import Vendor, Offer
 from market.core.signals import vendor_open, vendor_closed
 from market.utils import defaults
-from market.utils.models import CurrencyField
+from market.utils.models import CurrencyField, bulk_update
+
+from . import index
 
 logger = logging.getLogger(__name__)
 
@@ -85,8 +87,44 @@ class Billing(models.Model):
         self.next_billing = timezone.now().date()
         return self.bill()
 
+    def segments(self, until=None):
+        """Split the billing period into months and the remaining days.
+
+        :param until: end of the period instead of `next_billing` (e.g. for a forecast)
+        :return: list of (start, end) datetimes
+        """
+        until = until or self.next_billing
+        months, rest = monthmod(self.last_billed, until)
+        # tranform date to datetime for billing useng StatisticsManager
+        last_billed = datetime(self.last_billed.year, self.last_billed.month, self.last_billed.day)
+        # bill by months (because of Discounts and better visibility on the bill)
+        segments = [(last_billed + monthdelta(month), last_billed + monthdelta(month + 1))
+                    for month in range(months.months)]
+        # bill the remaining time (if there is some)
+        if rest.days > 1:
+            segments.append((last_billed + months, last_billed + months + rest))
+        return segments
+
+    def items(self, segments, history, discounts):
+        """Compute bill items (label, price, tax) of `segments` without touching the database.
+
+        :param history: preloaded `Statistics.objects.history` covering the segments
+        :param discounts: preloaded `Discount.objects.available` (usages are counted down)
+        """
+        items = []
+        for start, end in segments:
+            total = Decimal("0.00")
+            for tariff, price in Statistics.objects.bill(self.vendor, start, end, history):
+                items.append((tariff, price, settings.TAX))
+                total += price
+
+            discount = Discount.objects.cut_the_price(self.vendor, total, discounts)
+            if discount is not None:
+                items.append(discount)
+        return items
+
     @transaction.atomic
-    def bill(self):
+    def bill(self, send=True):
         """
         Issue a bill for a vendor.
 
@@ -96,10 +134,11 @@ class Billing(models.Model):
         We have to bill the vendor at the time of call. Only when the billing happened already
         today (or in the future) we will ignore that call.
 
+        :param send: email the bill right away (the billing runner sends it in background)
         :rvalue:`tariff.Bill` the created bill (invoice)
         """
         if self.last_billed >= timezone.now().date():
-            return Bill.objects.filter(period_end=timezone.now().date()).get()
+            return Bill.objects.filter(vendor=self.vendor, period_end=timezone.now().date()).get()
 
         if self.next_billing > timezone.now().date():
             raise ValueError("Can not bill before the end of billing period - close it instead.")
@@ -111,34 +150,14 @@ class Billing(models.Model):
             period_start=self.last_billed, period_end=self.next_billing,
             contractor=contractor.address, contractor_bank=contractor.bank_account)
 
-        months, rest = monthmod(self.last_billed, self.next_billing)
-        # tranform date to datetime for billing useng StatisticsManager
-        last_billed = datetime(self.last_billed.year, self.last_billed.month, self.last_billed.day)
-        # bill by months (because of Discounts and better visibility on the bill)
-        for month in range(months.months):
-            total = Decimal("0.00")
-            for tariff, price in Statistics.objects.bill(self.vendor,
-                                                         last_billed + monthdelta(month),
-                                                         last_billed + monthdelta(month + 1)):
-                bill.add_item(tariff, price, settings.TAX)
-                total += price
-
-            discount = Discount.objects.cut_the_price(self.vendor, total)
-            if discount is not None:
-                bill.add_item(*discount)
-
-        # bill the remaining time (if there is some)
-        if rest.days > 1:
-            total = Decimal("0.00")
-            for tariff, price in Statistics.objects.bill(self.vendor,
-                                                         last_billed + months,
-                                                         last_billed + months + rest):
-                bill.add_item(tariff, price, settings.TAX)
-                total += price
-
-            discount = Discount.objects.cut_the_price(self.vendor, total)
-            if discount is not None:
-                bill.add_item(*discount)
+        # load statistics and discounts once and slice them by segments in memory
+        segments = self.segments()
+        history = (Statistics.objects.history(self.vendor, segments[0][0], segments[-1][1])
+                   if segments else [])
+        discounts = Discount.objects.available(self.vendor, lock=True)
+        for item in self.items(segments, history, discounts):
+            bill.add_item(*item)
+        Discount.objects.store_usages(discounts)
 
         if bill.total < 0:
             bill.add_item(_("Rounding price to zero"), -1 * bill.total)
@@ -147,7 +166,8 @@ class Billing(models.Model):
 
         self.save()  # periods change is taken care of in .save() method
         bill.save()
-        bill.send()
+        if send:
+            bill.send()
         return bill
 
 
@@ -195,33 +215,68 @@ class StatisticsManager(models.Manager):
     def create(self, vendor, save=True, **kwargs):
         """Precompute stats upon creation of new stats."""
         stat = Statistics(vendor=vendor)
-        qs = vendor.offer_set.filter(active=True).exclude(quantity=0)
-        stat.quantity = qs.count()
-        stat.price = qs.aggregate(models.Sum('unit_price'))['unit_price__sum'] or Decimal(0)
-        stat.tariff = Tariff.objects.filter(
-            active=True, quantity__gte=stat.quantity, price__gte=stat.price).order_by("daily")[0]
+        # read the counters fresh - `vendor` might have been loaded before its offers changed
+        stat.quantity, stat.price = Vendor.objects.filter(pk=vendor.pk).values_list(
+            "offer_count", "offer_total").get()
+        stat.tariff = index.lookup(stat.quantity, stat.price)
         if save:
             stat.save(using=self._db)
         return stat
 
+    def refresh(self, vendor):
+        """Store new stats of `vendor` if they differ from the current ones.
+
+        The vendor is notified when the change moved them into another tariff.
+        :returns: the new stats or None when nothing changed
+        """
+        prev_stats = self.current(vendor)
+        new_stats = self.create(vendor, save=False)
+        if new_stats == prev_stats:
+            return None
+        new_stats.save(using=self._db)
+        if prev_stats.tariff != new_stats.tariff:
+            send_db_mail('tariff-changed', vendor.user.email, {
+                'tariff': new_stats.tariff,
+                'discounts': Discount.objects.filter(vendor=vendor, usages__gt=0)})
+        return new_stats
+
     def current(self, vendor):
         """Return the most recent stats (since we keep historical records)."""
         return self.get_queryset().filter(vendor=vendor).latest("created")
 
-    def bill(self, vendor, period_start, period_end):
+    def history(self, vendor, period_start, period_end):
+        """Load all stats relevant for billing `vendor` in the period (two queries).
+
+        That is the last stats created before `period_start` followed by all
+        stats created during the period ordered by creation.
+        """
+        qs = self.get_queryset().filter(vendor=vendor).select_related("tariff")
+        prime = qs.filter(created__lte=period_start).order_by("-created", "-pk").first()
+        following = list(qs.filter(created__gt=period_start,
+                                   created__lte=period_end).order_by("created", "pk"))
+        return ([prime] if prime is not None else []) + following
+
+    def bill(self, vendor, period_start, period_end, history=None):
         """Use statistics records to select propriate tariffs.
 
+        :param history: preloaded `history` covering the period (one billing
+                        slices the history of its whole period by months)
         :return: list of tuples(<text>, price) ready to be added to a bill
         """
-        prime = self.get_queryset().filter(vendor=vendor,
-                                           created__lte=period_start
-                                           ).latest("created")
-        following = self.get_queryset().filter(vendor=vendor,
-                                               created__gt=period_start,
-                                               created__lte=period_end
-                                               ).order_by("created")
+        if history is None:
+            history = self.history(vendor, period_start, period_end)
+        start, end = _comparable(period_start), _comparable(period_end)
+        prime, following = None, []
+        for stat in history:
+            if stat.created <= start:
+                prime = stat
+            elif stat.created <= end:
+                following.append(stat)
+        if prime is None:
+            raise self.model.DoesNotExist("No statistics of {} before {}".format(vendor, period_start))
+
         monthly = 0
-        if following.count() == 0:
+        if len(following) == 0:
             # there was no change in Offers during the whole billing period
             monthly = prime.tariff.total(period_start, period_end)
             return [(prime.to_string(period_start, period_end), monthly)]  # price
@@ -250,6 +305,13 @@ class StatisticsManager(models.Manager):
         return bill_items
 
 
+def _comparable(moment):
+    """Make naive period bounds comparable with `created` the same way the ORM does."""
+    if settings.USE_TZ and timezone.is_naive(moment):
+        return timezone.make_aware(moment, timezone.get_default_timezone())
+    return moment
+
+
 @python_2_unicode_compatible
 class Statistics(models.Model):
     """Statistics computed after addition of every :model:`core.Offer`.
@@ -269,6 +331,7 @@ class Statistics(models.Model):
     class Meta:
         """Explicitely mark the app_label."""
         app_label = "market"
+        index_together = (('vendor', 'created'), )
         verbose_name = _("Statistics")
         verbose_name_plural = _("Statistics")
 
@@ -288,6 +351,44 @@ class Statistics(models.Model):
                           _("until"), u"{:%d.%m %Y}".format(end)))
 
 
+class BillingRun(models.Model):
+    """State of billing of one vendor's period by the billing runner (see `tariff.billing`).
+
+    A period is billed at most once - DONE rows are unique per (billing, period_end).
+    """
+
+    RUNNING = 0
+    DONE = 1
+    FAILED = 2
+
+    STATUS_CODES = (
+        (RUNNING, lazy_('Running')),
+        (DONE, lazy_('Done')),
+        (FAILED, lazy_('Failed')),
+    )
+
+    billing = models.ForeignKey('market.Billing', on_delete=models.CASCADE, related_name='runs')
+    period_start = models.DateField()
+    period_end = models.DateField()
+    status = models.IntegerField(choices=STATUS_CODES, default=RUNNING)
+    bill = models.ForeignKey('market.Bill', null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """Explicitely mark the app_label."""
+        app_label = "market"
+        unique_together = (('billing', 'period_end'), )
+        verbose_name = _("Billing run")
+        verbose_name_plural = _("Billing runs")
+
+    def __str__(self):
+        return u"{} {:%d.%m.%Y} - {:%d.%m.%Y} [{}]".format(
+            self.billing_id, self.period_start, self.period_end, self.get_status_display())
+
+
 class Bill(Invoice):
     """The billing document for every closed billing period."""
 
@@ -311,16 +412,42 @@ class Bill(Invoice):
 class DiscountManager(models.Manager):
     """Provide complicated discount selection."""
 
-    def cut_the_price(self, vendor, total):
-        """Find the best discount for given total."""
+    def available(self, vendor, lock=False):
+        """Vendor's discounts with remaining usages, the best first.
+
+        :param lock: lock the rows until the end of the transaction (usages
+                     are going to be written by `store_usages`)
+        """
+        qs = self.get_queryset().filter(vendor=vendor, usages__gt=0).order_by("-percent", "pk")
+        if lock:
+            qs = qs.select_for_update()
+        return list(qs)
+
+    def cut_the_price(self, vendor, total, discounts=None):
+        """Find the best discount for given total.
+
+        :param discounts: preloaded `available` discounts - usages are then
+                          only counted down in memory and stored by `store_usages`
+        """
         if total <= 0.0:
             return None
-        candidate = self.get_queryset().filter(vendor=vendor, usages__gt=0)
-        if candidate.exists():
-            best = candidate.order_by("-percent")[0]
-            return best.use(total)
+        if discounts is not None:
+            for discount in discounts:
+                if discount.usages > 0:
+                    discount.usages -= 1
+                    return discount.price_cut(total)
+            return None
+        for candidate in self.get_queryset().filter(vendor=vendor, usages__gt=0).order_by("-percent", "pk"):
+            item = candidate.use(total)
+            if item is not None:
+                return item  # otherwise somebody used the last usage meanwhile
         return None
 
+    def store_usages(self, discounts):
+        """Write usages of preloaded discounts by one UPDATE."""
+        return bulk_update(self.model, {discount.pk: {"usages": discount.usages}
+                                        for discount in discounts})
+
 
 @python_2_unicode_compatible
 class Discount(models.Model):
@@ -343,12 +470,23 @@ class Discount(models.Model):
         return "{} {:d}% {} {:d} {}.".format(
             _("Discount"), self.percent, _("for next"), self.usages, _("paid months"))
 
-    def use(self, total):
-        """Use once this discount on `total`."""
-        self.usages -= 1
-        self.save()
+    def price_cut(self, total):
+        """Return bill item (label, price, tax) of this discount applied on `total`."""
         discount = Decimal("-0.01") * self.percent * total
-        return (self.name, discount.to_integral_value(), app_settings.TAX)
+        return (self.name, discount.to_integral_value(), settings.TAX)
+
+    def use(self, total):
+        """Use once this discount on `total`.
+
+        The usage is taken by a conditional UPDATE so concurrent callers never
+        redeem more usages than there are.
+        :returns: bill item (label, price, tax) or None when no usage was left
+        """
+        used = Discount.objects.filter(pk=self.pk, usages__gt=0).update(usages=models.F("usages") - 1)
+        self.usages = Discount.objects.values_list("usages", flat=True).get(pk=self.pk)
+        if not used:
+            return None
+        return self.price_cut(total)
 
 
 class Campaign(models.Model):
@@ -371,17 +509,27 @@ class Campaign(models.Model):
     def __str__(self):
         return self.discount.name
 
+    @transaction.atomic
     def use(self, vendor):
-        """Use the campaign once to give the `vendor` a discount."""
-        if self.vendors.filter(pk=vendor.pk).exists():
+        """Use the campaign once to give the `vendor` a discount.
+
+        The usage is taken by a conditional UPDATE and the redemption is
+        recorded in the (campaign, vendor) unique table of `vendors` so neither
+        concurrent vendors exhaust more usages nor one vendor redeems twice.
+        :raises ValueError: when the campaign is used up or the vendor redeemed it already
+        """
+        if not Campaign.objects.filter(pk=self.pk, usages__gt=0).update(usages=models.F("usages") - 1):
+            raise ValueError(_("The campaign is over"))
+        try:
+            with transaction.atomic():
+                Campaign.vendors.through.objects.create(campaign=self, vendor=vendor)
+        except IntegrityError:
             raise ValueError(_("Vendor already has this discount"))
-        self.usages -= 1
-        self.vendors.add(vendor)
+        self.usages = Campaign.objects.values_list("usages", flat=True).get(pk=self.pk)
         discount = copy(self.discount)
         discount.pk = None
         discount.vendor = vendor
         discount.save(force_insert=True)
-        self.save()
 
     @cached_property
     def used(self):
@@ -421,21 +569,26 @@ def vendor_open_hook(sender, instance, created, **kwargs):
 
 @receiver(vendor_closed, sender=Vendor)
 def vendor_closed_hook(sender, instance, **kwargs):
-    """Finalize Billing and Statistics for a closed vendor."""
-    Billing.objects.get(vendor=instance).close()
+    """Finalize Statistics for a closed vendor and close the Billing in background."""
+    from market.checkout import queue
+    from . import tasks
     Statistics.objects.create(vendor=instance)
-    send_db_mail('tariff-closed', instance.user.email, {"vendor": instance})
+    queue.enqueue_on_commit(tasks.close_billing, instance.pk, key="tariff-close:{}:{:%Y-%m-%d}".format(
+        instance.pk, timezone.now()))
+
+
+@receiver((post_save, post_delete), sender=Tariff)
+def tariff_change_hook(sender, instance, **kwargs):
+    """Tariff limits or prices changed - reload the tariff index.
+
+    This process reloads right away, other processes after the change commits.
+    """
+    index.forget()
+    transaction.on_commit(index.invalidate)
 
 
 @receiver((post_save, post_delete), sender=Offer)
 def offer_change_hook(sender, instance, **kwargs):
-    """Update Statistics based on vendor's wares count and value."""
-    prev_stats = Statistics.objects.current(instance.vendor)
-    new_stats = Statistics.objects.create(instance.vendor, save=False)
-    if new_stats == prev_stats:
-        return
-    new_stats.save()
-    if prev_stats.tariff != new_stats.tariff:
-        send_db_mail('tariff-changed', instance.vendor.user.email, {
-            'tariff': new_stats.tariff,
-            'discounts': Discount.objects.filter(vendor=instance.vendor, usages__gt=0)})
+    """Update Statistics based on vendor's wares count and value (see `tariff.statistics`)."""
+    from market.tariff import statistics
+    statistics.mark_dirty(instance.vendor_id)
@@ -0,0 +1,179 @@
+# coding: utf-8
+"""Coalesced recomputation of vendors' `Statistics`.
+
+Every change of an `Offer` marks its vendor dirty. Dirty vendors are
+collected per transaction and the statistics of each of them are refreshed
+once when the transaction commits (right away in autocommit mode), and
+
+- inside ``with statistics.coalesce():`` (e.g. a feed import saving
+  thousands of offers running many transactions) every dirty vendor is
+  refreshed only once after the outermost block exits
+- with ``MARKET_TARIFF_STATISTICS_DEBOUNCE`` seconds set, the refresh is
+  handed over to the task queue and runs at most once per vendor in every
+  debounce window
+
+The refresh itself (`StatisticsManager.refresh`) compares fresh numbers with
+the current record so the tariff outcomes are identical in all modes.
+
+Old records are merged by `compact`. Billing (`StatisticsManager.bill`)
+walks the records after the last one before a period and starts a new
+tariff period at a record whose tariff and day differ from the last record
+which did not start one. A record with the same tariff and day as its
+predecessor is folded into that predecessor unless the predecessor itself
+may start a period - then the record would start one as well. `redundant`
+tracks which records may start a period in any billed window, so bills
+stay the same whatever periods are billed later.
+"""
+import threading
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from market.checkout import queue
+from market.utils.models import on_commit_once
+
+DEBOUNCE = getattr(settings, "MARKET_TARIFF_STATISTICS_DEBOUNCE", 0)  # seconds
+BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+def _dirty():
+    """Set of dirty vendor IDs of the current coalescing block (or None)."""
+    return getattr(_local, "dirty", None)
+
+
+def refresh(vendor_ids):
+    """Refresh statistics of `vendor_ids` now."""
+    from market.core.models import Vendor
+    from . import models
+    for vendor in Vendor.objects.filter(pk__in=vendor_ids).select_related("user"):
+        models.Statistics.objects.refresh(vendor)
+
+
+def schedule(vendor_ids):
+    """Refresh statistics of `vendor_ids` once in the current debounce window."""
+    from . import tasks
+    window = int(time.time() // DEBOUNCE)
+    for vendor_id in vendor_ids:
+        queue.enqueue_on_commit(tasks.refresh_statistics, vendor_id, delay=DEBOUNCE,
+                                key="tariff-statistics:{}:{}".format(vendor_id, window))
+
+
+def _flush(vendor_ids):
+    vendor_ids = sorted(vendor_id for vendor_id in vendor_ids if vendor_id is not None)
+    if not vendor_ids:
+        return
+    if DEBOUNCE:
+        schedule(vendor_ids)
+    else:
+        refresh(vendor_ids)
+
+
+def mark_dirty(vendor_id):
+    """Note that offers of the vendor changed - refresh its statistics once on commit."""
+    dirty = _dirty()
+    if dirty is not None:
+        dirty.add(vendor_id)
+    else:
+        on_commit_once(_flush, [vendor_id])
+
+
+@contextmanager
+def coalesce():
+    """Refresh statistics of all vendors touched inside the block once at its end."""
+    outermost = _dirty() is None
+    if outermost:
+        _local.dirty = set()
+    try:
+        yield
+        if outermost:
+            dirty, _local.dirty = _local.dirty, None
+            on_commit_once(_flush, dirty)
+    finally:
+        if outermost:
+            _local.dirty = None
+
+
+def _day(moment):
+    """The day of `moment` both as `bill` compares them and in local time (of period bounds)."""
+    if timezone.is_aware(moment):
+        return moment.date(), timezone.localtime(moment).date()
+    return moment.date(), moment.date()
+
+
+def redundant(stats):
+    """Split `stats` (ordered by creation) into merged heads and records to delete.
+
+    A record is deleted when it has the tariff and the day of the kept record
+    before it (its head) and the head can not start a tariff period in any
+    billed window (whole days - see `Billing.segments`). The head can start
+    one when some record billing might compare it with - the record before
+    any window or the last one not starting a period since then - has
+    another tariff and another day.
+
+    :param stats: iterable of (pk, tariff_id, created, quantity, price)
+    :returns: ({head pk: {"quantity": .., "price": ..}}, [pks to delete]) where
+              every head takes over the numbers of the last record merged into it
+    """
+    heads, deleted = {}, []
+    head, marker = None, False
+    # (tariff, day) of records billing might compare the next record with
+    compared = set()
+    for pk, tariff_id, created, quantity, price in stats:
+        day = _day(created)
+        if head is not None and not marker and (tariff_id, day) == head[1:]:
+            deleted.append(pk)
+            heads[head[0]] = {"quantity": quantity, "price": price}
+            continue
+        # records with another tariff and day stay compared, the others give way to this one
+        survivors = {(tariff, other) for tariff, other in compared
+                     if tariff != tariff_id and other != day[0]}
+        marker = bool(survivors)
+        compared = survivors | {(tariff_id, day[0])}
+        head = (pk, tariff_id, day)
+    return heads, deleted
+
+
+def start_of_today():
+    """Midnight starting the current day in the local timezone."""
+    now = timezone.now()
+    return (timezone.localtime(now) if timezone.is_aware(now) else now).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+
+def compact_vendor(vendor_id, before, batch_size=BATCH_SIZE):
+    """Merge statistics of one vendor created before `before`; return the number of deleted."""
+    from . import models
+    from market.utils.models import bulk_update
+    with transaction.atomic():
+        stats = (models.Statistics.objects.filter(vendor=vendor_id, created__lt=before)
+                                          .order_by("created", "pk")
+                                          .values_list("pk", "tariff", "created", "quantity", "price"))
+        heads, deleted = redundant(stats)
+        for i in range(0, len(deleted), batch_size):
+            models.Statistics.objects.filter(pk__in=deleted[i:i + batch_size]).delete()
+        heads = list(heads.items())
+        for i in range(0, len(heads), batch_size):
+            bulk_update(models.Statistics, dict(heads[i:i + batch_size]))
+    return len(deleted)
+
+
+def compact(vendor_ids=None, before=None, batch_size=BATCH_SIZE):
+    """Merge redundant statistics of `vendor_ids` (all vendors by default).
+
+    Only records created before `before` (the local start of today by default) are
+    touched so the current day, still being written, stays intact.
+    :returns: number of deleted records
+    """
+    from . import models
+    if before is None:
+        before = start_of_today()
+    if vendor_ids is None:
+        vendor_ids = (models.Statistics.objects.order_by("vendor")
+                                               .values_list("vendor", flat=True).distinct())
+    return sum(compact_vendor(vendor_id, before, batch_size) for vendor_id in list(vendor_ids))
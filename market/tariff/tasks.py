@@ -0,0 +1,30 @@
+# coding: utf-8
+"""Background tasks of tariffs executed by `checkout.queue`."""
+from dbmail import send_db_mail
+
+from market.checkout.queue import task
+
+from . import models
+
+
+@task
+def send_bill(bill_id):
+    """Email the bill to its vendor."""
+    models.Bill.objects.select_related("vendor__user").get(pk=bill_id).send()
+
+
+@task
+def refresh_statistics(vendor_id):
+    """Refresh statistics of a vendor whose offers changed (debounced)."""
+    from . import statistics
+    statistics.refresh([vendor_id])
+
+
+@task
+def close_billing(vendor_id):
+    """Issue the last bill of a closed vendor (unless they reopened meanwhile)."""
+    billing = models.Billing.objects.select_related("vendor__user").get(vendor=vendor_id)
+    if billing.vendor.active or not billing.active:
+        return
+    billing.close()
+    send_db_mail('tariff-closed', billing.vendor.user.email, {"vendor": billing.vendor})
@@ -1,11 +1,14 @@
 from __future__ import print_function
+import operator
 import os
 import random
 import re
 from decimal import Decimal
+from functools import reduce
 
 from django.apps import apps
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Q, Value, When
 from django.db.models.fields import DecimalField
 from django.core.validators import RegexValidator
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
@@ -42,20 +45,102 @@ class CurrencyField(DecimalField):
         super(CurrencyField, self).__init__(**defaults)
 
 
-def slugify_uniquely(klass, name):
+def _numbered(slug):
+    """Yield (base, number) for every way the `slug` can be read as a numbered base."""
+    for i in range(len(slug) - 1, 0, -1):
+        if not slug[i].isdigit():
+            return
+        yield slug[:i], int(slug[i:])
+
+
+def pick_slugs(bases, taken):
+    """Choose a unique slug for every base slug in `bases` avoiding `taken` ones.
+
+    A free base is used as it is, otherwise the base gets the number following
+    the highest one already used with it (``med``, ``med2``, ``med3`` ...).
+    Chosen slugs are added to `taken`.
+    """
+    highest = {}
+    for slug in taken:
+        for base, number in _numbered(slug):
+            highest[base] = max(highest.get(base, 1), number)
+    slugs = []
+    for base in bases:
+        slug = base
+        if slug in taken:
+            number = highest.get(base, 1) + 1
+            while base + str(number) in taken:
+                number += 1
+            highest[base] = number
+            slug = base + str(number)
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def allocate_slugs(klass, names, field="slug", chunk_size=100):
+    """Create unique slugs of `klass` for all `names` at once.
+
+    Existing slugs starting with any of the bases are fetched by one query
+    (per `chunk_size` distinct bases) and the suffixes are picked in memory.
+    """
+    bases = [slugify(name) or klass.__name__.lower() for name in names]
+    distinct = sorted(set(bases))
+    taken = set()
+    for i in range(0, len(distinct), chunk_size):
+        prefixes = [Q(**{field + "__startswith": base}) for base in distinct[i:i + chunk_size]]
+        taken.update(klass._default_manager.filter(reduce(operator.or_, prefixes))
+                                           .values_list(field, flat=True))
+    return pick_slugs(bases, taken)
+
+
+def slugify_uniquely(klass, name, field="slug"):
     """Create unique slug for `klass` from `name` by adding numbers if necessary."""
-    original_slug = slugify(name)
-    slug = original_slug
+    return allocate_slugs(klass, [name], field)[0]
+
 
-    if not klass.objects.filter(slug=original_slug).exists():
-        return original_slug
+def save_slugged(instance, save, name, field="slug", klass=None, attempts=3):
+    """Run `save()` of `instance` giving it a unique slug made from `name` if it has none.
 
-    while True:
-        i = random.randint(1, 5000)
-        if klass.objects.filter(slug=slug).exists():
-            slug = original_slug + str(i)
-        else:
-            return slug
+    When a concurrent insert takes the slug meanwhile (unique violation) a new
+    one is allocated and the save is repeated.
+    """
+    if getattr(instance, field):
+        return save()
+    klass = klass or instance.__class__
+    for attempt in range(attempts):
+        slug = slugify_uniquely(klass, name, field)
+        setattr(instance, field, slug)
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            setattr(instance, field, "")
+            if (attempt == attempts - 1 or
+                    not klass._default_manager.filter(**{field: slug}).exists()):
+                raise
+
+
+def bulk_create_slugged(klass, instances, source="name", field="slug", attempts=3):
+    """Insert `instances` with unique slugs made from their `source` attribute.
+
+    The slugs of the whole batch are allocated at once. When a concurrent
+    insert takes some of them meanwhile (unique violation) the batch is
+    allocated and inserted again. Mind that `save()` of the instances is not
+    called where the backend can insert in bulk (see `bulk_create`).
+    """
+    for attempt in range(attempts):
+        slugs = allocate_slugs(klass, [getattr(instance, source) for instance in instances], field)
+        for instance, slug in zip(instances, slugs):
+            setattr(instance, field, slug)
+        try:
+            with transaction.atomic():
+                return bulk_create(klass, instances)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+            for instance in instances:
+                instance.pk = None
 
 
 def upload_to_classname(instance, filename):
@@ -115,6 +200,89 @@ class UidMixin(models.Model):
             super().save(force_update=True, update_fields=['uid', ])
 
 
+def bulk_create(klass, instances):
+    """Insert `instances` at once and make sure they have primary keys.
+
+    Backends which can not return IDs from bulk insert fall back to saving
+    one instance after another.
+    """
+    features = connections[klass.objects.db].features
+    if (getattr(features, "can_return_ids_from_bulk_insert", False) or
+            getattr(features, "can_return_rows_from_bulk_insert", False)):
+        return klass.objects.bulk_create(instances)
+    for instance in instances:
+        instance.save(force_insert=True)
+    return instances
+
+
+def bulk_update(klass, changes):
+    """Write `changes` in form {pk: {field: value}} with a single UPDATE.
+
+    Values are selected per row by CASE WHEN pk = ... so any number of rows
+    costs one statement. Fields missing for some row keep their value.
+    """
+    if not changes:
+        return 0
+    fields = set(field for values in changes.values() for field in values)
+    update = {}
+    for field in fields:
+        update[field] = Case(*[When(pk=pk, then=Value(values[field]))
+                               for pk, values in changes.items() if field in values],
+                             default=models.F(field),
+                             output_field=klass._meta.get_field(field))
+    return klass.objects.filter(pk__in=list(changes)).update(**update)
+
+
+def bulk_increment(klass, field, deltas):
+    """Atomically add `deltas` in form {pk: delta} to `field` with a single UPDATE.
+
+    The new value is computed by the database (``field = field + CASE ...``)
+    so concurrent increments are never lost. No `save()` nor signal is run.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    output_field = klass._meta.get_field(field)
+    delta = Case(*[When(pk=pk, then=Value(value)) for pk, value in deltas.items()],
+                 default=Value(0), output_field=output_field)
+    return klass.objects.filter(pk__in=list(deltas)).update(**{field: models.F(field) + delta})
+
+
+def on_commit_once(flush, values, using=None):
+    """Call `flush(values)` once when the current transaction commits.
+
+    Values passed with the same `flush` during one transaction are collected
+    into one set, so `flush` runs once per transaction for all of them.
+    Outside of a transaction `flush` runs right away.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        flush(set(values))
+        return
+    pending = connection.__dict__.setdefault("market_on_commit_once", {})
+    batch = pending.get(flush)
+    # a rolled back transaction (or savepoint) drops the callback - start over
+    if batch is None or not any(hook[1] is batch[0] for hook in connection.run_on_commit):
+        collected = set()
+
+        def callback():
+            if pending.get(flush, (None, ))[0] is callback:
+                del pending[flush]
+            flush(collected)
+        batch = pending[flush] = (callback, collected)
+        transaction.on_commit(callback, using=using)
+    batch[1].update(values)
+
+
+def assign_uids(instances):
+    """Store UIDs of bulk-created `UidMixin` instances with one UPDATE."""
+    missing = [instance for instance in instances if instance.__dict__.get("uid") is None]
+    for instance in missing:
+        instance.uid = perfect_hash.encode(instance.pk)
+    if missing:
+        bulk_update(type(missing[0]), {instance.pk: {"uid": instance.uid} for instance in missing})
+
+
 phone_re = re.compile(r'^[\+\d\s][\s0-9]{8,22}$')
 phone_validator = RegexValidator(phone_re, _('Enter a valid phone number.'), 'invalid')
 
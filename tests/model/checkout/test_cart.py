@@ -0,0 +1,62 @@
+"""Whitebox tests on model level of cart - grouping and pricing."""
+from decimal import Decimal
+
+from django.test import TestCase
+
+from tests import factories
+from tests.factories import checkout as checkout_factories
+from market.checkout import models
+
+
+class TestCartGrouping(TestCase):
+
+    def setUp(self):
+        self.vendor1 = factories.core.VendorFactory.create()
+        self.vendor2 = factories.core.VendorFactory.create()
+        self.cart = checkout_factories.CartFactory.create()
+        offers = (
+            factories.core.OfferFactory.create(vendor=self.vendor1, unit_price=1, shipping_price=5),
+            factories.core.OfferFactory.create(vendor=self.vendor2, unit_price=10, shipping_price=7),
+            factories.core.OfferFactory.create(vendor=self.vendor2, unit_price=100, shipping_price=3),
+        )
+        for offer in offers:
+            models.CartItem.objects.create(cart=self.cart, item=offer, quantity=2)
+
+    def test_items_by_vendor(self):
+        with self.assertNumQueries(1):
+            groups = self.cart.items_by_vendor()
+
+        self.assertEqual([g['vendor'] for g in groups], [self.vendor1, self.vendor2])
+        self.assertEqual(len(groups[1]['items']), 2)
+        self.assertEqual(groups[0]['subtotal'], Decimal(2))
+        self.assertEqual(groups[1]['subtotal'], Decimal(220))
+        self.assertEqual(groups[0]['shipping'], Decimal(5))
+        self.assertEqual(groups[1]['shipping'], Decimal(7))
+
+    def test_changed_cart_is_not_stale(self):
+        self.cart.update()
+        self.assertEqual(len(self.cart.items_by_vendor()[1]['items']), 2)
+        self.cart.delete_item(self.cart.items.filter(item__vendor=self.vendor2).first().pk)
+        self.assertIsNone(self.cart.updated_items)
+        self.assertEqual(len(self.cart.items_by_vendor()[1]['items']), 1)
+
+    def test_vendors(self):
+        self.assertEqual(sorted(self.cart.vendors), sorted([self.vendor1.pk, self.vendor2.pk]))
+
+
+class TestCartMerge(TestCase):
+
+    def test_merge(self):
+        offer1 = factories.core.OfferFactory.create(unit_price=1)
+        offer2 = factories.core.OfferFactory.create(unit_price=2)
+        user_cart = checkout_factories.CartFactory.create()
+        session_cart = checkout_factories.CartFactory.create(user=None)
+        models.CartItem.objects.create(cart=user_cart, item=offer1, quantity=1)
+        models.CartItem.objects.create(cart=session_cart, item=offer1, quantity=2)
+        models.CartItem.objects.create(cart=session_cart, item=offer2, quantity=5)
+
+        user_cart.merge(session_cart)
+
+        self.assertFalse(models.Cart.objects.filter(pk=session_cart.pk).exists())
+        quantities = dict(user_cart.items.values_list("item", "quantity"))
+        self.assertEqual(quantities, {offer1.pk: 3, offer2.pk: 5})
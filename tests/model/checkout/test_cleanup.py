@@ -0,0 +1,57 @@
+"""Whitebox tests of garbage collection of abandoned carts and orders."""
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from tests import factories
+from tests.factories import checkout as checkout_factories
+from market.checkout import cleanup, models
+
+
+class TestCleanup(TestCase):
+
+    def setUp(self):
+        self.offer = factories.core.OfferFactory.create(unit_price=10)
+        self.old = timezone.now() - timedelta(days=cleanup.CART_EXPIRATION_DAYS + 1)
+
+    def _cart(self, user=None, age=None):
+        cart = checkout_factories.CartFactory.create(user=user)
+        models.CartItem.objects.create(cart=cart, item=self.offer, quantity=1)
+        if age is not None:
+            models.Cart.objects.filter(pk=cart.pk).update(modified=age)
+        return cart
+
+    def test_expired_anonymous_carts(self):
+        expired = self._cart(age=self.old)
+        fresh = self._cart()
+        owned = self._cart(user=factories.core.UserFactory.create(), age=self.old)
+
+        deleted = cleanup.collect_garbage(batch_size=1)
+
+        self.assertEqual(deleted["market.Cart"], 1)
+        self.assertEqual(deleted["market.CartItem"], 1)
+        self.assertFalse(models.Cart.objects.filter(pk=expired.pk).exists())
+        self.assertTrue(models.Cart.objects.filter(pk=fresh.pk).exists())
+        self.assertTrue(models.Cart.objects.filter(pk=owned.pk).exists())
+
+    def test_dry_run(self):
+        expired = self._cart(age=self.old)
+
+        deleted = cleanup.collect_garbage(dry_run=True)
+
+        self.assertEqual(deleted["market.Cart"], 1)
+        self.assertTrue(models.Cart.objects.filter(pk=expired.pk).exists())
+
+    def test_stale_orders(self):
+        stale = models.Order.objects.create(status=models.Order.PROCESSING)
+        suborder = models.Order.objects.create(order=stale, vendor=self.offer.vendor)
+        models.ExtraOrderPriceField.objects.create(order=suborder, label="Shipping", value=1)
+        confirmed = models.Order.objects.create(status=models.Order.CONFIRMED)
+        models.Order.objects.filter(pk__in=(stale.pk, confirmed.pk)).update(modified=self.old)
+
+        deleted = cleanup.collect_garbage()
+
+        self.assertEqual(deleted["market.Order"], 2)
+        self.assertEqual(deleted["market.ExtraOrderPriceField"], 1)
+        self.assertTrue(models.Order.objects.filter(pk=confirmed.pk).exists())
@@ -0,0 +1,54 @@
+"""Content-addressed cache of rendered documents."""
+import os
+import shutil
+import tempfile
+
+from django.test import RequestFactory, TestCase
+
+from tests import factories
+from market.checkout import documents
+
+
+class TestDocumentCache(TestCase):
+    """Any model with `export_attachment` is a document - an Address is used here."""
+
+    def setUp(self):
+        self.root, documents.DOCUMENT_ROOT = documents.DOCUMENT_ROOT, tempfile.mkdtemp()
+        self.document = factories.core.AddressFactory.create()
+        self.renders = 0
+
+        def export_attachment():
+            self.renders += 1
+            return ("document.pdf", b"%PDF-" + str(self.document.pk).encode(), documents.MIMETYPE)
+        self.document.export_attachment = export_attachment
+
+    def tearDown(self):
+        shutil.rmtree(documents.DOCUMENT_ROOT)
+        documents.DOCUMENT_ROOT = self.root
+
+    def test_render_once(self):
+        first = documents.attachment(self.document)
+        self.assertEqual(documents.attachment(self.document), first)
+        self.assertEqual(self.renders, 1)
+
+        self.document.city = self.document.city + "x"
+        self.document.save()
+        documents.attachment(self.document)
+        self.assertEqual(self.renders, 2)
+        # only the render of the current contents is kept
+        self.assertEqual(os.listdir(documents._directory(self.document)),
+                         [documents.fingerprint(self.document)])
+
+    def test_fingerprint_one_query(self):
+        with self.assertNumQueries(1):
+            documents.fingerprint(self.document)
+
+    def test_response_etag(self):
+        request = RequestFactory().get("/")
+        response = documents.response(request, self.document)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content)[:5], b"%PDF-")
+
+        request = RequestFactory().get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(documents.response(request, self.document).status_code, 304)
+        self.assertEqual(self.renders, 1)
@@ -0,0 +1,28 @@
+"""Streaming export of orders."""
+import csv
+import io
+
+from django.test import TestCase
+
+from tests import factories
+from market.checkout import export, models
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.vendor = factories.core.VendorFactory.create()
+        for status in (models.Order.SHIPPED, models.Order.CONFIRMED):
+            order = models.Order.objects.create(vendor=self.vendor, status=status)
+            for i in range(3):
+                models.OrderItem.objects.create(order=order, item_reference=str(i), quantity=1,
+                                                unit_price=1, subtotal=1, total=1)
+
+    def test_csv(self):
+        queryset = export.items(vendor=self.vendor, status=models.Order.SHIPPED)
+        lines = list(export.csv_lines(export.rows(queryset, batch_size=2)))
+        table = list(csv.reader(io.StringIO("".join(lines))))
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table[0][0], "Order")
+        self.assertEqual({row[2] for row in table[1:]}, {"Shipped"})
+        self.assertEqual([row[5] for row in table[1:]], ["0", "1", "2"])
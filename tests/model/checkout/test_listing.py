@@ -0,0 +1,30 @@
+"""Vendor's order listing - grouped counts and keyset pagination."""
+from django.test import TestCase
+
+from tests import factories
+from market.checkout import listing, models
+
+
+class TestListing(TestCase):
+
+    def setUp(self):
+        self.vendor = factories.core.VendorFactory.create()
+        for i in range(5):
+            models.Order.objects.create(vendor=self.vendor, status=models.Order.SHIPPED)
+        models.Order.objects.create(vendor=self.vendor, status=models.Order.CONFIRMED)
+
+    def test_status_counts(self):
+        with self.assertNumQueries(1):
+            counts = listing.status_counts(self.vendor)
+        self.assertEqual(counts, {models.Order.SHIPPED: 5, models.Order.CONFIRMED: 1})
+
+    def test_keyset_pagination(self):
+        seen, cursor = [], None
+        while True:
+            page = listing.page(self.vendor, models.Order.SHIPPED, cursor=cursor, size=2)
+            seen.extend(order.pk for order in page.object_list)
+            cursor = page.cursor
+            if cursor is None:
+                break
+        expected = models.Order.objects.filter(status=models.Order.SHIPPED).order_by("-created", "-pk")
+        self.assertEqual(seen, list(expected.values_list("pk", flat=True)))
@@ -1,9 +1,15 @@
 """Whitebox tests on model level of checkout - mainly order creation and coherency."""
 
+from decimal import Decimal
+
+import mock
+
 from tests import factories
-from market.checkout import models
-from market.core import core_models
-from django.tests import TestCase
+from tests.factories import checkout as checkout_factories
+from market.checkout import costs, models
+from market.core import models as core_models
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 
 
 class TestOrder(TestCase):
@@ -32,3 +38,85 @@ class TestOrder(TestCase):
         self.assertEqual(toporder.subtotal, suborder1.subtotal + suborder2.subtotal)
         self.assertEqual(toporder.total, suborder1.total + suborder2.total)
         all(self.assertEqual(order.status, models.Order.PROCESSING) for order in orders)
+
+
+class TestOrderCreation(TestCase):
+
+    def test_create_from_cart(self):
+        vendors = factories.core.VendorFactory.create_batch(3)
+        cart = checkout_factories.CartFactory.create()
+        for vendor in vendors:
+            for price in (1, 2):
+                offer = factories.core.OfferFactory.create(vendor=vendor, unit_price=price)
+                models.CartItem.objects.create(cart=cart, item=offer, quantity=2)
+
+        toporder = models.Order.objects.create_from_cart(cart, None)
+
+        self.assertEqual(toporder.suborders.count(), 3)
+        self.assertEqual(models.OrderItem.objects.filter(order__order=toporder).count(), 6)
+        for suborder in toporder.suborders.all():
+            self.assertEqual(suborder.subtotal, Decimal(6))
+            self.assertEqual(suborder.orderitems.count(), 2)
+            self.assertEqual(models.Order.objects.get(uid=suborder.uid), suborder)
+        self.assertEqual(toporder.subtotal, Decimal(18))
+        self.assertEqual(models.Order.objects.get(uid=toporder.uid), toporder)
+
+        # costs computed in memory have to be the same as recomputed ones
+        total = toporder.total
+        toporder.update_costs()
+        self.assertEqual(toporder.total, total)
+
+    def test_update_costs(self):
+        toporder = models.Order.objects.create()
+        suborders = [models.Order.objects.create(order=toporder) for i in range(2)]
+        for suborder in suborders:
+            offer = factories.core.OfferFactory.create(unit_price=10)
+            models.OrderItem.objects.create(order=suborder, item=offer, unit_price=10,
+                                            quantity=2, subtotal=20, total=24)
+        models.ExtraOrderPriceField.objects.create(
+            order=suborders[0], label="Shipping", value=5, is_shipping=True)
+
+        toporder.update_costs()
+
+        self.assertEqual(toporder.subtotal, Decimal(40))
+        self.assertEqual(toporder.total, Decimal(53))
+        self.assertEqual(models.Order.objects.get(pk=suborders[0].pk).total, Decimal(29))
+        self.assertEqual(models.Order.objects.get(pk=toporder.pk).total, Decimal(53))
+
+
+class TestDenormalizedTotals(TransactionTestCase):
+    """Totals are recomputed once per transaction - after it commits."""
+
+    def test_denormalized_totals(self):
+        toporder = models.Order.objects.create()
+        suborder = models.Order.objects.create(order=toporder)
+        models.ExtraOrderPriceField.objects.create(
+            order=suborder, label="Shipping", value=5, is_shipping=True)
+        models.OrderPayment.objects.create(order=suborder, amount=7, transaction_id="1",
+                                           payment_method="test")
+
+        toporder = models.Order.objects.get(pk=toporder.pk)
+        self.assertEqual(toporder.shipping_total, Decimal(5))
+        self.assertEqual(toporder.amount_paid, Decimal(7))
+        self.assertEqual(models.Order.objects.get(pk=suborder.pk).amount_paid, Decimal(7))
+
+        models.Order.objects.filter(pk=toporder.pk).update(amount_paid=0)
+        self.assertEqual(list(costs.reconcile()), [toporder.pk])
+        self.assertEqual(list(costs.reconcile(repair=True)), [toporder.pk])
+        self.assertEqual(costs.reconcile(), {})
+
+    def test_recompute_once_per_transaction(self):
+        toporder = models.Order.objects.create()
+        suborder = models.Order.objects.create(order=toporder)
+        with mock.patch.object(costs, "recompute", wraps=costs.recompute) as recompute:
+            with transaction.atomic():
+                for i in range(3):
+                    models.OrderPayment.objects.create(order=suborder, amount=1, transaction_id=str(i),
+                                                       payment_method="test")
+                self.assertEqual(recompute.call_count, 0)
+            self.assertEqual(recompute.call_count, 1)
+
+            with transaction.atomic():
+                toporder.delete()
+            self.assertEqual(recompute.call_count, 1)  # nothing left to recompute
+        self.assertFalse(models.Order.objects.exists())
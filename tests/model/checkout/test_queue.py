@@ -0,0 +1,61 @@
+"""Database-backed task queue - idempotency, retries and the worker loop."""
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from market.checkout import models, queue
+
+calls = []
+
+
+@queue.task
+def remember(value):
+    calls.append(value)
+
+
+@queue.task
+def explode():
+    raise RuntimeError("boom")
+
+
+class TestQueue(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def test_idempotency_key(self):
+        first = queue.enqueue(remember, 1, key="remember:1")
+        second = queue.enqueue(remember, 2, key="remember:1")
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(models.Task.objects.count(), 1)
+
+    def test_work(self):
+        queue.enqueue(remember, 1)
+        queue.enqueue(remember, 2)
+        self.assertEqual(queue.work(concurrency=1, once=True), (2, 0))
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(models.Task.objects.filter(status=models.Task.DONE).count(), 2)
+
+    def test_retry_with_backoff(self):
+        task = queue.enqueue(explode, max_attempts=2)
+        self.assertEqual(queue.work(concurrency=1, once=True), (0, 1))
+        task.refresh_from_db()
+        self.assertEqual(task.status, models.Task.PENDING)
+        self.assertEqual(task.attempts, 1)
+        self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=queue.BACKOFF - 5))
+        self.assertIn("boom", task.error)
+
+        models.Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        queue.work(concurrency=1, once=True)
+        task.refresh_from_db()
+        self.assertEqual(task.status, models.Task.FAILED)
+
+    def test_release_stale(self):
+        task = queue.enqueue(remember, 1)
+        self.assertEqual(len(queue.claim(10)), 1)
+        self.assertEqual(queue.claim(10), [])
+        later = timezone.now() + timedelta(seconds=queue.LOCK_TIMEOUT + 1)
+        self.assertEqual(queue.release_stale(later), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, models.Task.PENDING)
@@ -0,0 +1,143 @@
+"""Stock reservations - correctness and behaviour under concurrent checkouts."""
+import threading
+
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+
+from tests import factories
+from market.checkout import models, reservations
+from market.core.models import Offer, Vendor
+
+
+class TestReservations(TestCase):
+
+    def setUp(self):
+        self.offer = factories.core.OfferFactory.create(quantity=5)
+        self.order = models.Order.objects.create()
+
+    def quantity(self):
+        return Offer.objects.get(pk=self.offer.pk).quantity
+
+    def test_reserve_and_release(self):
+        reservations.reserve(self.order, {self.offer: 3})
+        self.assertEqual(self.quantity(), 2)
+        with self.assertRaises(reservations.SoldOut):
+            reservations.reserve(models.Order.objects.create(), {self.offer: 3})
+        self.assertEqual(self.quantity(), 2)
+
+        reservations.release(self.order)
+        self.assertEqual(self.quantity(), 5)
+        self.assertFalse(models.Reservation.objects.exists())
+
+    def test_commit(self):
+        reservations.reserve(self.order, {self.offer: 3})
+        reservations.commit(self.order)
+        self.assertEqual(reservations.release(self.order), 0)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_expiration(self):
+        reservations.reserve(self.order, {self.offer: 3})
+        self.assertEqual(reservations.release_expired(), 0)
+        later = timezone.now() + timedelta(seconds=reservations.TTL + 1)
+        self.assertEqual(reservations.release_expired(later), 1)
+        self.assertEqual(self.quantity(), 5)
+
+    def test_sold_out_counters(self):
+        """Offers sold out by reservations leave vendor's counters until restocked."""
+        def counted():
+            return Vendor.objects.values_list("offer_count", flat=True).get(pk=self.offer.vendor_id)
+
+        self.assertEqual(counted(), 1)
+        reservations.reserve(self.order, {self.offer: 3})
+        self.assertEqual(counted(), 1)
+        other = models.Order.objects.create()
+        reservations.reserve(other, {self.offer: 2})
+        self.assertEqual(counted(), 0)
+        reservations.release(other)
+        self.assertEqual(counted(), 1)
+        reservations.release(self.order)
+        self.assertEqual(counted(), 1)
+
+    def _order_with_item(self, quantity):
+        suborder = models.Order.objects.create(order=self.order, vendor=self.offer.vendor)
+        models.OrderItem.objects.create(order=suborder, item=self.offer, item_reference="x",
+                                        quantity=quantity, unit_price=1, subtotal=quantity,
+                                        total=quantity)
+
+    def test_confirm_after_expiration(self):
+        """Stock of an expired reservation is reserved again on confirmation."""
+        self._order_with_item(3)
+        reservations.reserve(self.order, {self.offer: 3})
+        reservations.release_expired(timezone.now() + timedelta(seconds=reservations.TTL + 1))
+        self.assertEqual(self.quantity(), 5)
+        self.order.mark_as_confirmed()
+        self.assertEqual(self.quantity(), 2)
+        self.assertFalse(models.Reservation.objects.exists())
+
+    def test_confirm_sold_out_after_expiration(self):
+        """Confirmation fails when the stock of an expired reservation was sold meanwhile."""
+        self._order_with_item(3)
+        reservations.reserve(self.order, {self.offer: 3})
+        reservations.release_expired(timezone.now() + timedelta(seconds=reservations.TTL + 1))
+        reservations.reserve(models.Order.objects.create(), {self.offer: 4})
+        with self.assertRaises(reservations.SoldOut):
+            self.order.mark_as_confirmed()
+        self.assertEqual(models.Order.objects.get(pk=self.order.pk).status, models.Order.PROCESSING)
+        self.assertEqual(self.quantity(), 1)
+
+    def test_unlimited(self):
+        offer = factories.core.OfferFactory.create(quantity=-1)
+        self.assertEqual(reservations.reserve(self.order, {offer: 1000}), [])
+        self.assertEqual(Offer.objects.get(pk=offer.pk).quantity, -1)
+
+
+class TestCancelReservations(TransactionTestCase):
+    """Stock of a canceled order is released once the cancellation commits."""
+
+    def test_cancel(self):
+        offer = factories.core.OfferFactory.create(quantity=5)
+        order = models.Order.objects.create()
+        reservations.reserve(order, {offer: 3})
+        self.assertEqual(Offer.objects.get(pk=offer.pk).quantity, 2)
+
+        order.mark_as_canceled()
+        self.assertEqual(models.Order.objects.get(pk=order.pk).status, models.Order.CANCELED)
+        self.assertEqual(Offer.objects.get(pk=offer.pk).quantity, 5)
+        self.assertFalse(models.Reservation.objects.exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class TestConcurrentReservations(TransactionTestCase):
+    """Hammer one offer from many threads - it must never be oversold."""
+
+    threads = 20
+    stock = 7
+
+    def test_no_overselling(self):
+        offer = factories.core.OfferFactory.create(quantity=self.stock)
+        orders = [models.Order.objects.create() for i in range(self.threads)]
+        results = []
+        barrier = threading.Barrier(self.threads)
+
+        def buy(order):
+            try:
+                barrier.wait()
+                reservations.reserve(order, {offer: 1})
+                results.append(True)
+            except reservations.SoldOut:
+                results.append(False)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=buy, args=(order, )) for order in orders]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(results.count(True), self.stock)
+        self.assertEqual(Offer.objects.get(pk=offer.pk).quantity, 0)
+        self.assertEqual(models.Reservation.objects.count(), self.stock)
@@ -0,0 +1,26 @@
+"""Background tasks of orders."""
+from django.test import TestCase
+
+from tests import factories
+from market.checkout import models, tasks
+from market.core import models as core_models
+
+
+class TestRecordSales(TestCase):
+
+    def test_record_sales(self):
+        product = factories.core.ProductFactory.create()
+        offer1 = factories.core.OfferFactory.create(product=product)
+        offer2 = factories.core.OfferFactory.create(product=product)
+        order = models.Order.objects.create()
+        for offer, quantity in ((offer1, 2), (offer1, 3), (offer2, 4)):
+            models.OrderItem.objects.create(order=order, item=offer, quantity=quantity,
+                                            unit_price=1, subtotal=quantity, total=quantity)
+
+        offers, products = tasks.record_sales([order.pk])
+
+        self.assertEqual(offers, {offer1.pk: 5, offer2.pk: 4})
+
+        self.assertEqual(core_models.Offer.objects.get(pk=offer1.pk).sold, 5)
+        self.assertEqual(core_models.Offer.objects.get(pk=offer2.pk).sold, 4)
+        self.assertEqual(core_models.Product.objects.get(pk=product.pk).sold, 9)
@@ -0,0 +1,76 @@
+"""Batched status transitions of orders."""
+from django.test import TestCase, TransactionTestCase
+
+from tests import factories
+from market.checkout import models, signals, transitions
+
+
+def create_order(suborders=2):
+    top = models.Order.objects.create()
+    for i in range(suborders):
+        models.Order.objects.create(order=top, vendor=factories.core.VendorFactory.create())
+    return top
+
+
+class TestTransitions(TestCase):
+
+    def test_transition_moves_suborders(self):
+        tops = [create_order(), create_order()]
+        models.Order.objects.filter(order=tops[0]).update(status=models.Order.SHIPPED)
+
+        # SAVEPOINT, SELECT orders FOR UPDATE, securing stock of the confirmed tops
+        # (SAVEPOINT, SELECT reservations, SELECT order items, DELETE reservations,
+        # RELEASE), UPDATE, INSERT transitions, RELEASE
+        with self.assertNumQueries(10):
+            moved = transitions.transition(tops, models.Order.CONFIRMED)
+
+        self.assertEqual(len(moved), 4)  # two tops and suborders of the second one
+        self.assertEqual(tops[0].status, models.Order.CONFIRMED)
+        self.assertEqual(set(models.Order.objects.filter(order=tops[0]).values_list("status", flat=True)),
+                         {models.Order.SHIPPED})
+        self.assertEqual(models.OrderTransition.objects.filter(new_status=models.Order.CONFIRMED).count(), 4)
+
+    def test_unconfirmed_keeps_confirmed(self):
+        order = create_order(1)
+        order.mark_as_confirmed()
+        order.mark_as_unconfirmed()
+        self.assertEqual(models.Order.objects.get(pk=order.pk).status, models.Order.CONFIRMED)
+
+    def test_mark_in_memory(self):
+        order = create_order(2)
+        received = []
+
+        def receiver(sender, order, **kwargs):
+            received.append(order.pk)
+
+        signals.order_shipped.connect(receiver)
+        try:
+            order.mark_as(models.Order.SHIPPED, save=False)
+        finally:
+            signals.order_shipped.disconnect(receiver)
+        self.assertEqual(len(received), 3)  # the order and both suborders
+        self.assertEqual(models.Order.objects.get(pk=order.pk).status, models.Order.PROCESSING)
+
+    def test_closed_orders(self):
+        order = create_order(0)
+        order.mark_as_canceled()
+        with self.assertRaises(ValueError):
+            transitions.transition([order], models.Order.SHIPPED)
+        self.assertEqual(transitions.transition([order], models.Order.CANCELED), [])
+
+
+class TestTransitionSignals(TransactionTestCase):
+
+    def test_signals_after_commit(self):
+        orders = [create_order(1) for i in range(3)]
+        received = []
+
+        def receiver(sender, orders, status, **kwargs):
+            received.append((len(orders), status))
+
+        signals.orders_transitioned.connect(receiver)
+        try:
+            transitions.transition(orders, models.Order.UNCONFIRMED)
+        finally:
+            signals.orders_transitioned.disconnect(receiver)
+        self.assertEqual(received, [(6, models.Order.UNCONFIRMED)])
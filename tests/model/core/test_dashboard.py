@@ -0,0 +1,37 @@
+"""Vendor's dashboard data - aggregates and cache invalidation."""
+from django.core.cache import cache
+from django.test import TestCase
+
+from tests import factories
+from market.checkout import models as checkout_models
+from market.core import dashboard
+
+
+class TestDashboard(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = factories.core.VendorFactory.create()
+        for status in (checkout_models.Order.PROCESSING, checkout_models.Order.CONFIRMED,
+                       checkout_models.Order.CONFIRMED, checkout_models.Order.SHIPPED):
+            checkout_models.Order.objects.create(vendor=self.vendor, status=status)
+        factories.core.OfferFactory.create(vendor=self.vendor, active=True)
+        factories.core.OfferFactory.create(vendor=self.vendor, active=False)
+
+    def test_counts(self):
+        with self.assertNumQueries(1):
+            counts = dashboard.order_counts(self.vendor)
+        self.assertEqual(counts, {"confirming": 1, "confirmed": 2, "completed": 0,
+                                  "shipped": 1, "all": 4})
+        with self.assertNumQueries(1):
+            self.assertEqual(dashboard.offer_counts(self.vendor), {"active": 1, "deleted": 1})
+
+    def test_cache_invalidation(self):
+        dashboard.get(self.vendor)
+        with self.assertNumQueries(0):
+            dashboard.get(self.vendor)
+
+        factories.core.OfferFactory.create(vendor=self.vendor, active=True)
+        data = dashboard.get(self.vendor)
+        self.assertEqual(data["offers_count"], 2)
+        self.assertEqual(data["offers_counts"]["active"], 2)
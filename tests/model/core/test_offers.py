@@ -1,6 +1,7 @@
 # coding: utf-8
 import random
 from django import test
+from market.core import counters
 from market.core.models import User, Vendor, Offer, Product, Address, BankAccount, Category
 
 from . import load as load_core
@@ -55,3 +56,73 @@ class TestOffer(test.TestCase):
         self.assertEqual(vendor.product_set.count(), 1)  # the product has to stay this time
         o2.delete()
         self.assertEqual(vendor.product_set.count(), 0)  # the product has to be deleted as well
+
+    def test_vendor_close(self):
+        """Closing a vendor deactivates their offers and products nobody else offers."""
+        vendor = Vendor.objects.create(
+            user=self.user, bank_account=self.bank_account, address=self.address,
+            name="Hello Vendor", motto="Greetings everyone", active=True,
+            category=random.choice(Category.objects.all()))
+        other = Vendor.objects.create(
+            user=User.objects.create_user(email="obchodnik@druhy.cz", password="hello"),
+            bank_account=BankAccount.objects.create(number=12345678, bank=5388),
+            address=Address.objects.create(street="Stara 321", city="Krno", name="Druhy"),
+            name="Other Vendor", motto="Hi", active=True,
+            category=random.choice(Category.objects.all()))
+        own, o = create_offer(vendor)
+        shared, o = create_offer(vendor)
+        create_offer(other, shared)
+
+        vendor.close()
+        self.assertFalse(vendor.offer_set.filter(active=True).exists())
+        self.assertFalse(Product.objects.get(pk=own.pk).active)
+        self.assertTrue(Product.objects.get(pk=shared.pk).active)
+        self.assertFalse(Vendor.objects.get(pk=vendor.pk).active)
+        self.assertEqual(Vendor.objects.get(pk=vendor.pk).offer_count, 0)
+
+    def test_vendor_counters(self):
+        """Counts and values of active offers follow every change of offers."""
+        vendor = Vendor.objects.create(
+            user=self.user, bank_account=self.bank_account, address=self.address,
+            name="Hello Vendor", motto="Greetings everyone",
+            category=random.choice(Category.objects.all()))
+
+        def counted():
+            fresh = Vendor.objects.get(pk=vendor.pk)
+            return fresh.offer_count, fresh.offer_total
+
+        p1, o1 = create_offer(vendor, price=100)
+        p2, o2 = create_offer(vendor, price=200)
+        self.assertEqual(counted(), (2, 300))
+        o1 = Offer.objects.get(pk=o1.pk)
+        o1.unit_price = 150
+        o1.save()
+        self.assertEqual(counted(), (2, 350))
+        o2.hide()
+        self.assertEqual(counted(), (1, 150))
+        o2.activate()
+        self.assertEqual(counted(), (2, 350))
+        o2.remove()
+        self.assertEqual(counted(), (1, 150))
+        # sold out offers are not counted
+        o1 = Offer.objects.get(pk=o1.pk)
+        o1.quantity = 0
+        o1.save()
+        self.assertEqual(counted(), (0, 0))
+        o1.quantity = 3
+        o1.save()
+        self.assertEqual(counted(), (1, 150))
+        Offer.objects.get(pk=o1.pk).delete()
+        self.assertEqual(counted(), (0, 0))
+        # saving the vendor never overwrites counters from memory
+        create_offer(vendor, price=50)
+        vendor.save()
+        self.assertEqual(counted(), (1, 50))
+
+        # drift made by bulk updates is found and repaired
+        Offer.objects.filter(vendor=vendor).update(unit_price=70)
+        self.assertEqual(counters.reconcile().get(vendor.pk), {"offer_count": 1, "offer_total": 70})
+        self.assertEqual(counted(), (1, 50))
+        counters.reconcile(repair=True)
+        self.assertEqual(counted(), (1, 70))
+        self.assertNotIn(vendor.pk, counters.reconcile())
@@ -0,0 +1,69 @@
+# coding: utf-8
+"""Allocation of unique slugs - one by one and for whole batches."""
+import mock
+
+from django.test import TestCase
+
+from tests import factories
+from market.core.models import Product
+from market.utils import models as utils
+
+
+class TestSlugs(TestCase):
+
+    def setUp(self):
+        self.category = factories.core.CategoryFactory.create()
+        self.vendor = factories.core.VendorFactory.create()
+
+    def product(self, name):
+        return Product(name=name, vendor=self.vendor, category=self.category, description="")
+
+    def test_slugify_uniquely(self):
+        for i in range(3):
+            self.product("Med").save()
+        self.assertEqual(sorted(Product.objects.filter(name="Med").values_list("slug", flat=True)),
+                         ["med", "med2", "med3"])
+        with self.assertNumQueries(1):
+            self.assertEqual(utils.slugify_uniquely(Product, "Med"), "med4")
+
+    def test_batch(self):
+        self.product("Med").save()
+        names = ["Med", "Vejce", "Med", "Vejce", "Mléko"]
+        with self.assertNumQueries(1):
+            slugs = utils.allocate_slugs(Product, names)
+        self.assertEqual(slugs, ["med2", "vejce", "med3", "vejce2", "mleko"])
+
+    def test_bulk_create_retries(self):
+        """Slugs taken by a concurrent insert are allocated again."""
+        self.product("Med").save()
+        allocate, calls = utils.allocate_slugs, []
+
+        def allocate_slugs(klass, names, field="slug"):
+            calls.append(names)
+            if len(calls) == 1:
+                return ["med", "med2"]  # "med" got taken before the insert
+            return allocate(klass, names, field)
+
+        with mock.patch.object(utils, "allocate_slugs", allocate_slugs):
+            created = utils.bulk_create_slugged(Product, [self.product("Med"), self.product("Med")])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([product.slug for product in created], ["med2", "med3"])
+        self.assertEqual(Product.objects.filter(name="Med").count(), 3)
+
+    def test_save_retries(self):
+        """A slug taken by a concurrent insert is allocated again on save."""
+        self.product("Med").save()
+        slugify, calls = utils.slugify_uniquely, []
+
+        def slugify_uniquely(klass, name, field="slug"):
+            calls.append(name)
+            if len(calls) == 1:
+                return "med"  # "med" got taken before the insert
+            return slugify(klass, name, field)
+
+        with mock.patch.object(utils, "slugify_uniquely", slugify_uniquely):
+            product = self.product("Med")
+            product.save()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(product.slug, "med2")
+        self.assertEqual(Product.objects.filter(name="Med").count(), 2)
@@ -4,14 +4,15 @@ from __future__ import absolute_import
 import random
 import logging
 from decimal import Decimal
-from datetime import timedelta
+from datetime import datetime, timedelta
 from monthdelta import monthdelta
 
 from django import test
 from django.core import mail
 from django.utils import timezone
 from market.core.models import User, Vendor, Address, BankAccount, Category  # Offer, Product
-from market.tariff.models import Statistics, Billing, Tariff, Discount
+from market.tariff import billing as billing_runner, forecast, statistics
+from market.tariff.models import Statistics, Billing, BillingRun, Bill, Tariff, Discount
 
 from ..core import load as load_core
 from . import load as load_tariff
@@ -130,6 +131,106 @@ class TestBilling(test.TestCase):
         # billing period of 90 days started 110 days ago
         self.assertEquals(bill.date_issuance, timezone.now().date())
 
+    def test_preloaded_history(self):
+        """Slicing the preloaded history gives the same items as querying each month."""
+        vendor, billing, stat = self._create_vendor_and_stats()
+        for days, tariff in ((10, Decimal("2.5")), (40, Decimal("1.15"))):
+            change = Statistics(vendor=vendor, quantity=days, price=5,
+                                tariff=Tariff.objects.filter(daily=tariff).first())
+            change.save()
+            change.created = timezone.now() - timedelta(days=days)
+            change.save()
+        start = timezone.now() - monthdelta(billing.period + 1)
+        end = timezone.now()
+        history = Statistics.objects.history(vendor, start, end)
+        for month in range(billing.period + 1):
+            month_start, month_end = start + monthdelta(month), start + monthdelta(month + 1)
+            self.assertEqual(Statistics.objects.bill(vendor, month_start, month_end, history),
+                             Statistics.objects.bill(vendor, month_start, month_end))
+
+    def test_compacted_statistics(self):
+        """Billing replayed over compacted history is identical to the original one."""
+        vendor, billing, stat = self._create_vendor_and_stats()
+        tariffs = list(Tariff.objects.filter(daily__in=(Decimal("1.15"), Decimal("2.5"), Decimal("70"))))
+        rnd = random.Random(46)
+        moment = stat.created
+        while moment < timezone.now() - timedelta(days=1):
+            # bursts of changes within a day, mostly keeping the tariff
+            moment += timedelta(hours=rnd.choice((1, 3, 7, 30)))
+            change = Statistics(vendor=vendor, quantity=rnd.randint(0, 100), price=5,
+                                tariff=rnd.choice(tariffs) if rnd.random() < 0.2 else stat.tariff)
+            change.save()
+            change.created = moment
+            change.save()
+            stat = change
+        count = Statistics.objects.filter(vendor=vendor).count()
+        current = Statistics.objects.current(vendor)
+        segments = billing.segments()
+        replay = [Statistics.objects.bill(vendor, start, end) for start, end in segments]
+
+        self.assertGreater(statistics.compact([vendor.pk], before=timezone.now()), 0)
+        self.assertLess(Statistics.objects.filter(vendor=vendor).count(), count)
+        self.assertEqual([Statistics.objects.bill(vendor, start, end) for start, end in segments],
+                         replay)
+        # the merged record keeps the most recent numbers
+        self.assertEqual(Statistics.objects.current(vendor), current)
+        # compaction is idempotent
+        self.assertEqual(statistics.compact([vendor.pk], before=timezone.now()), 0)
+
+    def test_compaction_keeps_bills(self):
+        """Bills of any whole-day window stay the same over many random compacted histories."""
+        vendor = Vendor(name="Hello Vendor")
+        tariffs = list(Tariff.objects.filter(daily__in=(Decimal("1.15"), Decimal("2.5"), Decimal("70"))))
+        rnd = random.Random(46)
+        origin = datetime(2017, 3, 1)
+        for i in range(1000):
+            moment, history = origin + timedelta(hours=rnd.randint(0, 23)), []
+            choices = tariffs[:rnd.randint(1, len(tariffs))]
+            for pk in range(rnd.randint(1, 30)):
+                history.append(Statistics(pk=pk, vendor=vendor, created=moment,
+                                          tariff=rnd.choice(choices)))
+                # bursts of changes within a day as well as changes days apart
+                moment += timedelta(hours=rnd.choice((0, 1, 3, 7, 20, 30, 50)),
+                                    minutes=rnd.randint(0, 59))
+            heads, deleted = statistics.redundant((stat.pk, stat.tariff_id, stat.created,
+                                                   stat.quantity, stat.price) for stat in history)
+            compacted = [stat for stat in history if stat.pk not in deleted]
+            for j in range(20):
+                start = origin + timedelta(days=rnd.randint(1, 40))
+                end = start + timedelta(days=rnd.randint(1, 10))
+                if start < history[0].created:
+                    continue  # no statistics before the window
+                self.assertEqual(Statistics.objects.bill(vendor, start, end, compacted),
+                                 Statistics.objects.bill(vendor, start, end, history))
+
+    def test_billing_run(self):
+        """The runner bills a due vendor exactly once and records the run."""
+        vendor, billing, stat = self._create_vendor_and_stats()
+        stats = billing_runner.run(workers=1)
+        self.assertGreaterEqual(stats["billed"], 1)
+        run = BillingRun.objects.get(billing=billing)
+        self.assertEqual(run.status, BillingRun.DONE)
+        self.assertEqual(run.bill.vendor, vendor)
+        # a repeated run finds nothing due
+        self.assertEqual(billing_runner.run(workers=1)["billed"], 0)
+        self.assertEqual(Bill.objects.filter(vendor=vendor).count(), 1)
+
+    def test_forecast(self):
+        """The forecast projects the very bill the vendor gets and writes nothing."""
+        vendor, billing, stat = self._create_vendor_and_stats()
+        Discount.objects.create(vendor=vendor, name="Half", percent=50, usages=1)
+        bills, stats = forecast.run()
+        projected = [bill for bill in bills if bill["vendor"] == vendor.pk]
+        self.assertEqual(len(projected), 1)
+        self.assertTrue(projected[0]["due"])
+        self.assertLess(projected[0]["discount"], 0)
+        self.assertEqual(Discount.objects.get(vendor=vendor).usages, 1)
+        self.assertFalse(Bill.objects.filter(vendor=vendor).exists())
+
+        bill = billing.bill(send=False)
+        self.assertEqual(projected[0]["total"], bill.total)
+        self.assertEqual(projected[0]["period_end"], bill.period_end)
+
     def test_vendor_closing(self):
         """Test closing a billing."""
         mail.outbox = []
@@ -0,0 +1,98 @@
+# coding: utf-8
+"""Redemption of discounts and campaigns - alone and under concurrent use."""
+import threading
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+
+from tests import factories
+from market.tariff.models import Campaign, Discount
+
+from ..tariff import load as load_tariff
+
+
+class TestRedemption(TestCase):
+
+    def setUp(self):
+        load_tariff()
+        self.vendor = factories.core.VendorFactory.create()
+
+    def test_discount_use(self):
+        discount = Discount.objects.create(vendor=self.vendor, name="Half", percent=50, usages=1)
+        self.assertEqual(discount.use(Decimal("100")), ("Half", Decimal("-50"), settings.TAX))
+        self.assertEqual(discount.usages, 0)
+        self.assertIsNone(discount.use(Decimal("100")))
+        self.assertEqual(Discount.objects.get(pk=discount.pk).usages, 0)
+
+    def test_campaign_use(self):
+        discount = Discount.objects.create(name="Free", percent=100, usages=3)
+        campaign = Campaign.objects.create(code="FREE", expiration=timezone.now() + timedelta(days=1),
+                                           usages=5, discount=discount)
+        campaign.use(self.vendor)
+        self.assertEqual(campaign.usages, 4)
+        self.assertTrue(Discount.objects.filter(vendor=self.vendor, usages=3).exists())
+        # the second redemption is refused and takes no usage
+        self.assertRaises(ValueError, campaign.use, self.vendor)
+        self.assertEqual(Campaign.objects.get(pk=campaign.pk).usages, 4)
+        self.assertEqual(Discount.objects.filter(vendor=self.vendor).count(), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class TestConcurrentRedemption(TransactionTestCase):
+    """Redeem one discount and one campaign from many threads - never more than allowed."""
+
+    threads = 20
+    usages = 7
+
+    def setUp(self):
+        load_tariff()
+
+    def _hammer(self, func, args):
+        results = []
+        barrier = threading.Barrier(self.threads)
+
+        def redeem(arg):
+            try:
+                barrier.wait()
+                results.append(func(arg))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=redeem, args=(arg, )) for arg in args]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_discount_not_overused(self):
+        discount = Discount.objects.create(vendor=factories.core.VendorFactory.create(),
+                                           name="Half", percent=50, usages=self.usages)
+        results = self._hammer(lambda total: Discount.objects.get(pk=discount.pk).use(total),
+                               [Decimal("100")] * self.threads)
+        self.assertEqual(sum(1 for result in results if result is not None), self.usages)
+        self.assertEqual(Discount.objects.get(pk=discount.pk).usages, 0)
+
+    def test_campaign_not_overused(self):
+        vendors = [factories.core.VendorFactory.create() for i in range(self.threads)]
+        campaign = Campaign.objects.create(
+            code="HALF", expiration=timezone.now() + timedelta(days=1), usages=self.usages,
+            discount=Discount.objects.create(name="Half", percent=50, usages=1))
+
+        def use(vendor):
+            try:
+                Campaign.objects.get(pk=campaign.pk).use(vendor)
+                return True
+            except ValueError:
+                return False
+
+        results = self._hammer(use, vendors)
+        self.assertEqual(results.count(True), self.usages)
+        self.assertEqual(Campaign.objects.get(pk=campaign.pk).usages, 0)
+        self.assertEqual(Campaign.objects.get(pk=campaign.pk).vendors.count(), self.usages)
+        self.assertEqual(Discount.objects.filter(vendor__in=vendors).count(), self.usages)
@@ -7,7 +7,9 @@ import logging
 
 from django import test
 from django.core import mail
+from django.db import transaction
 from market.core.models import User, Vendor, Offer, Product, Address, BankAccount, Category
+from market.tariff import index as tariff_index, statistics
 from market.tariff.models import Billing, Statistics, Tariff  # Bill, Discount
 
 from ..core import load as load_core
@@ -45,8 +47,11 @@ def print_bill(bill):
     logger.debug("")
 
 
-class TestTariffSwitching(test.TestCase):
-    """Test tariff behaviour when adding/removing Offers."""
+class TestTariffSwitching(test.TransactionTestCase):
+    """Test tariff behaviour when adding/removing Offers.
+
+    Statistics are refreshed when transactions commit so transactions are real here.
+    """
 
     def setUp(self):
         """Create default owner of a vendor."""
@@ -144,3 +149,59 @@ class TestTariffSwitching(test.TestCase):
             # check we send the new price in the email
             self.assertIn(str(stat.tariff.monthly), mail.outbox[0].body)
             mail.outbox = []
+
+    def test_coalesced_statistics(self):
+        """Offers changed inside `coalesce` produce one Statistics record per vendor."""
+        vendor = Vendor.objects.create(
+            user=self.user, bank_account=self.bank_account, address=self.address,
+            name="Hello Vendor", motto="Greetings everyone",
+            category=random.choice(Category.objects.all()))
+        qs = Statistics.objects.filter(vendor=vendor)
+        count = qs.count()
+        with statistics.coalesce():
+            for i in range(10):
+                create_offer(vendor, price=1)
+            self.assertEqual(qs.count(), count)
+        self.assertEqual(qs.count(), count + 1)
+        self.assertEqual(qs.latest("created").quantity, 10)
+
+    def test_statistics_on_commit(self):
+        """Offers changed in one transaction produce one Statistics record per vendor."""
+        vendor = Vendor.objects.create(
+            user=self.user, bank_account=self.bank_account, address=self.address,
+            name="Hello Vendor", motto="Greetings everyone",
+            category=random.choice(Category.objects.all()))
+        qs = Statistics.objects.filter(vendor=vendor)
+        count = qs.count()
+        with transaction.atomic():
+            for i in range(10):
+                create_offer(vendor, price=1)
+            self.assertEqual(qs.count(), count)
+        self.assertEqual(qs.count(), count + 1)
+        self.assertEqual(qs.latest("created").quantity, 10)
+
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            create_offer(vendor, price=1)
+            1 / 0
+        with transaction.atomic():
+            create_offer(vendor, price=1)
+        self.assertEqual(qs.count(), count + 2)
+        self.assertEqual(qs.latest("created").quantity, 11)
+
+    def test_tariff_index(self):
+        """The index picks the same tariff as the database query."""
+        tariff_index.get()
+        for quantity in (0, 1, 10, 50, 100, 1000):
+            for price in (0, 100, 10000):
+                expected = (Tariff.objects.filter(active=True, quantity__gte=quantity, price__gte=price)
+                                          .order_by("daily", "pk").first())
+                with self.assertNumQueries(0):
+                    if expected is None:
+                        self.assertRaises(IndexError, tariff_index.lookup, quantity, price)
+                    else:
+                        self.assertEqual(tariff_index.lookup(quantity, price), expected)
+
+        cheapest = Tariff.objects.filter(active=True).order_by("daily", "pk").first()
+        cheapest.active = False
+        cheapest.save()
+        self.assertNotIn(cheapest, tariff_index.get().tariffs)
@@ -20,3 +20,46 @@ class SimpleTest(SimpleTestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class FakeLine(object):
+    """Minimal stand-in for a CartItem."""
+
+    def __init__(self):
+        self.labels = []
+
+    def add_modifier(self, label, value):
+        self.labels.append(label)
+
+
+@mock.patch("django.db.backends.utils.CursorWrapper", cursor_wrapper)
+class TestModifierRegistry(SimpleTestCase):
+
+    def test_order_and_batching(self):
+        from market.checkout import modifiers
+
+        class PerItem(modifiers.Modifier):
+            def process_item(self, cart_item, request):
+                cart_item.add_modifier("per-item", 1)
+
+        class Batch(modifiers.Modifier):
+            def process_items(self, cart, items, request):
+                for item in items:
+                    item.add_modifier("batch", 1)
+
+        registry = modifiers.ModifierRegistry(profile=True)
+        registry.register(PerItem, order=20)
+        registry.register(Batch, order=10)
+        pipeline = registry.compile()
+
+        self.assertEqual(len(pipeline.pre), 0)
+        self.assertEqual(len(pipeline.items), 2)
+        lines = [FakeLine(), FakeLine()]
+        for modifier in pipeline.items:
+            modifier(None, lines, None)
+        self.assertEqual(lines[0].labels, ["batch", "per-item"])
+        self.assertEqual([row[:2] for row in sorted(registry.report())],
+                         [("Batch", 1), ("PerItem", 1)])
+
+        registry.unregister(Batch)
+        self.assertEqual(len(registry.pipeline.items), 1)
@@ -1,7 +1,7 @@
 from decimal import Decimal
 from django.core import mail
 from django.shortcuts import reverse
-from django_webtest import WebTest
+from django_webtest import TransactionWebTest
 from monthdelta import monthdelta
 from market.tariff import models
 from market.core import models as core_models
@@ -29,8 +29,8 @@ def field_in_form(fieldname, forms):
     )
 
 
-class TestCampaigns(WebTest):
-    """Test right changing of tariffs."""
+class TestCampaigns(TransactionWebTest):
+    """Test right changing of tariffs (statistics are refreshed on commit)."""
 
     def test_promo_code(self):
         """New vendor has to have zero-tariff assigned and progress with price/products."""